@@ -3,29 +3,393 @@
 #include <string.h> /*string*/
 #include <ctype.h>  /*string assertion*/
 #include "db.h"     /*database API*/
+#include "metrics.h" /*stage timers*/
+#include "analyzer.h" /*tokenizer API*/
 
-int tokenize_with_id(char *intext, int text_id)
+static int utf8_length(const char *token, size_t len)
+{
+    /*count characters the way SQLite LENGTH() does, skipping continuation bytes*/
+    int chars = 0;
+    for (size_t i = 0; i < len; i++) {
+        if (((unsigned char)token[i] & 0xC0) != 0x80) {
+            chars++;
+        }
+    }
+    return chars;
+}
+
+static int hist_add(length_hist *h, int chars, long long n)
+{
+    if (chars >= h->size) {
+        int new_size = chars * 2 + 1;
+        long long *grown = realloc(h->counts, new_size * sizeof(long long));
+        if (grown == NULL) {
+            return -1;
+        }
+        memset(grown + h->size, 0, (new_size - h->size) * sizeof(long long));
+        h->counts = grown;
+        h->size = new_size;
+    }
+    h->counts[chars] += n;
+
+    if (h->total == 0 || chars > h->max_len) h->max_len = chars;
+    if (h->total == 0 || chars < h->min_len) h->min_len = chars;
+    h->total += n;
+    h->total_len += chars * n;
+    return 0;
+}/*count n tokens of the given length*/
+
+static int save_lengths(int text_id, const length_hist *h, int append)
+{
+    for (int len = 0; len < h->size; len++) {
+        if (h->counts[len] > 0 && db_insert_length_count(text_id, len, h->counts[len]) < 0) {
+            return -1;
+        }
+    }
+    if (append) {
+        return db_refresh_stats(text_id); /*the histogram now holds the whole text*/
+    }
+    int avg_len = h->total > 0 ? (int)((h->total_len + h->total / 2) / h->total) : 0;
+    return db_insert_stats(text_id, h->total, avg_len, h->max_len, h->min_len);
+}/*write the length histogram and stats row of a text, or add to them*/
+
+static int save_aggregates(int text_id, const counter *freq, length_hist *lengths, int append)
+{
+    size_t iter = 0;
+    counter_entry *e;
+
+    while ((e = counter_next(freq, &iter)) != NULL) {
+        int rc = append
+            ? db_add_token_freq(text_id, e->token, e->count)
+            : db_insert_token_freq(text_id, e->token, e->count);
+        if (rc < 0) {
+            return -1;
+        }
+        if (hist_add(lengths, utf8_length(e->token, e->len), e->count) < 0) {
+            return -1;
+        }
+    }
+    return save_lengths(text_id, lengths, append);
+}/*write the frequency table, length histogram and stats row of a text*/
+
+static unsigned char *serialize(const token_sketch *sk, size_t (*write)(const token_sketch *, unsigned char *, size_t), size_t *len)
+{
+    *len = write(sk, NULL, 0);
+    unsigned char *buf = malloc(*len);
+    if (buf != NULL) {
+        write(sk, buf, *len);
+    }
+    return buf;
+}
+
+static int save_sketch(int text_id, const token_sketch *sk, const length_hist *lengths)
+{
+    size_t topk_len, cms_len, hll_len;
+    unsigned char *topk = serialize(sk, sketch_serialize_topk, &topk_len);
+    unsigned char *cms = serialize(sk, sketch_serialize_cms, &cms_len);
+    unsigned char *hll = serialize(sk, sketch_serialize_hll, &hll_len);
+    int rc = -1;
+
+    if (topk != NULL && cms != NULL && hll != NULL && save_lengths(text_id, lengths, 0) == 0) {
+        rc = db_insert_sketch(text_id, SKETCH_FORMAT, sk->total, sketch_distinct(sk),
+                              topk, (int)topk_len, cms, (int)cms_len, hll, (int)hll_len);
+    }
+    free(topk);
+    free(cms);
+    free(hll);
+    return rc;
+}/*write the length histogram, stats row and serialized sketches of a text, token_freq stays empty*/
+
+static int flush_batch(analyzer_stream *s)
+{
+    if (s->batched == 0) {
+        return 0;
+    }
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = db_insert_tokens(s->text_id, s->batch, s->lens, s->batched, s->count + 1 - s->batched);
+    metrics_leave(stage);
+    if (rc < 0) {
+        fprintf(stderr, "Failed to save token to database\n");
+        return -1;
+    }
+    s->batched = 0;
+    s->scratch_len = 0; /*no queued token points into the scratch buffer any more*/
+    return 0;
+}/*send the queued tokens to the database in one call*/
+
+static const char *fold_token(analyzer_stream *s, const char *token, size_t len)
+{
+    if (s->scratch_len + len > s->scratch_cap) {
+        /*make room by sending the queued tokens, then grow if a single token still does not fit*/
+        if (flush_batch(s) < 0) {
+            return NULL;
+        }
+        if (len > s->scratch_cap) {
+            size_t cap = len > FOLD_SCRATCH ? len : FOLD_SCRATCH;
+            char *grown = realloc(s->scratch, cap);
+            if (grown == NULL) {
+                fprintf(stderr, "Failed to allocate token buffer\n");
+                return NULL;
+            }
+            s->scratch = grown;
+            s->scratch_cap = cap;
+        }
+    }
+    char *dst = s->scratch + s->scratch_len;
+    tok_normalize(&s->cfg, token, len, dst);
+    s->scratch_len += len;
+    return dst;
+}/*normalized copy of a token, valid until the next flush*/
+
+static int emit_token(analyzer_stream *s, const char *token, size_t len)
+{
+    if (s->cfg.fold_case) {
+        token = fold_token(s, token, len);
+        if (token == NULL) {
+            return -1;
+        }
+    }
+
+    /*aggregate while the token is at hand, so nothing has to re-scan the rows*/
+    if (s->sketch != NULL) {
+        sketch_add(s->sketch, token, len);
+        if (hist_add(&s->lengths, utf8_length(token, len), 1) < 0) {
+            fprintf(stderr, "Failed to count token\n");
+            return -1;
+        }
+    } else if (counter_add(&s->freq, token, len, 1) == NULL) {
+        fprintf(stderr, "Failed to count token\n");
+        return -1;
+    }
+
+    /*queue the token, the batch goes to the database in one call*/
+    s->batch[s->batched] = token;
+    s->lens[s->batched] = (int)len;
+    s->batched++;
+    s->count++;
+    return s->batched == TOKEN_BATCH ? flush_batch(s) : 0;
+}
+
+int analyzer_stream_insert_ids(analyzer_stream *s, const long long *ids, int n)
+{
+    /*tokens queued by feed come first, they hold the earlier positions*/
+    if (flush_batch(s) < 0) {
+        return -1;
+    }
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = db_insert_token_ids(s->text_id, ids, n, s->count + 1);
+    metrics_leave(stage);
+    if (rc < 0) {
+        fprintf(stderr, "Failed to save token to database\n");
+        return -1;
+    }
+    s->count += n;
+    return 0;
+}
+
+int analyzer_stream_merge(analyzer_stream *s, const counter *freq)
+{
+    size_t iter = 0;
+    counter_entry *e;
+    while ((e = counter_next(freq, &iter)) != NULL) {
+        if (counter_add(&s->freq, e->token, e->len, e->count) == NULL) {
+            fprintf(stderr, "Failed to count token\n");
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static int carry_append(analyzer_stream *s, const char *buf, size_t len)
+{
+    if (s->carry_len + len > s->carry_cap) {
+        size_t cap = s->carry_cap ? s->carry_cap : MAX_TOKEN_LEN;
+        while (cap < s->carry_len + len) {
+            cap *= 2;
+        }
+        char *grown = realloc(s->carry, cap);
+        if (grown == NULL) {
+            fprintf(stderr, "Failed to allocate token buffer\n");
+            return -1;
+        }
+        s->carry = grown;
+        s->carry_cap = cap;
+    }
+    memcpy(s->carry + s->carry_len, buf, len);
+    s->carry_len += len;
+    return 0;
+}/*keep the unfinished tail of a chunk for the next one*/
+
+int analyzer_stream_init(analyzer_stream *s, int text_id, const tokenizer_config *cfg)
+{
+    memset(s, 0, sizeof(*s));
+    s->text_id = text_id;
+    if (cfg != NULL) {
+        s->cfg = *cfg;
+    } else {
+        tokenizer_config_init(&s->cfg, TOK_SPLIT_DEFAULT);
+    }
+    if (counter_init(&s->freq, 1024) != 0) {
+        fprintf(stderr, "Failed to allocate token table\n");
+        return -1;
+    }
+    return 0;
+}
+
+int analyzer_stream_use_sketch(analyzer_stream *s)
+{
+    s->sketch = malloc(sizeof(*s->sketch));
+    if (s->sketch == NULL || sketch_init(s->sketch) != 0) {
+        fprintf(stderr, "Failed to allocate token sketches\n");
+        free(s->sketch);
+        s->sketch = NULL;
+        return -1;
+    }
+    return 0;
+}
+
+int analyzer_stream_resume(analyzer_stream *s, long long tokens)
+{
+    if (s->sketch != NULL) {
+        fprintf(stderr, "Sketched texts cannot be continued\n");
+        return -1;
+    }
+    s->count = tokens;
+    s->resumed_at = tokens;
+    s->append = 1;
+    return 0;
+}
+
+int analyzer_stream_feed(analyzer_stream *s, const char *buf, size_t len)
+{
+    size_t i = 0;
+    tok_span span;
+    int kind;
+
+    /*finish the token the previous chunk ended in*/
+    if (s->carry_len > 0) {
+        size_t end = tok_word_prefix(&s->cfg, buf, len);
+        if (carry_append(s, buf, end) < 0) {
+            return -1;
+        }
+        if (end == len) {
+            return 0; /*the whole chunk belongs to the same token*/
+        }
+        if (emit_token(s, s->carry, s->carry_len) < 0) {
+            return -1;
+        }
+        i = end;
+    }
+
+    while ((kind = tok_next(&s->cfg, buf, len, &i, &span)) == TOK_WORD) {
+        if (emit_token(s, buf + span.offset, span.length) < 0) {
+            return -1;
+        }
+    }
+    if (kind == TOK_PARTIAL) {
+        /*the token may continue in the next chunk, the queued tokens
+          point into buf and the carry, so flush them before reusing it*/
+        if (flush_batch(s) < 0) {
+            return -1;
+        }
+        s->carry_len = 0;
+        return carry_append(s, buf + span.offset, span.length);
+    }
+
+    /*the caller may overwrite buf after this call*/
+    s->carry_len = 0;
+    return flush_batch(s);
+}
+
+int analyzer_stream_retract(analyzer_stream *s, const char *token, size_t len)
 {
-    int count = 0;
+    if (!s->append || s->count != s->resumed_at || s->count == 0) {
+        fprintf(stderr, "Only the last token of a resumed text can be taken back\n");
+        return -1;
+    }
+    char *stored = malloc(len + 1);
+    if (stored == NULL) {
+        fprintf(stderr, "Failed to allocate token buffer\n");
+        return -1;
+    }
+    tok_normalize(&s->cfg, token, len, stored);
+    stored[len] = '\0';
 
-    /*get first token*/
-    char *token = strtok(intext, " ,.\n");
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = db_remove_token(s->text_id, stored, (int)len, s->count, utf8_length(stored, len));
+    metrics_leave(stage);
+    free(stored);
+    if (rc < 0) {
+        return -1;
+    }
+    s->count--; /*its position is used again by the token that replaces it*/
+    return 0;
+}
 
-    /*continue getting tokens*/
-    while (token != NULL && count < 3000)
-    {
-        /*save token to database*/
-        int result = db_insert_token(text_id, token, count+1);
-        if (result < 0) {
-            fprintf(stderr, "Failed to save token to database\n");
+long long analyzer_stream_finish(analyzer_stream *s)
+{
+    if (s->carry_len > 0) {
+        if (emit_token(s, s->carry, s->carry_len) < 0) {
             return -1;
         }
-        
-        count++;
-        /*get next token*/
-        token = strtok(NULL, " ,.\n");
+    }
+    if (flush_batch(s) < 0) {
+        return -1;
+    }
+    s->carry_len = 0;
+
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = s->sketch != NULL
+        ? save_sketch(s->text_id, s->sketch, &s->lengths)
+        : save_aggregates(s->text_id, &s->freq, &s->lengths, s->append);
+    metrics_leave(stage);
+    if (rc < 0) {
+        fprintf(stderr, "Failed to save token statistics to database\n");
+        return -1;
+    }
+    return s->count - s->resumed_at;
+}
+
+long long analyzer_stream_distinct(const analyzer_stream *s)
+{
+    return s->sketch != NULL ? sketch_distinct(s->sketch) : (long long)s->freq.size;
+}
+
+void analyzer_stream_free(analyzer_stream *s)
+{
+    counter_free(&s->freq);
+    if (s->sketch != NULL) {
+        sketch_free(s->sketch);
+        free(s->sketch);
+        s->sketch = NULL;
+    }
+    free(s->lengths.counts);
+    s->lengths.counts = NULL;
+    s->lengths.size = 0;
+    free(s->scratch);
+    s->scratch = NULL;
+    free(s->carry);
+    s->carry = NULL;
+    s->carry_len = 0;
+    s->carry_cap = 0;
+}
+
+int tokenize_with_id(char *intext, int text_id)
+{
+    analyzer_stream s;
+
+    if (analyzer_stream_init(&s, text_id, NULL) != 0) {
+        return -1;
+    }
+    long long count = -1;
+    if (analyzer_stream_feed(&s, intext, strlen(intext)) == 0) {
+        count = analyzer_stream_finish(&s);
+    }
+    analyzer_stream_free(&s);
+    if (count < 0) {
+        return -1;
     }
 
-    printf("\nFound and saved %d tokens\n", count);
-    return count;
+    printf("\nFound and saved %lld tokens\n", count);
+    return (int)count;
 }
\ No newline at end of file
@@ -2,11 +2,65 @@
 #include <stdlib.h> /*dynamic allocation*/
 #include <string.h> /*string*/
 #include <ctype.h> /*string assertion*/
+#include "counter.h" /*token frequency table*/
+#include "tokenizer.h" /*byte class tokenizer*/
+#include "sketch.h" /*approximate token summaries*/
 
 #ifndef ANALYZER_H
 #define ANALYZER_H
-#define MAX_TOKENS 3000
 #define MAX_TOKEN_LEN 64
+#define TOKEN_BATCH 512 /*tokens per bulk insert*/
+#define CHUNK_SIZE 65536 /*bytes read per call when streaming*/
+#define FOLD_SCRATCH 65536 /*bytes of normalized tokens buffered per batch*/
+
+typedef struct {
+    long long *counts;          /*counts[n] = number of tokens with n characters*/
+    int size;
+    long long total;
+    long long total_len;        /*characters over all tokens, for the average*/
+    int max_len;
+    int min_len;
+} length_hist;
+
+typedef struct {
+    int text_id;
+    tokenizer_config cfg;       /*private copy, so streams never share state*/
+    long long count;            /*tokens seen so far, also the last position used*/
+    long long resumed_at;       /*tokens the text already had, see analyzer_stream_resume*/
+    int append;                 /*add to the stored aggregates instead of creating them*/
+    counter freq;               /*token frequencies, written at finish*/
+    token_sketch *sketch;       /*replaces freq when set, memory stays fixed however many distinct tokens*/
+    length_hist lengths;        /*filled as tokens arrive in sketch mode, from freq otherwise*/
+    char *carry;                /*token cut off at the end of the previous chunk*/
+    size_t carry_len;
+    size_t carry_cap;
+    const char *batch[TOKEN_BATCH]; /*tokens waiting for the next bulk insert*/
+    int lens[TOKEN_BATCH];
+    int batched;
+    char *scratch;              /*case folded copies of the queued tokens*/
+    size_t scratch_len;
+    size_t scratch_cap;
+} analyzer_stream;
+
+int analyzer_stream_init(analyzer_stream *s, int text_id, const tokenizer_config *cfg);/*prepare incremental tokenization of one text, cfg NULL selects the default delimiters*/
+
+int analyzer_stream_use_sketch(analyzer_stream *s);/*count tokens in fixed size sketches instead of the exact table, call before the first feed*/
+
+int analyzer_stream_resume(analyzer_stream *s, long long tokens);/*continue a text that already has tokens, positions go on after them and finish adds to its aggregates*/
+
+int analyzer_stream_feed(analyzer_stream *s, const char *buf, size_t len);/*tokenize the next chunk, tokens may span chunk boundaries*/
+
+int analyzer_stream_insert_ids(analyzer_stream *s, const long long *ids, int n);/*insert tokens already resolved to vocab ids at the next positions without counting them*/
+
+int analyzer_stream_merge(analyzer_stream *s, const counter *freq);/*add frequencies counted elsewhere, e.g. by a worker thread*/
+
+int analyzer_stream_retract(analyzer_stream *s, const char *token, size_t len);/*take back the last token of a resumed text, as it appears in the input, so it can be fed again together with what follows it*/
+
+long long analyzer_stream_finish(analyzer_stream *s);/*flush the last token and write the aggregates, returns the tokens this stream added*/
+
+long long analyzer_stream_distinct(const analyzer_stream *s);/*distinct tokens so far, estimated in sketch mode*/
+
+void analyzer_stream_free(analyzer_stream *s);/*release the stream buffers*/
 
 int tokenize_with_id(char *intext, int text_id);
 
@@ -0,0 +1,108 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import text_analyzer
+
+def iter_documents(sources, field):
+    """Yield ("path", path) or ("text", text) for every document in the sources
+
+    A source is a directory (every file inside, recursively), a glob pattern,
+    or a .jsonl file with one document per line. JSONL lines are either a JSON
+    string or an object whose `field` holds the text.
+    """
+    for source in sources:
+        if source.endswith(".jsonl") and os.path.isfile(source):
+            with open(source, "r", encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        doc = json.loads(line)
+                    except ValueError as e:
+                        print(f"Skipping {source}:{line_no}: {e}", file=sys.stderr)
+                        continue
+                    if isinstance(doc, dict):
+                        doc = doc.get(field)
+                    if not isinstance(doc, str):
+                        print(f"Skipping {source}:{line_no}: no '{field}' text", file=sys.stderr)
+                        continue
+                    yield "text", doc
+        elif os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    yield "path", os.path.join(root, name)
+        else:
+            matches = sorted(glob.glob(source, recursive=True))
+            if not matches:
+                print(f"No files match {source}", file=sys.stderr)
+            for path in matches:
+                if os.path.isfile(path):
+                    yield "path", path
+
+def run_batch(analyzer, documents, group_size=500):
+    """Analyze documents, committing every `group_size` texts, and return the totals"""
+    totals = {"docs": 0, "failed": 0, "tokens": 0, "bytes": 0}
+    documents = iter(documents)
+    done = False
+    while not done:
+        # One transaction per group, each text keeps its own savepoint inside it
+        with analyzer.transaction():
+            for _ in range(group_size):
+                try:
+                    kind, value = next(documents)
+                except StopIteration:
+                    done = True
+                    break
+                try:
+                    if kind == "path":
+                        result = analyzer.analyze(path=value)
+                    else:
+                        result = analyzer.analyze(value)
+                except text_analyzer.AnalyzerError as e:
+                    totals["failed"] += 1
+                    print(f"Failed to analyze {value if kind == 'path' else 'document'}: {e}", file=sys.stderr)
+                    continue
+                totals["docs"] += 1
+                totals["tokens"] += result.tokens
+                totals["bytes"] += result.bytes
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze many documents in one process")
+    parser.add_argument("sources", nargs="+",
+                        help="directories, glob patterns (quote them) or .jsonl files")
+    parser.add_argument("--db", default="analysis.db", help="database path (default analysis.db)")
+    parser.add_argument("--field", default="text", help="JSONL object field holding the text (default text)")
+    parser.add_argument("--group", type=int, default=500, help="texts per transaction (default 500)")
+    parser.add_argument("--threads", type=int, default=1, help="threads per mapped file, 0 = one per CPU")
+    parser.add_argument("--fold-case", action="store_true", help="lowercase ASCII letters before counting")
+    parser.add_argument("--sketch", action="store_true", help="approximate counts in fixed memory, see vis.py --approx")
+    args = parser.parse_intermixed_args()
+
+    try:
+        analyzer = text_analyzer.Analyzer(args.db, fold_case=args.fold_case, threads=args.threads,
+                                          sketch=args.sketch)
+    except (OSError, text_analyzer.AnalyzerError) as e:
+        print(f"Error: cannot load the analyzer library: {e}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        totals = run_batch(analyzer, iter_documents(args.sources, args.field), max(1, args.group))
+    finally:
+        analyzer.close()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print(f"Analyzed {totals['docs']} documents ({totals['failed']} failed) in {elapsed:.2f} s")
+    print(f"  {totals['docs'] / elapsed:.1f} docs/s")
+    print(f"  {totals['tokens'] / elapsed:.0f} tokens/s ({totals['tokens']} tokens)")
+    print(f"  {totals['bytes'] / elapsed / 1e6:.2f} MB/s ({totals['bytes']} bytes)")
+    if totals["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import batch
+import db_queries
+import text_analyzer
+import vis
+
+# Synthetic corpora, sized at --scale 1. Every corpus is generated from the seed,
+# so two runs with the same arguments analyze byte-identical input. `scales`
+# names what --scale multiplies, the document count or the document length.
+CORPORA = {
+    # many short documents, dominated by per-text overhead
+    "small": {"docs": 2000, "tokens_per_doc": 50, "vocab": 5000, "zipf": None, "scales": "docs"},
+    # few long documents, dominated by tokenizing and inserting
+    "large": {"docs": 4, "tokens_per_doc": 500000, "vocab": 50000, "zipf": None, "scales": "tokens_per_doc"},
+    # natural-language-like vocabulary, a few very common words and a long tail
+    "zipf": {"docs": 200, "tokens_per_doc": 10000, "vocab": 200000, "zipf": 1.1, "scales": "docs"},
+}
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+PUNCTUATION = [",", ".", ";", "!", "?"]
+
+def make_vocabulary(rng, size):
+    """Distinct pseudo words, short ones first like real text"""
+    words = []
+    seen = set()
+    while len(words) < size:
+        length = min(3 + int(rng.expovariate(0.35)), 20)
+        word = "".join(rng.choice(LETTERS) for _ in range(length))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def generate_corpus(directory, spec, scale, seed):
+    """Write the documents of one corpus spec as text files, return (paths, total tokens)"""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, spec["vocab"])
+    cum_weights = None
+    if spec["zipf"]:
+        total = 0.0
+        cum_weights = []
+        for rank in range(1, len(vocabulary) + 1):
+            total += 1.0 / rank ** spec["zipf"]
+            cum_weights.append(total)
+
+    sizes = {"docs": spec["docs"], "tokens_per_doc": spec["tokens_per_doc"]}
+    sizes[spec["scales"]] = max(1, int(sizes[spec["scales"]] * scale))
+    docs, tokens_per_doc = sizes["docs"], sizes["tokens_per_doc"]
+    paths = []
+    for index in range(docs):
+        if cum_weights is not None:
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=tokens_per_doc)
+        else:
+            words = rng.choices(vocabulary, k=tokens_per_doc)
+        lines = []
+        for start in range(0, len(words), 12):
+            line = " ".join(words[start:start + 12])
+            lines.append(line + rng.choice(PUNCTUATION))
+        path = os.path.join(directory, f"doc_{index:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths, docs * tokens_per_doc
+
+def percentiles(samples):
+    """p50/p90/p99 and mean of latency samples, in milliseconds"""
+    ordered = sorted(samples)
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "samples": len(ordered),
+    }
+
+def ingest(paths, db_path, threads, analyzer_exe):
+    """Analyze every document into a fresh database, return elapsed seconds"""
+    start = time.perf_counter()
+    if analyzer_exe is None:
+        analyzer = text_analyzer.Analyzer(db_path, threads=threads)
+        try:
+            totals = batch.run_batch(analyzer, (("path", path) for path in paths))
+        finally:
+            analyzer.close()
+        if totals["failed"]:
+            raise RuntimeError(f"{totals['failed']} documents failed to analyze")
+    else:
+        # The CLI always writes analysis.db in its working directory
+        workdir = os.path.dirname(db_path)
+        for path in paths:
+            subprocess.run([analyzer_exe, f"--threads={threads}", path], cwd=workdir,
+                           stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+def database_size(db_path):
+    """Bytes on disk after folding the WAL back into the main file"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+
+def bench_queries(db_path, text_ids, iterations, rng):
+    """Latency of the loaders vis.py runs, each on a fresh connection like vis.py itself"""
+    others = text_ids[1:] + text_ids[:1]
+    loaders = {
+        "text_aggregates": lambda tid, other: vis.TextAggregates.load(tid, db_path),
+        "tfidf_terms": lambda tid, other: vis.load_tfidf_terms(tid, 15, db_path),
+        "comparison": lambda tid, other: vis.load_comparison(tid, other, 15, db_path),
+        "corpus_top_terms": lambda tid, other: vis.load_corpus_top_terms(15, db_path),
+        "chart_key": lambda tid, other: vis.chart_key("word_cloud", [tid], db_path=db_path),
+    }
+    results = {}
+    for name, loader in loaders.items():
+        samples = []
+        for _ in range(iterations):
+            index = rng.randrange(len(text_ids))
+            start = time.perf_counter()
+            loader(text_ids[index], others[index])
+            samples.append(time.perf_counter() - start)
+        results[name] = percentiles(samples)
+    return results
+
+def bench_renders(db_path, text_id, other_id, output_dir, repeat):
+    """Median render time per chart type, None when the chart libraries are missing"""
+    try:
+        import matplotlib
+        import wordcloud
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    vis.SHOW_FIGURES = False
+    aggregates = vis.TextAggregates.load(text_id, db_path)
+    charts = {
+        "word_frequency": lambda: vis.generate_word_frequency_chart(text_id, output_dir, aggregates),
+        "token_length_distribution": lambda: vis.generate_token_length_distribution(text_id, output_dir, aggregates),
+        "word_cloud": lambda: vis.generate_word_cloud(text_id, output_dir, aggregates),
+        "corpus_word_frequency": lambda: vis.generate_corpus_frequency_chart(output_dir),
+        "tfidf": lambda: vis.generate_tfidf_chart(text_id, output_dir),
+        "comparison": lambda: vis.generate_comparison_chart(text_id, other_id, output_dir),
+    }
+    results = {}
+    # The chart loaders read analysis.db from the working directory
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(db_path))
+    try:
+        for name, render in charts.items():
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    render()
+                samples.append(time.perf_counter() - start)
+                if "saved as" not in out.getvalue():
+                    raise RuntimeError(f"{name} failed: {out.getvalue().strip()}")
+            results[name] = {"median_ms": statistics.median(samples) * 1000}
+    finally:
+        os.chdir(cwd)
+    return results
+
+def bench_corpus(name, spec, args, workdir):
+    corpus_dir = os.path.join(workdir, name)
+    os.makedirs(corpus_dir)
+    paths, tokens = generate_corpus(corpus_dir, spec, args.scale, args.seed)
+    corpus_bytes = sum(os.path.getsize(path) for path in paths)
+    print(f"[{name}] {len(paths)} documents, {tokens} tokens, {corpus_bytes / 1e6:.1f} MB")
+
+    # Every repeat starts from an empty database, the last one is kept for the queries
+    ingest_times = []
+    db_path = None
+    for attempt in range(args.repeat):
+        db_dir = os.path.join(workdir, f"{name}_db{attempt}")
+        os.makedirs(db_dir)
+        db_path = os.path.join(db_dir, "analysis.db")
+        ingest_times.append(ingest(paths, db_path, args.threads, args.analyzer_exe))
+    elapsed = statistics.median(ingest_times)
+    size = database_size(db_path)
+    result = {
+        "documents": len(paths),
+        "tokens": tokens,
+        "bytes": corpus_bytes,
+        "ingest": {
+            "median_s": elapsed,
+            "tokens_per_s": tokens / elapsed,
+            "mb_per_s": corpus_bytes / elapsed / 1e6,
+            "docs_per_s": len(paths) / elapsed,
+        },
+        "db_bytes": size,
+        "db_bytes_per_million_tokens": size / tokens * 1e6,
+    }
+    print(f"[{name}] ingest {result['ingest']['tokens_per_s']:.0f} tokens/s, "
+          f"db {result['db_bytes_per_million_tokens'] / 1e6:.1f} MB per million tokens")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        text_ids = [row[0] for row in conn.execute(db_queries.ALL_TEXT_IDS.sql)]
+    finally:
+        conn.close()
+    result["queries"] = bench_queries(db_path, text_ids, args.iterations, random.Random(args.seed))
+    for query, stats in result["queries"].items():
+        print(f"[{name}] {query}: p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+    if not args.skip_render:
+        render_dir = os.path.join(workdir, f"{name}_charts")
+        os.makedirs(render_dir)
+        other_id = text_ids[1] if len(text_ids) > 1 else text_ids[0]
+        result["render"] = bench_renders(db_path, text_ids[0], other_id, render_dir, args.repeat)
+        for chart, stats in result["render"].items():
+            print(f"[{name}] render {chart}: {stats if chart == 'skipped' else format(stats['median_ms'], '.0f') + ' ms'}")
+    return result
+
+def flatten(results, prefix=""):
+    """Numeric leaves of a result tree as {"zipf.ingest.tokens_per_s": value}"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(baseline_path, results):
+    """Print every metric next to the baseline run, with the relative change"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    baseline = flatten(previous["corpora"])
+    print(f"\nCompared with {baseline_path} ({previous.get('commit') or 'unknown commit'}):")
+    if previous.get("settings") != results["settings"]:
+        print("  Note: the runs used different settings, the numbers are not comparable")
+    for key, value in sorted(flatten(results["corpora"]).items()):
+        if key in baseline and baseline[key]:
+            change = (value - baseline[key]) / baseline[key] * 100
+            print(f"  {key}: {baseline[key]:.4g} -> {value:.4g} ({change:+.1f}%)")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, vis.py queries and chart rendering on synthetic corpora")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA),
+                        help="corpus to run, repeatable (default all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="shrink or grow every corpus (default 1.0)")
+    parser.add_argument("--seed", type=int, default=1, help="corpus and sampling seed (default 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="ingest and render repeats, the median is kept (default 3)")
+    parser.add_argument("--iterations", type=int, default=200, help="samples per query (default 200)")
+    parser.add_argument("--threads", type=int, default=1, help="analyzer threads per document (default 1)")
+    parser.add_argument("--analyzer-exe", help="benchmark this CLI binary instead of the in-process library")
+    parser.add_argument("--skip-render", action="store_true", help="do not time chart rendering")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file (default bench_results.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="print changes against an earlier results file")
+    args = parser.parse_args()
+    args.repeat = max(1, args.repeat)
+
+    if args.analyzer_exe is None and not text_analyzer.is_available():
+        print("Error: the analyzer library is not built, build it or pass --analyzer-exe")
+        sys.exit(1)
+
+    workdir = tempfile.mkdtemp(prefix="text_analyzer_bench_")
+    try:
+        corpora = {}
+        for name in args.corpus or sorted(CORPORA):
+            corpora[name] = bench_corpus(name, CORPORA[name], args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "engine": args.analyzer_exe or "library",
+        "settings": {"scale": args.scale, "seed": args.seed, "repeat": args.repeat,
+                     "iterations": args.iterations, "threads": args.threads},
+        "corpora": corpora,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
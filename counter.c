@@ -0,0 +1,115 @@
+#include "counter.h"
+#include <stdlib.h> /*dynamic allocation*/
+#include <string.h> /*string*/
+
+static unsigned int counter_hash(const char *token, size_t len)
+{
+    /*FNV-1a, cheap and good enough for short words*/
+    unsigned int h = 2166136261u;
+    for (size_t i = 0; i < len; i++) {
+        h ^= (unsigned char)token[i];
+        h *= 16777619u;
+    }
+    return h;
+}
+
+int counter_init(counter *c, size_t capacity)
+{
+    size_t cap = 16;
+    while (cap < capacity * 2) {
+        cap <<= 1; /*keep the load factor below one half initially*/
+    }
+    c->slots = calloc(cap, sizeof(counter_entry));
+    if (c->slots == NULL) {
+        return -1;
+    }
+    c->capacity = cap;
+    c->size = 0;
+    return 0;
+}
+
+static int counter_grow(counter *c)
+{
+    size_t new_cap = c->capacity * 2;
+    counter_entry *slots = calloc(new_cap, sizeof(counter_entry));
+    if (slots == NULL) {
+        return -1;
+    }
+
+    /*rehash every used slot, token copies are moved, not duplicated*/
+    for (size_t i = 0; i < c->capacity; i++) {
+        counter_entry *e = &c->slots[i];
+        if (e->token == NULL) {
+            continue;
+        }
+        size_t j = e->hash & (new_cap - 1);
+        while (slots[j].token != NULL) {
+            j = (j + 1) & (new_cap - 1);
+        }
+        slots[j] = *e;
+    }
+
+    free(c->slots);
+    c->slots = slots;
+    c->capacity = new_cap;
+    return 0;
+}
+
+counter_entry *counter_add(counter *c, const char *token, size_t len, long long n)
+{
+    /*grow at 70% load so probe sequences stay short*/
+    if ((c->size + 1) * 10 > c->capacity * 7 && counter_grow(c) != 0) {
+        return NULL;
+    }
+
+    unsigned int h = counter_hash(token, len);
+    size_t i = h & (c->capacity - 1);
+    while (c->slots[i].token != NULL) {
+        counter_entry *e = &c->slots[i];
+        if (e->hash == h && e->len == len && memcmp(e->token, token, len) == 0) {
+            e->count += n;
+            return e;
+        }
+        i = (i + 1) & (c->capacity - 1);
+    }
+
+    char *copy = malloc(len + 1);
+    if (copy == NULL) {
+        return NULL;
+    }
+    memcpy(copy, token, len);
+    copy[len] = '\0';
+
+    counter_entry *e = &c->slots[i];
+    e->token = copy;
+    e->len = len;
+    e->hash = h;
+    e->count = n;
+    c->size++;
+    return e;
+}
+
+counter_entry *counter_next(const counter *c, size_t *iter)
+{
+    while (*iter < c->capacity) {
+        counter_entry *e = &c->slots[(*iter)++];
+        if (e->token != NULL) {
+            return e;
+        }
+    }
+    return NULL;
+}
+
+void counter_free(counter *c)
+{
+    if (c->slots == NULL) {
+        return;
+    }
+    for (size_t i = 0; i < c->capacity; i++) {
+        free(c->slots[i].token);
+    }
+    free(c->slots);
+    c->slots = NULL;
+    c->capacity = 0;
+    c->size = 0;
+}
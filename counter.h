@@ -0,0 +1,28 @@
+#ifndef COUNTER_H
+#define COUNTER_H
+
+/* The head of "counter", a string-keyed hash table for token frequencies*/
+
+#include <stddef.h>
+
+typedef struct {
+    char *token;      /*owned, NUL terminated copy of the token*/
+    size_t len;       /*token length in bytes*/
+    unsigned int hash;
+    long long count;
+} counter_entry;
+
+typedef struct {
+    counter_entry *slots; /*open addressing table, token == NULL marks a free slot*/
+    size_t capacity;      /*always a power of two*/
+    size_t size;          /*number of distinct tokens*/
+} counter;
+
+int counter_init(counter *c, size_t capacity);/*allocate an empty table with room for `capacity` tokens*/
+
+counter_entry *counter_add(counter *c, const char *token, size_t len, long long n);/*add n occurrences of a token, returns its entry or NULL when out of memory*/
+
+counter_entry *counter_next(const counter *c, size_t *iter);/*iterate over the used slots, start with *iter = 0, returns NULL at the end*/
+
+void counter_free(counter *c);/*release the table and every token copy*/
+#endif
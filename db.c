@@ -1,9 +1,275 @@
 #include "db.h"
+#include "counter.h"
+#include "metrics.h"
 #include <stdio.h>
+#include <string.h>
 
 static sqlite3 *db = NULL; /*The global handle, no need to define later*/
+
+/*statements are compiled once per connection and reset between uses*/
+enum {
+    STMT_INSERT_TEXT,
+    STMT_UPDATE_TEXT,
+    STMT_INSERT_TOKEN,
+    STMT_INSERT_STATS,
+    STMT_INSERT_TOKEN_FREQ,
+    STMT_INSERT_LENGTH_COUNT,
+    STMT_SELECT_VOCAB,
+    STMT_INSERT_VOCAB,
+    STMT_UPSERT_CORPUS_TERM,
+    STMT_INSERT_SKETCH,
+    STMT_SELECT_TEXT_STATE,
+    STMT_APPEND_TEXT,
+    STMT_ADD_TOKEN_FREQ,
+    STMT_ADD_CORPUS_TERM,
+    STMT_REFRESH_STATS,
+    STMT_DELETE_TOKEN,
+    STMT_DROP_TOKEN_FREQ,
+    STMT_DROP_CORPUS_DOC,
+    STMT_DELETE_CORPUS_TERM,
+    STMT_DROP_LENGTH_COUNT,
+    STMT_DROP_VOCAB,
+    STMT_COUNT
+};
+
+static const char *stmt_sql[STMT_COUNT] = {
+    "INSERT INTO texts (content, bytes) VALUES (?1, LENGTH(CAST(?1 AS BLOB)));",
+    "UPDATE texts SET content = ?, bytes = ? WHERE id = ?;",
+    "INSERT INTO tokens (text_id, token_id, position) VALUES (?, ?, ?);",
+    "INSERT INTO stats (text_id, token_count, avg_len, max_len, min_len) VALUES (?, ?, ?, ?, ?);",
+    "INSERT INTO token_freq (text_id, token_id, count) VALUES (?, ?, ?);",
+    "INSERT INTO token_len_hist (text_id, length, count) VALUES (?1, ?2, ?3) "
+        "ON CONFLICT(text_id, length) DO UPDATE SET count = count + ?3;",
+    "SELECT id FROM vocab WHERE token = ?;",
+    "INSERT INTO vocab (token) VALUES (?);",
+    "INSERT INTO corpus_terms (token_id, term_count, doc_count) VALUES (?1, ?2, 1) "
+        "ON CONFLICT(token_id) DO UPDATE SET term_count = term_count + ?2, doc_count = doc_count + 1;",
+    "INSERT INTO sketches (text_id, format, tokens, distinct_estimate, topk, cms, hll) VALUES (?, ?, ?, ?, ?, ?, ?);",
+    "SELECT texts.bytes, LENGTH(CAST(texts.content AS BLOB)), COALESCE(stats.token_count, 0), "
+        "EXISTS (SELECT 1 FROM sketches WHERE sketches.text_id = texts.id) "
+        "FROM texts LEFT JOIN stats ON stats.text_id = texts.id WHERE texts.id = ?;",
+    "UPDATE texts SET content = content || ?, bytes = ? WHERE id = ?;",
+    "UPDATE token_freq SET count = count + ?3 WHERE text_id = ?1 AND token_id = ?2;",
+    "UPDATE corpus_terms SET term_count = term_count + ?2 WHERE token_id = ?1;",
+    "UPDATE stats SET (token_count, avg_len, max_len, min_len) = ("
+        "SELECT COALESCE(SUM(count), 0), COALESCE(CAST(ROUND(1.0 * SUM(length * count) / SUM(count)) AS INTEGER), 0), "
+        "COALESCE(MAX(length), 0), COALESCE(MIN(length), 0) FROM token_len_hist WHERE text_id = ?1), "
+        "distinct_tokens = NULL, median_len = NULL, p90_len = NULL, p99_len = NULL, len_stddev = NULL, "
+        "entropy = NULL, type_token_ratio = NULL, hapax_ratio = NULL, zipf_exponent = NULL, zipf_r2 = NULL "
+        "WHERE text_id = ?1;",
+    "DELETE FROM tokens WHERE text_id = ? AND token_id = ? AND position = ?;",
+    "DELETE FROM token_freq WHERE text_id = ? AND token_id = ? AND count <= 0;",
+    "UPDATE corpus_terms SET doc_count = doc_count - 1 WHERE token_id = ?;",
+    "DELETE FROM corpus_terms WHERE token_id = ? AND doc_count <= 0;",
+    "DELETE FROM token_len_hist WHERE text_id = ? AND length = ? AND count <= 0;",
+    "DELETE FROM vocab WHERE id = ?1 AND NOT EXISTS ("
+        "SELECT 1 FROM sketches JOIN tokens ON tokens.text_id = sketches.text_id AND tokens.token_id = ?1);",
+};
+
+static sqlite3_stmt *stmt_cache[STMT_COUNT];
+
+/*token -> vocab id, the entry count holds the id so known tokens never touch the database.
+  Past VOCAB_CACHE_MAX tokens it starts over, so texts with millions of distinct tokens stay bounded*/
+#define VOCAB_CACHE_MAX (1 << 20)
+static counter vocab_cache;
+static int vocab_cache_ready = 0;
+
+static sqlite3_stmt *db_stmt(int which) {
+    if (stmt_cache[which] == NULL) {
+        int rc = sqlite3_prepare_v3(db, stmt_sql[which], -1, SQLITE_PREPARE_PERSISTENT, &stmt_cache[which], NULL); /*compile the SQL statement once*/
+        if (rc != SQLITE_OK) {
+            fprintf(stderr, "Failed to prepare statement: %s\n", sqlite3_errmsg(db));
+            stmt_cache[which] = NULL;
+            return NULL;
+        }
+    }
+    return stmt_cache[which];
+}/*get a cached prepared statement, compiling it on first use*/
+
+static int db_step_done(sqlite3_stmt *stmt) {
+    int rc = sqlite3_step(stmt); /*execute the statement*/
+    if (rc != SQLITE_DONE) {
+        fprintf(stderr, "Failed to execute statement: %s\n", sqlite3_errmsg(db));
+    }
+    sqlite3_reset(stmt);
+    sqlite3_clear_bindings(stmt); /*ready for the next use*/
+    return rc == SQLITE_DONE ? 0 : -1;
+}/*run a cached write statement to completion and reset it*/
+
+static int db_user_version(void) {
+    sqlite3_stmt *stmt;
+    int version = -1;
+
+    if (sqlite3_prepare_v2(db, "PRAGMA user_version;", -1, &stmt, NULL) != SQLITE_OK) {
+        fprintf(stderr, "Failed to prepare statement: %s\n", sqlite3_errmsg(db));
+        return -1;
+    }
+    if (sqlite3_step(stmt) == SQLITE_ROW) {
+        version = sqlite3_column_int(stmt, 0);
+    }
+    sqlite3_finalize(stmt);
+    return version;
+}/*read the schema version stored in the database header*/
+
+static int db_migrate(void) {
+    /*each step upgrades the schema by one version, old databases walk through all of them*/
+    static const char *steps[] = {
+        /*1: materialize the per-text aggregates for texts analyzed before they existed*/
+        "INSERT OR IGNORE INTO token_freq (text_id, token, count) "
+            "SELECT text_id, token, COUNT(*) FROM tokens GROUP BY text_id, token;"
+        "INSERT OR IGNORE INTO token_len_hist (text_id, length, count) "
+            "SELECT text_id, LENGTH(token), COUNT(*) FROM tokens GROUP BY text_id, LENGTH(token);"
+        "INSERT OR IGNORE INTO stats (text_id, token_count, avg_len, max_len, min_len) "
+            "SELECT text_id, COUNT(*), CAST(ROUND(AVG(LENGTH(token))) AS INTEGER), "
+            "MAX(LENGTH(token)), MIN(LENGTH(token)) FROM tokens GROUP BY text_id;",
+        /*2: streamed texts keep only a preview in content, bytes holds the full input size*/
+        "ALTER TABLE texts ADD COLUMN bytes INTEGER;"
+        "UPDATE texts SET bytes = LENGTH(CAST(content AS BLOB));",
+        /*3: per-text lookups, see db_queries.py for the queries these serve*/
+        "CREATE INDEX IF NOT EXISTS idx_tokens_text_token ON tokens (text_id, token);"
+        "CREATE INDEX IF NOT EXISTS idx_token_freq_text_count ON token_freq (text_id, count DESC);",
+        /*4: store every distinct token once in vocab, tokens and token_freq keep its integer id*/
+        "CREATE TABLE vocab ("
+            "id INTEGER PRIMARY KEY,"
+            "token TEXT NOT NULL UNIQUE"
+        ");"
+        "INSERT INTO vocab (token) SELECT token FROM token_freq UNION SELECT token FROM tokens;"
+        "CREATE TABLE tokens_v4 ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "text_id INTEGER NOT NULL,"
+            "token_id INTEGER NOT NULL,"
+            "position INTEGER,"
+            "FOREIGN KEY(text_id) REFERENCES texts(id),"
+            "FOREIGN KEY(token_id) REFERENCES vocab(id)"
+        ");"
+        "INSERT INTO tokens_v4 (id, text_id, token_id, position) "
+            "SELECT t.id, t.text_id, v.id, t.position FROM tokens t JOIN vocab v ON v.token = t.token ORDER BY t.id;"
+        "DROP TABLE tokens;"
+        "ALTER TABLE tokens_v4 RENAME TO tokens;"
+        "CREATE INDEX idx_tokens_text_token ON tokens (text_id, token_id);"
+        "CREATE TABLE token_freq_v4 ("
+            "text_id INTEGER NOT NULL,"
+            "token_id INTEGER NOT NULL,"
+            "count INTEGER NOT NULL,"
+            "PRIMARY KEY(text_id, token_id),"
+            "FOREIGN KEY(text_id) REFERENCES texts(id),"
+            "FOREIGN KEY(token_id) REFERENCES vocab(id)"
+        ") WITHOUT ROWID;"
+        "INSERT INTO token_freq_v4 (text_id, token_id, count) "
+            "SELECT f.text_id, v.id, f.count FROM token_freq f JOIN vocab v ON v.token = f.token;"
+        "DROP TABLE token_freq;"
+        "ALTER TABLE token_freq_v4 RENAME TO token_freq;"
+        "CREATE INDEX idx_token_freq_text_count ON token_freq (text_id, count DESC);",
+        /*5: corpus wide rollup, kept current by db_insert_token_freq*/
+        "CREATE TABLE corpus_terms ("
+            "token_id INTEGER PRIMARY KEY,"
+            "term_count INTEGER NOT NULL,"
+            "doc_count INTEGER NOT NULL,"
+            "FOREIGN KEY(token_id) REFERENCES vocab(id)"
+        ");"
+        "INSERT INTO corpus_terms (token_id, term_count, doc_count) "
+            "SELECT token_id, SUM(count), COUNT(*) FROM token_freq GROUP BY token_id;"
+        "CREATE INDEX idx_corpus_terms_count ON corpus_terms (term_count DESC);",
+        /*6: summary counters, the triggers keep them current inside the writing transaction*/
+        "CREATE TABLE db_meta ("
+            "key TEXT PRIMARY KEY,"
+            "value INTEGER NOT NULL"
+        ") WITHOUT ROWID;"
+        "INSERT INTO db_meta (key, value) VALUES "
+            "('text_count', (SELECT COUNT(*) FROM texts)),"
+            "('token_count', (SELECT COALESCE(SUM(token_count), 0) FROM stats)),"
+            "('total_bytes', (SELECT COALESCE(SUM(bytes), 0) FROM texts)),"
+            "('vocab_size', (SELECT COUNT(*) FROM vocab));"
+        "CREATE TRIGGER db_meta_texts_insert AFTER INSERT ON texts BEGIN "
+            "UPDATE db_meta SET value = value + 1 WHERE key = 'text_count';"
+            "UPDATE db_meta SET value = value + COALESCE(NEW.bytes, 0) WHERE key = 'total_bytes';"
+        "END;"
+        "CREATE TRIGGER db_meta_texts_update AFTER UPDATE OF bytes ON texts BEGIN "
+            "UPDATE db_meta SET value = value + COALESCE(NEW.bytes, 0) - COALESCE(OLD.bytes, 0) WHERE key = 'total_bytes';"
+        "END;"
+        "CREATE TRIGGER db_meta_texts_delete AFTER DELETE ON texts BEGIN "
+            "UPDATE db_meta SET value = value - 1 WHERE key = 'text_count';"
+            "UPDATE db_meta SET value = value - COALESCE(OLD.bytes, 0) WHERE key = 'total_bytes';"
+        "END;"
+        "CREATE TRIGGER db_meta_stats_insert AFTER INSERT ON stats BEGIN "
+            "UPDATE db_meta SET value = value + COALESCE(NEW.token_count, 0) WHERE key = 'token_count';"
+        "END;"
+        "CREATE TRIGGER db_meta_stats_update AFTER UPDATE OF token_count ON stats BEGIN "
+            "UPDATE db_meta SET value = value + COALESCE(NEW.token_count, 0) - COALESCE(OLD.token_count, 0) WHERE key = 'token_count';"
+        "END;"
+        "CREATE TRIGGER db_meta_stats_delete AFTER DELETE ON stats BEGIN "
+            "UPDATE db_meta SET value = value - COALESCE(OLD.token_count, 0) WHERE key = 'token_count';"
+        "END;"
+        "CREATE TRIGGER db_meta_vocab_insert AFTER INSERT ON vocab BEGIN "
+            "UPDATE db_meta SET value = value + 1 WHERE key = 'vocab_size';"
+        "END;"
+        "CREATE TRIGGER db_meta_vocab_delete AFTER DELETE ON vocab BEGIN "
+            "UPDATE db_meta SET value = value - 1 WHERE key = 'vocab_size';"
+        "END;",
+        /*7: approximate summaries of texts analyzed in sketch mode, see sketch.h for the blob layouts*/
+        "CREATE TABLE sketches ("
+            "text_id INTEGER PRIMARY KEY,"
+            "format INTEGER NOT NULL,"
+            "tokens INTEGER NOT NULL,"
+            "distinct_estimate INTEGER NOT NULL,"
+            "topk BLOB NOT NULL,"
+            "cms BLOB NOT NULL,"
+            "hll BLOB NOT NULL,"
+            "FOREIGN KEY(text_id) REFERENCES texts(id)"
+        ");",
+        /*8: distribution statistics, filled in by text_stats.py and NULL until it has run*/
+        "ALTER TABLE stats ADD COLUMN distinct_tokens INTEGER;"
+        "ALTER TABLE stats ADD COLUMN median_len INTEGER;"
+        "ALTER TABLE stats ADD COLUMN p90_len INTEGER;"
+        "ALTER TABLE stats ADD COLUMN p99_len INTEGER;"
+        "ALTER TABLE stats ADD COLUMN len_stddev REAL;"
+        "ALTER TABLE stats ADD COLUMN entropy REAL;"
+        "ALTER TABLE stats ADD COLUMN type_token_ratio REAL;"
+        "ALTER TABLE stats ADD COLUMN hapax_ratio REAL;"
+        "ALTER TABLE stats ADD COLUMN zipf_exponent REAL;"
+        "ALTER TABLE stats ADD COLUMN zipf_r2 REAL;",
+    };
+    int n_steps = (int)(sizeof(steps) / sizeof(steps[0]));
+
+    int version = db_user_version();
+    if (version < 0) {
+        return -1;
+    }
+
+    for (; version < n_steps; version++) {
+        char pragma[64];
+        char *err_msg = NULL;
+        snprintf(pragma, sizeof(pragma), "PRAGMA user_version = %d;", version + 1);
+
+        int rc = sqlite3_exec(db, "BEGIN;", 0, 0, &err_msg);
+        if (rc == SQLITE_OK) rc = sqlite3_exec(db, steps[version], 0, 0, &err_msg);
+        if (rc == SQLITE_OK) rc = sqlite3_exec(db, pragma, 0, 0, &err_msg);
+        if (rc == SQLITE_OK) rc = sqlite3_exec(db, "COMMIT;", 0, 0, &err_msg);
+        if (rc != SQLITE_OK) {
+            fprintf(stderr, "Schema migration to version %d failed: %s\n", version + 1, err_msg);
+            sqlite3_free(err_msg);
+            sqlite3_exec(db, "ROLLBACK;", 0, 0, NULL);
+            return -1;
+        }
+    }
+    return 0;
+}/*bring an existing database up to the current schema version*/
+static int db_profile(unsigned type, void *ctx, void *stmt, void *ns) {
+    (void)type;
+    (void)ctx;
+    metrics_statement(sqlite3_sql((sqlite3_stmt *)stmt), (long long)*(sqlite3_int64 *)ns);
+    return 0;
+}/*count every finished statement and its run time*/
+
+void db_trace_statements(int on) {
+    if (db != NULL) {
+        sqlite3_trace_v2(db, on ? SQLITE_TRACE_PROFILE : 0, on ? db_profile : NULL, NULL);
+    }
+}/*report statements to the metrics module while on*/
+
 int db_init(const char *db_path) {
     int rc = sqlite3_open(db_path, &db);
+    db_trace_statements(metrics_enabled());
 
     const char *sql = 
         "CREATE TABLE IF NOT EXISTS texts ("
@@ -26,7 +292,23 @@ int db_init(const char *db_path) {
             "max_len INTEGER,"
             "min_len INTEGER,"
             "FOREIGN KEY(text_id) REFERENCES texts(id)"
-        ");";
+        ");"
+
+        "CREATE TABLE IF NOT EXISTS token_freq ("
+            "text_id INTEGER NOT NULL,"
+            "token TEXT NOT NULL,"
+            "count INTEGER NOT NULL,"
+            "PRIMARY KEY(text_id, token),"
+            "FOREIGN KEY(text_id) REFERENCES texts(id)"
+        ") WITHOUT ROWID;"
+
+        "CREATE TABLE IF NOT EXISTS token_len_hist ("
+            "text_id INTEGER NOT NULL,"
+            "length INTEGER NOT NULL,"
+            "count INTEGER NOT NULL,"
+            "PRIMARY KEY(text_id, length),"
+            "FOREIGN KEY(text_id) REFERENCES texts(id)"
+        ") WITHOUT ROWID;";
     char *err_msg = NULL;
     rc = sqlite3_exec(db, sql, 0, 0, &err_msg);
     if (rc != SQLITE_OK) {
@@ -35,89 +317,432 @@ int db_init(const char *db_path) {
         return -1;
 }
 
+    if (db_migrate() != 0) {
+        return -1;
+    }
     
     return 0;
 }/*initialize the database*/
 
-int db_insert_text(const char *text){
-    const char *sql = "INSERT INTO texts (content) VALUES (?);";
-    sqlite3_stmt *stmt;
-    int rc;
+int db_configure(const char *journal_mode, const char *synchronous) {
+    static const char *journal_modes[] = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"};
+    static const char *sync_modes[] = {"OFF", "NORMAL", "FULL", "EXTRA"};
+    char sql[96];
+    char *err_msg = NULL;
+    int ok = 0;
 
-    rc = sqlite3_prepare_v2(db, sql, -1, &stmt, NULL); /*compile the SQL statement*/
-    if (rc != SQLITE_OK) {
-        fprintf(stderr, "Failed to prepare statement: %s\n", sqlite3_errmsg(db));
+    /*the modes are pasted into the PRAGMA text, so only accept known names*/
+    for (size_t i = 0; i < sizeof(journal_modes) / sizeof(journal_modes[0]); i++) {
+        if (sqlite3_stricmp(journal_mode, journal_modes[i]) == 0) ok |= 1;
+    }
+    for (size_t i = 0; i < sizeof(sync_modes) / sizeof(sync_modes[0]); i++) {
+        if (sqlite3_stricmp(synchronous, sync_modes[i]) == 0) ok |= 2;
+    }
+    if (ok != 3) {
+        fprintf(stderr, "Unknown journal mode '%s' or synchronous mode '%s'\n", journal_mode, synchronous);
         return -1;
     }
 
-    sqlite3_bind_text(stmt, 1, text, -1, SQLITE_STATIC); /*bind the text parameter*/
-    rc = sqlite3_step(stmt); /*execute the statement*/
-    if (rc != SQLITE_DONE) {
+    snprintf(sql, sizeof(sql), "PRAGMA journal_mode = %s; PRAGMA synchronous = %s;", journal_mode, synchronous);
+    if (sqlite3_exec(db, sql, 0, 0, &err_msg) != SQLITE_OK) {
+        fprintf(stderr, "SQL error: %s\n", err_msg);
+        sqlite3_free(err_msg);
+        return -1;
+    }
+    return 0;
+}/*set the journal and synchronous modes of the connection*/
+
+static void vocab_cache_reset(void) {
+    if (vocab_cache_ready) {
+        counter_free(&vocab_cache);
+        vocab_cache_ready = 0;
+    }
+}/*forget cached ids, a rollback may have removed them from vocab*/
+
+static void vocab_cache_forget(const char *token, size_t len) {
+    if (vocab_cache_ready) {
+        counter_entry *e = counter_add(&vocab_cache, token, len, 0);
+        if (e != NULL) {
+            e->count = 0; /*resolved again on next use*/
+        }
+    }
+}/*drop the cached id of a token removed from vocab*/
+
+long long db_token_id(const char *token, int len) {
+    size_t n = len < 0 ? strlen(token) : (size_t)len;
+
+    if (vocab_cache_ready && vocab_cache.size >= VOCAB_CACHE_MAX) {
+        vocab_cache_reset(); /*the ids stay in vocab, only the shortcut is lost*/
+    }
+    if (!vocab_cache_ready) {
+        if (counter_init(&vocab_cache, 4096) != 0) {
+            fprintf(stderr, "Memory allocation failed\n");
+            return -1;
+        }
+        vocab_cache_ready = 1;
+    }
+    counter_entry *e = counter_add(&vocab_cache, token, n, 0);
+    if (e == NULL) {
+        fprintf(stderr, "Memory allocation failed\n");
+        return -1;
+    }
+    if (e->count > 0) {
+        return e->count; /*ids start at 1, 0 means not resolved yet*/
+    }
+
+    sqlite3_stmt *stmt = db_stmt(STMT_SELECT_VOCAB);
+    if (stmt == NULL) {
+        return -1;
+    }
+    sqlite3_bind_text(stmt, 1, token, (int)n, SQLITE_STATIC);
+    int rc = sqlite3_step(stmt);
+    if (rc == SQLITE_ROW) {
+        e->count = sqlite3_column_int64(stmt, 0);
+    }
+    sqlite3_reset(stmt);
+    sqlite3_clear_bindings(stmt);
+    if (rc != SQLITE_ROW && rc != SQLITE_DONE) {
         fprintf(stderr, "Failed to execute statement: %s\n", sqlite3_errmsg(db));
-        sqlite3_finalize(stmt);
         return -1;
     }
-    sqlite3_finalize(stmt);
+
+    if (e->count == 0) {
+        stmt = db_stmt(STMT_INSERT_VOCAB);
+        if (stmt == NULL) {
+            return -1;
+        }
+        sqlite3_bind_text(stmt, 1, token, (int)n, SQLITE_STATIC);
+        if (db_step_done(stmt) < 0) {
+            return -1;
+        }
+        e->count = sqlite3_last_insert_rowid(db);
+    }
+    return e->count;
+}/*look up the vocab id of a token, adding the token on first sight*/
+
+static int db_exec(const char *sql) {
+    char *err_msg = NULL;
+    if (sqlite3_exec(db, sql, 0, 0, &err_msg) != SQLITE_OK) {
+        fprintf(stderr, "SQL error: %s\n", err_msg);
+        sqlite3_free(err_msg);
+        return -1;
+    }
+    return 0;
+}
+
+int db_begin(void) {
+    return db_exec("BEGIN IMMEDIATE;"); /*take the write lock up front instead of failing mid-text*/
+}/*start a transaction, normally one per text*/
+
+int db_commit(void) {
+    return db_exec("COMMIT;");
+}/*commit the current transaction*/
+
+int db_in_transaction(void) {
+    return !sqlite3_get_autocommit(db);
+}/*1 while a transaction is open*/
+
+int db_savepoint(const char *name) {
+    char sql[96];
+    snprintf(sql, sizeof(sql), "SAVEPOINT %s;", name);
+    return db_exec(sql);
+}/*open a nested transaction inside the current one*/
+
+int db_release(const char *name) {
+    char sql[96];
+    snprintf(sql, sizeof(sql), "RELEASE %s;", name);
+    return db_exec(sql);
+}/*keep the work done since the savepoint*/
+
+int db_rollback_to(const char *name) {
+    char sql[96];
+    snprintf(sql, sizeof(sql), "ROLLBACK TO %s; RELEASE %s;", name, name);
+    vocab_cache_reset();
+    return db_exec(sql);
+}/*undo the work done since the savepoint*/
+
+int db_rollback(void) {
+    if (sqlite3_get_autocommit(db)) {
+        return 0; /*nothing to roll back*/
+    }
+    vocab_cache_reset();
+    return db_exec("ROLLBACK;");
+}/*discard the current transaction*/
+
+int db_insert_text(const char *text){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_TEXT);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    sqlite3_bind_text(stmt, 1, text, -1, SQLITE_STATIC); /*bind the text parameter*/
+    if (db_step_done(stmt) < 0) {
+        return -1;
+    }
     return (int)sqlite3_last_insert_rowid(db);
 };/*insert a new text into the database*/
 
-int db_insert_token(int text_id, const char *token, int position){
-    const char *sql = "INSERT INTO tokens (text_id, token, position) VALUES (?, ?, ?);";
-    sqlite3_stmt *stmt;
-    int rc;
+int db_update_text(int text_id, const char *preview, int preview_len, long long bytes){
+    sqlite3_stmt *stmt = db_stmt(STMT_UPDATE_TEXT);
+    if (stmt == NULL) {
+        return -1;
+    }
 
-    rc = sqlite3_prepare_v2(db, sql, -1, &stmt, NULL); /*compile the SQL statement*/
-    if (rc != SQLITE_OK) {
-        fprintf(stderr, "Failed to prepare statement: %s\n", sqlite3_errmsg(db));
+    sqlite3_bind_text(stmt, 1, preview, preview_len, SQLITE_STATIC);
+    sqlite3_bind_int64(stmt, 2, bytes);
+    sqlite3_bind_int(stmt, 3, text_id); /*binding order: content, bytes, id*/
+    return db_step_done(stmt);
+};/*store the leading bytes and total size of a streamed text*/
+
+int db_get_text_state(int text_id, text_state *state){
+    sqlite3_stmt *stmt = db_stmt(STMT_SELECT_TEXT_STATE);
+    if (stmt == NULL) {
         return -1;
-    } /*error handling*/
+    }
 
     sqlite3_bind_int(stmt, 1, text_id);
-    sqlite3_bind_text(stmt, 2, token, -1, SQLITE_STATIC);
-    sqlite3_bind_int(stmt, 3, position); /*binding order: text_id, token, position, aligning with the SQL statement*/
-    rc = sqlite3_step(stmt); /*execute the statement*/
-    if (rc != SQLITE_DONE) {
+    int rc = sqlite3_step(stmt);
+    if (rc == SQLITE_ROW) {
+        state->bytes = sqlite3_column_int64(stmt, 0);
+        state->preview_len = sqlite3_column_int64(stmt, 1);
+        state->tokens = sqlite3_column_int64(stmt, 2);
+        state->sketched = sqlite3_column_int(stmt, 3);
+    } else if (rc != SQLITE_DONE) {
         fprintf(stderr, "Failed to execute statement: %s\n", sqlite3_errmsg(db));
-        sqlite3_finalize(stmt);
+    }
+    sqlite3_reset(stmt);
+    sqlite3_clear_bindings(stmt);
+    return rc == SQLITE_ROW ? 0 : -1;
+};/*read how far a text has been analyzed, -1 if there is no such text*/
+
+int db_append_text(int text_id, const char *preview, int preview_len, long long bytes){
+    sqlite3_stmt *stmt = db_stmt(STMT_APPEND_TEXT);
+    if (stmt == NULL) {
         return -1;
     }
-    
 
-    sqlite3_finalize(stmt);
+    sqlite3_bind_text(stmt, 1, preview, preview_len, SQLITE_STATIC);
+    sqlite3_bind_int64(stmt, 2, bytes);
+    sqlite3_bind_int(stmt, 3, text_id); /*binding order: appended content, bytes, id*/
+    return db_step_done(stmt);
+};/*extend the preview of a text and store its new total size*/
+
+int db_insert_token(int text_id, const char *token, int position){
+    if (db_insert_tokens(text_id, &token, NULL, 1, position) < 0) {
+        return -1;
+    }
     return (int)sqlite3_last_insert_rowid(db);
 };/*insert a divided token, for later statistical analysis*/
 
-int db_insert_stats(int text_id, int token_count, int avg_len, int max_len, int min_len){
-    const char *sql = "INSERT INTO stats (text_id, token_count, avg_len, max_len, min_len) VALUES (?, ?, ?, ?, ?);";
-    sqlite3_stmt *stmt; /*define a handle for the prepared statement*/
-    int rc;
-    rc = sqlite3_prepare_v2(db, sql, -1, &stmt, NULL);
-    if (rc != SQLITE_OK) {
-        fprintf(stderr, "Failed to prepare statement: %s\n", sqlite3_errmsg(db));
+int db_insert_tokens(int text_id, const char *const *tokens, const int *lens, int count, long long first_position){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_TOKEN);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    for (int i = 0; i < count; i++) {
+        long long token_id = db_token_id(tokens[i], lens != NULL ? lens[i] : -1);
+        if (token_id < 0) {
+            return -1;
+        }
+        sqlite3_bind_int(stmt, 1, text_id);
+        sqlite3_bind_int64(stmt, 2, token_id);
+        sqlite3_bind_int64(stmt, 3, first_position + i); /*binding order: text_id, token_id, position, aligning with the SQL statement*/
+        if (db_step_done(stmt) < 0) {
+            return -1;
+        }
+    }
+    return 0;
+};/*insert a batch of consecutive tokens with one reused statement*/
+
+int db_insert_token_ids(int text_id, const long long *ids, int count, long long first_position){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_TOKEN);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    for (int i = 0; i < count; i++) {
+        sqlite3_bind_int(stmt, 1, text_id);
+        sqlite3_bind_int64(stmt, 2, ids[i]);
+        sqlite3_bind_int64(stmt, 3, first_position + i); /*binding order: text_id, token_id, position*/
+        if (db_step_done(stmt) < 0) {
+            return -1;
+        }
+    }
+    return 0;
+};/*insert consecutive tokens whose vocab ids are already known*/
+
+int db_insert_stats(int text_id, long long token_count, int avg_len, int max_len, int min_len){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_STATS); /*the cached handle for the prepared statement*/
+    if (stmt == NULL) {
         return -1;
     }
 
     sqlite3_bind_int(stmt, 1, text_id);
-    sqlite3_bind_int(stmt, 2, token_count);
+    sqlite3_bind_int64(stmt, 2, token_count);
     sqlite3_bind_int(stmt, 3, avg_len);
     sqlite3_bind_int(stmt, 4, max_len);
     sqlite3_bind_int(stmt, 5, min_len); /*binding order: text_id, token_count, avg_len, max_len, min_len*/
 
-    rc = sqlite3_step(stmt);
-    if (rc != SQLITE_DONE) {
-        fprintf(stderr, "Failed to execute statement: %s\n", sqlite3_errmsg(db));
-        sqlite3_finalize(stmt);
+    return db_step_done(stmt);
+};/*insert statistical data for a text*/
+
+int db_insert_token_freq(int text_id, const char *token, long long count){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_TOKEN_FREQ);
+    if (stmt == NULL) {
+        return -1;
+    }
+    long long token_id = db_token_id(token, -1);
+    if (token_id < 0) {
         return -1;
     }
 
-    sqlite3_finalize(stmt);
-    return 0;
+    sqlite3_bind_int(stmt, 1, text_id);
+    sqlite3_bind_int64(stmt, 2, token_id);
+    sqlite3_bind_int64(stmt, 3, count); /*binding order: text_id, token_id, count*/
+    if (db_step_done(stmt) < 0) {
+        return -1;
+    }
 
+    stmt = db_stmt(STMT_UPSERT_CORPUS_TERM);
+    if (stmt == NULL) {
+        return -1;
+    }
+    sqlite3_bind_int64(stmt, 1, token_id);
+    sqlite3_bind_int64(stmt, 2, count); /*the text adds its occurrences and one document*/
+    return db_step_done(stmt);
+};/*insert the precomputed frequency of one token in a text and roll it into corpus_terms*/
 
-};/*insert statistical data for a text*/
+int db_add_token_freq(int text_id, const char *token, long long count){
+    sqlite3_stmt *stmt = db_stmt(STMT_ADD_TOKEN_FREQ);
+    if (stmt == NULL) {
+        return -1;
+    }
+    long long token_id = db_token_id(token, -1);
+    if (token_id < 0) {
+        return -1;
+    }
+
+    sqlite3_bind_int(stmt, 1, text_id);
+    sqlite3_bind_int64(stmt, 2, token_id);
+    sqlite3_bind_int64(stmt, 3, count); /*binding order: text_id, token_id, count*/
+    if (db_step_done(stmt) < 0) {
+        return -1;
+    }
+    if (sqlite3_changes(db) == 0) {
+        return db_insert_token_freq(text_id, token, count); /*new to the text, it also counts as one more document*/
+    }
+
+    stmt = db_stmt(STMT_ADD_CORPUS_TERM);
+    if (stmt == NULL) {
+        return -1;
+    }
+    sqlite3_bind_int64(stmt, 1, token_id);
+    sqlite3_bind_int64(stmt, 2, count); /*the text is already in doc_count*/
+    return db_step_done(stmt);
+};/*add occurrences of a token to a text that may already contain it, keeps corpus_terms current*/
+
+int db_insert_length_count(int text_id, int length, long long count){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_LENGTH_COUNT);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    sqlite3_bind_int(stmt, 1, text_id);
+    sqlite3_bind_int(stmt, 2, length);
+    sqlite3_bind_int64(stmt, 3, count); /*binding order: text_id, length, count*/
+    return db_step_done(stmt);
+};/*insert one bucket of the precomputed token length histogram, or add to it*/
+
+int db_refresh_stats(int text_id){
+    sqlite3_stmt *stmt = db_stmt(STMT_REFRESH_STATS);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    sqlite3_bind_int(stmt, 1, text_id);
+    return db_step_done(stmt);
+};/*recompute the stats row of a text from its length histogram, text_stats.py fills in the rest again*/
+
+static int db_step_pair(int which, long long first, long long second) {
+    sqlite3_stmt *stmt = db_stmt(which);
+    if (stmt == NULL) {
+        return -1;
+    }
+    sqlite3_bind_int64(stmt, 1, first);
+    sqlite3_bind_int64(stmt, 2, second);
+    return db_step_done(stmt);
+}/*run a cached statement that takes two integers*/
+
+int db_remove_token(int text_id, const char *token, int len, long long position, int chars){
+    long long token_id = db_token_id(token, len);
+    if (token_id < 0) {
+        return -1;
+    }
+
+    sqlite3_stmt *stmt = db_stmt(STMT_DELETE_TOKEN);
+    if (stmt == NULL) {
+        return -1;
+    }
+    sqlite3_bind_int(stmt, 1, text_id);
+    sqlite3_bind_int64(stmt, 2, token_id);
+    sqlite3_bind_int64(stmt, 3, position); /*binding order: text_id, token_id, position*/
+    if (db_step_done(stmt) < 0) {
+        return -1;
+    }
+    if (sqlite3_changes(db) != 1) {
+        fprintf(stderr, "Text %d does not end in the token its input ends in, was the input changed?\n", text_id);
+        return -1;
+    }
+
+    /*the frequency row goes when its count does, and with it the text's share of doc_count*/
+    if (db_add_token_freq(text_id, token, -1) < 0 || db_step_pair(STMT_DROP_TOKEN_FREQ, text_id, token_id) < 0) {
+        return -1;
+    }
+    if (sqlite3_changes(db) > 0) {
+        if (db_step_pair(STMT_DROP_CORPUS_DOC, token_id, 0) < 0 || db_step_pair(STMT_DELETE_CORPUS_TERM, token_id, 0) < 0) {
+            return -1;
+        }
+        /*no exact text has the token any more; unless a sketched text's rows use it, vocab loses it too*/
+        if (sqlite3_changes(db) > 0) {
+            if (db_step_pair(STMT_DROP_VOCAB, token_id, 0) < 0) {
+                return -1;
+            }
+            if (sqlite3_changes(db) > 0) {
+                vocab_cache_forget(token, (size_t)len);
+            }
+        }
+    }
+    if (db_insert_length_count(text_id, chars, -1) < 0) {
+        return -1;
+    }
+    return db_step_pair(STMT_DROP_LENGTH_COUNT, text_id, chars);
+};/*take the token at a text's last position back out of tokens and the aggregates, the stats row is refreshed by the append*/
+
+int db_insert_sketch(int text_id, int format, long long tokens, long long distinct,
+                     const void *topk, int topk_len, const void *cms, int cms_len, const void *hll, int hll_len){
+    sqlite3_stmt *stmt = db_stmt(STMT_INSERT_SKETCH);
+    if (stmt == NULL) {
+        return -1;
+    }
+
+    sqlite3_bind_int(stmt, 1, text_id);
+    sqlite3_bind_int(stmt, 2, format);
+    sqlite3_bind_int64(stmt, 3, tokens);
+    sqlite3_bind_int64(stmt, 4, distinct);
+    sqlite3_bind_blob(stmt, 5, topk, topk_len, SQLITE_STATIC);
+    sqlite3_bind_blob(stmt, 6, cms, cms_len, SQLITE_STATIC);
+    sqlite3_bind_blob(stmt, 7, hll, hll_len, SQLITE_STATIC); /*binding order: text_id, format, tokens, distinct, topk, cms, hll*/
+    return db_step_done(stmt);
+};/*insert the serialized sketches of a text*/
 
 void db_close(void){
     if (db != NULL) {
+        for (int i = 0; i < STMT_COUNT; i++) {
+            sqlite3_finalize(stmt_cache[i]); /*finalizing NULL is a no-op*/
+            stmt_cache[i] = NULL;
+        }
+        vocab_cache_reset();
         int rc = sqlite3_close(db);
         if (rc != SQLITE_OK) {
             fprintf(stderr, "Failed to close database: %s\n", sqlite3_errmsg(db));
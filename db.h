@@ -6,14 +6,66 @@
 #include <sqlite3.h>
 #include <stdio.h>
 #define DB_PATH "analysis.db"
+#define DB_JOURNAL_MODE "WAL"
+#define DB_SYNCHRONOUS "NORMAL"
+
+typedef struct {
+    long long bytes;       /*input analyzed so far, where an append continues*/
+    long long tokens;      /*tokens so far, also the last position used*/
+    long long preview_len; /*bytes stored in texts.content*/
+    int sketched;          /*analyzed in sketch mode*/
+} text_state;
 
 int db_init(const char *db_path);/*initialize the database*/
 
+int db_configure(const char *journal_mode, const char *synchronous);/*set journal and synchronous modes, e.g. "WAL" and "NORMAL"*/
+
+int db_begin(void);/*start a transaction, normally one per text*/
+
+int db_commit(void);/*commit the current transaction*/
+
+int db_rollback(void);/*discard the current transaction, no-op outside one*/
+
+int db_in_transaction(void);/*1 while a transaction is open*/
+
+int db_savepoint(const char *name);/*open a nested transaction, name must be a plain identifier*/
+
+int db_release(const char *name);/*keep the work done since the savepoint*/
+
+int db_rollback_to(const char *name);/*undo the work done since the savepoint*/
+
 int db_insert_text(const char *text);/*insert a new text into the database*/
 
+int db_update_text(int text_id, const char *preview, int preview_len, long long bytes);/*store the leading bytes and total size of a streamed text*/
+
+int db_get_text_state(int text_id, text_state *state);/*read how far a text has been analyzed, -1 if there is no such text*/
+
+int db_append_text(int text_id, const char *preview, int preview_len, long long bytes);/*extend the stored preview of a text and set its new total size*/
+
 int db_insert_token(int text_id, const char *token, int position);/*insert a divided token, for later statistical analysis*/
 
-int db_insert_stats(int text_id, int token_count, int avg_len, int max_len, int min_len);/*insert statistical data for a text*/
+int db_insert_tokens(int text_id, const char *const *tokens, const int *lens, int count, long long first_position);/*insert a batch of consecutive tokens as vocab ids, lens may be NULL for NUL terminated tokens*/
+
+int db_insert_token_ids(int text_id, const long long *ids, int count, long long first_position);/*insert a batch of consecutive tokens given by vocab id*/
+
+long long db_token_id(const char *token, int len);/*vocab id of a token, added to vocab when new, len -1 for a NUL terminated token*/
+
+int db_insert_stats(int text_id, long long token_count, int avg_len, int max_len, int min_len);/*insert statistical data for a text*/
+
+int db_insert_token_freq(int text_id, const char *token, long long count);/*insert the precomputed frequency of one token in a text, updates the corpus rollup*/
+
+int db_add_token_freq(int text_id, const char *token, long long count);/*add occurrences to the frequency of a token in an existing text, updates the corpus rollup*/
+
+int db_insert_length_count(int text_id, int length, long long count);/*insert one bucket of the precomputed token length histogram, adds to an existing bucket*/
+
+int db_refresh_stats(int text_id);/*recompute the stats row of an appended text from its length histogram*/
+
+int db_remove_token(int text_id, const char *token, int len, long long position, int chars);/*undo the last token of a text, chars is its length in characters*/
+
+int db_insert_sketch(int text_id, int format, long long tokens, long long distinct,
+                     const void *topk, int topk_len, const void *cms, int cms_len, const void *hll, int hll_len);/*insert the serialized sketches of a text analyzed in sketch mode*/
+
+void db_trace_statements(int on);/*count statements in the metrics report, on by default while metrics are enabled*/
 
 void db_close(void);/*close the database connection*/
 #endif
\ No newline at end of file
@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+import db_queries
+
+# What the GUI info panels show, see db_queries.DASHBOARD
+Dashboard = namedtuple("Dashboard", ["text_count", "token_total", "total_bytes", "vocab_size", "recent"])
+
+def parse_id_ranges(spec, conn=None):
+    """Expand "1-100,205" into text ids, "all" means every analyzed text and reads them from conn
+
+    Raises ValueError for an empty part or bound and for a range that ends before it starts.
+    """
+    if spec == "all":
+        return [row[0] for row in conn.execute(db_queries.ALL_TEXT_IDS.sql)]
+    ids = []
+    for part in spec.split(","):
+        first, dash, last = (bound.strip() for bound in part.partition("-"))
+        if not first or (dash and not last):
+            raise ValueError(f"incomplete text id range {part.strip()!r} in {spec!r}")
+        start = int(first)
+        end = int(last) if dash else start
+        if end < start:
+            raise ValueError(f"text id range {part.strip()!r} ends before it starts")
+        ids.extend(range(start, end + 1))
+    return ids
+
+class Database:
+    """Long-lived read connections to the analysis database, one per thread
+
+    The GUI thread and each background worker keep their own connection for
+    the whole session, so refreshes skip the connect and schema load and reuse
+    the statements sqlite3 caches per connection. Connections are query_only;
+    with the analyzer's WAL journal they read while an analysis is writing.
+    """
+
+    def __init__(self, path, busy_timeout_ms=2000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+            try:
+                # WAL is a property of the file, readers then never block the analyzer
+                conn.execute("PRAGMA journal_mode = WAL")
+            except sqlite3.OperationalError:
+                pass  # locked by a writer right now, it will already be in WAL mode
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def fetchall(self, query, params=()):
+        """Run a db_queries.Query and return all rows, no read stays open afterwards"""
+        return self.connection().execute(query.sql, params).fetchall()
+
+    def fetchone(self, query, params=()):
+        cursor = self.connection().execute(query.sql, params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def dashboard(self, recent=10):
+        """Summary counters and the newest texts in one query, constant time in the database size
+
+        Databases without db_meta yet are counted with the legacy queries until
+        the analyzer has migrated them.
+        """
+        try:
+            row = self.fetchone(db_queries.DASHBOARD, (recent,))
+        except sqlite3.OperationalError:
+            row = self._legacy_dashboard(recent)
+        return Dashboard(*row[:4], [tuple(pair) for pair in json.loads(row[4])])
+
+    def _legacy_dashboard(self, recent):
+        for sql in db_queries.LEGACY_DASHBOARD_SQL[:-1]:
+            try:
+                return self.connection().execute(sql, (recent,)).fetchone()
+            except sqlite3.OperationalError:
+                continue
+        return self.connection().execute(db_queries.LEGACY_DASHBOARD_SQL[-1], (recent,)).fetchone()
+
+    def text_exists(self, text_id):
+        return self.fetchone(db_queries.TEXT_EXISTS, (text_id,))[0] > 0
+
+    def close(self):
+        """Close every connection, call once the worker threads are done"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
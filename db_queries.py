@@ -0,0 +1,320 @@
+import sqlite3
+import sys
+from collections import namedtuple
+
+# Every query the Python side runs against analysis.db lives here, so the
+# planner audit below covers all of them. `scans` names the tables a query is
+# allowed to walk without an index, with the reason next to the query.
+Query = namedtuple("Query", ["sql", "params", "scans"])
+
+# Walks the count index and stops after LIMIT rows, so vocab is only joined for the top tokens
+TOP_TOKEN_FREQUENCIES = Query("""
+    SELECT vocab.token, token_freq.count
+    FROM token_freq
+    JOIN vocab ON vocab.id = token_freq.token_id
+    WHERE token_freq.text_id = ?
+    ORDER BY token_freq.count DESC
+    LIMIT ?
+""", (1, 200), ())
+
+TOKEN_LENGTHS = Query("""
+    SELECT length, count
+    FROM token_len_hist
+    WHERE text_id = ?
+    ORDER BY length
+""", (1,), ())
+
+# Frequency of frequencies: how many distinct tokens occur exactly `count`
+# times, most frequent first. Walks the count index in order, so SQLite
+# groups millions of token_freq rows into a few thousand without sorting.
+FREQUENCY_SPECTRUM = Query("""
+    SELECT count, COUNT(*)
+    FROM token_freq
+    WHERE text_id = ?
+    GROUP BY count
+    ORDER BY count DESC
+""", (1,), ())
+
+# Distribution statistics computed by text_stats.py, NULL until it has run on the text
+TEXT_DISTRIBUTION_STATS = Query("""
+    SELECT token_count, avg_len, min_len, max_len, distinct_tokens,
+           median_len, p90_len, p99_len, len_stddev,
+           entropy, type_token_ratio, hapax_ratio, zipf_exponent, zipf_r2
+    FROM stats
+    WHERE text_id = ?
+""", (1,), ())
+
+STORE_DISTRIBUTION_STATS = Query("""
+    UPDATE stats
+    SET distinct_tokens = ?, median_len = ?, p90_len = ?, p99_len = ?, len_stddev = ?,
+        entropy = ?, type_token_ratio = ?, hapax_ratio = ?, zipf_exponent = ?, zipf_r2 = ?
+    WHERE text_id = ?
+""", (0, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1), ())
+
+# Fallback for texts analyzed before token_freq existed, groups on the integer ids
+TOKEN_FREQUENCIES_FROM_TOKENS = Query("""
+    SELECT vocab.token, grouped.frequency
+    FROM (
+        SELECT token_id, COUNT(*) as frequency
+        FROM tokens
+        WHERE text_id = ?
+        GROUP BY token_id
+    ) AS grouped
+    JOIN vocab ON vocab.id = grouped.token_id
+""", (1,), ("grouped",))  # walks its own materialized result, one row per distinct token
+
+# Corpus views read the corpus_terms rollup, never the per-text tables of other texts.
+# Walks the term count index and stops after LIMIT rows.
+CORPUS_TOP_TERMS = Query("""
+    SELECT vocab.token, corpus_terms.term_count, corpus_terms.doc_count
+    FROM corpus_terms
+    JOIN vocab ON vocab.id = corpus_terms.token_id
+    ORDER BY corpus_terms.term_count DESC
+    LIMIT ?
+""", (20,), ("corpus_terms",))
+
+# One row per distinct token of the text, scored in Python
+TEXT_TERM_DOC_COUNTS = Query("""
+    SELECT token_freq.token_id, token_freq.count, corpus_terms.doc_count
+    FROM token_freq
+    JOIN corpus_terms ON corpus_terms.token_id = token_freq.token_id
+    WHERE token_freq.text_id = ?
+""", (1,), ())
+
+# Top tokens by id, for views that combine several texts before looking up the strings
+TOP_TOKEN_IDS = Query("""
+    SELECT token_id, count
+    FROM token_freq
+    WHERE text_id = ?
+    ORDER BY count DESC
+    LIMIT ?
+""", (1, 20), ())
+
+# The id lists are passed as a JSON array, json_each walks only that array.
+# CROSS JOIN keeps the ids as the outer loop, left to itself the planner walks
+# every token_freq row of the text once per id.
+TOKEN_COUNTS_FOR_IDS = Query("""
+    SELECT token_freq.token_id, token_freq.count
+    FROM json_each(?2) AS ids
+    CROSS JOIN token_freq ON token_freq.text_id = ?1 AND token_freq.token_id = ids.value
+""", (1, "[1, 2]"), ("ids",))
+
+# Same by token string, for views mixing exact texts with sketched ones (vis.py --approx)
+TOKEN_COUNTS_FOR_TOKENS = Query("""
+    SELECT vocab.token, token_freq.count
+    FROM json_each(?2) AS tokens
+    CROSS JOIN vocab ON vocab.token = tokens.value
+    CROSS JOIN token_freq ON token_freq.text_id = ?1 AND token_freq.token_id = vocab.id
+""", (1, '["a", "b"]'), ("tokens",))
+
+VOCAB_TOKENS_FOR_IDS = Query("""
+    SELECT vocab.id, vocab.token
+    FROM json_each(?) AS ids
+    JOIN vocab ON vocab.id = ids.value
+""", ("[1, 2]",), ("ids",))
+
+# Serialized sketches of a text analyzed with --sketch, see sketch.py
+TEXT_SKETCH = Query("""
+    SELECT format, tokens, distinct_estimate, topk, cms
+    FROM sketches
+    WHERE text_id = ?
+""", (1,), ())
+
+TEXT_TOKEN_COUNT = Query("SELECT token_count FROM stats WHERE text_id = ?", (1,), ())
+
+# What a rendered chart of a text depends on, see render_cache.py
+TEXT_DATA_VERSION = Query("""
+    SELECT texts.bytes, stats.token_count
+    FROM texts
+    LEFT JOIN stats ON stats.text_id = texts.id
+    WHERE texts.id = ?
+""", (1,), ())
+
+# Changes whenever a text is added to the corpus, read from the db_meta counters
+CORPUS_DATA_VERSION = Query("""
+    SELECT
+        (SELECT value FROM db_meta WHERE key = 'text_count'),
+        (SELECT value FROM db_meta WHERE key = 'token_count')
+""", (), ())
+
+# Every text for batch rendering, in rowid order
+ALL_TEXT_IDS = Query("SELECT id FROM texts ORDER BY id", (), ("texts",))
+
+# Number of analyzed texts
+DOCUMENT_COUNT = Query("SELECT value FROM db_meta WHERE key = 'text_count'", (), ())
+
+# Databases the analyzer has not migrated yet still keep the token text in tokens.
+# Not audited, it only runs against that old schema.
+LEGACY_TOKEN_FREQUENCIES_SQL = """
+    SELECT token, COUNT(*) as frequency
+    FROM tokens
+    WHERE text_id = ?
+    GROUP BY token
+"""
+
+# TEXT_DATA_VERSION and CORPUS_DATA_VERSION for databases from before texts.bytes
+# and db_meta, so charts of an unmigrated database are still cached. Not audited.
+LEGACY_TEXT_DATA_VERSION_SQL = """
+    SELECT LENGTH(texts.content), stats.token_count
+    FROM texts
+    LEFT JOIN stats ON stats.text_id = texts.id
+    WHERE texts.id = ?
+"""
+
+LEGACY_CORPUS_DATA_VERSION_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM texts),
+        (SELECT COALESCE(SUM(token_count), 0) FROM stats)
+"""
+
+# Columnar export and import, see export.py. Tokens come back in index
+# order and are put in position order by the exporter.
+EXPORT_TEXT = Query("""
+    SELECT texts.id, texts.bytes, texts.content,
+           stats.token_count, stats.avg_len, stats.max_len, stats.min_len
+    FROM texts
+    LEFT JOIN stats ON stats.text_id = texts.id
+    WHERE texts.id = ?
+""", (1,), ())
+
+EXPORT_TEXT_TOKENS = Query("""
+    SELECT position, token_id
+    FROM tokens
+    WHERE text_id = ?
+""", (1,), ())
+
+EXPORT_TEXT_FREQUENCIES = Query("""
+    SELECT token_id, count
+    FROM token_freq
+    WHERE text_id = ?
+""", (1,), ())
+
+# Largest vocab id, picks the width of the exported token column
+VOCAB_MAX_ID = Query("SELECT MAX(id) FROM vocab", (), ())
+
+# Migrations applied to a database, see db_migrate() in db.c
+SCHEMA_VERSION = Query("PRAGMA user_version", (), ())
+
+IMPORT_TEXT = Query("INSERT INTO texts (content, bytes) VALUES (?, ?)", ("", 0), ())
+
+IMPORT_STATS = Query("""
+    INSERT INTO stats (text_id, token_count, avg_len, max_len, min_len)
+    VALUES (?, ?, ?, ?, ?)
+""", (1, 0, 0, 0, 0), ())
+
+IMPORT_LENGTH_COUNT = Query("INSERT INTO token_len_hist (text_id, length, count) VALUES (?, ?, ?)", (1, 1, 1), ())
+
+IMPORT_TOKEN_FREQUENCY = Query("INSERT INTO token_freq (text_id, token_id, count) VALUES (?, ?, ?)", (1, 1, 1), ())
+
+# Same rollup as db_insert_token_freq in db.c
+IMPORT_CORPUS_TERM = Query("""
+    INSERT INTO corpus_terms (token_id, term_count, doc_count) VALUES (?1, ?2, 1)
+    ON CONFLICT(token_id) DO UPDATE SET term_count = term_count + ?2, doc_count = doc_count + 1
+""", (1, 1), ())
+
+IMPORT_TOKEN = Query("INSERT INTO tokens (text_id, token_id, position) VALUES (?, ?, ?)", (1, 1, 1), ())
+
+# Exported tokens are matched to the target's vocab ids by string, a batch
+# at a time as a JSON array; key is the index of the token in the array
+IMPORT_VOCAB = Query("""
+    INSERT OR IGNORE INTO vocab (token)
+    SELECT value FROM json_each(?)
+""", ('["a", "b"]',), ("json_each",))
+
+IMPORT_VOCAB_IDS = Query("""
+    SELECT tokens.key, vocab.id
+    FROM json_each(?) AS tokens
+    JOIN vocab ON vocab.token = tokens.value
+""", ('["a", "b"]',), ("tokens",))
+
+TEXT_EXISTS = Query("SELECT COUNT(*) FROM texts WHERE id = ?", (1,), ())
+
+# Everything the GUI info panels show, in one round trip. The totals come from
+# the db_meta counters the schema triggers maintain, so no table is counted.
+# recent is a JSON array of [id, bytes] pairs, newest first, found by walking
+# the rowid backwards and stopping after LIMIT rows.
+DASHBOARD = Query("""
+    SELECT
+        (SELECT value FROM db_meta WHERE key = 'text_count'),
+        (SELECT value FROM db_meta WHERE key = 'token_count'),
+        (SELECT value FROM db_meta WHERE key = 'total_bytes'),
+        (SELECT value FROM db_meta WHERE key = 'vocab_size'),
+        (SELECT json_group_array(json_array(id, bytes))
+         FROM (SELECT id, COALESCE(bytes, LENGTH(content)) AS bytes
+               FROM texts ORDER BY id DESC LIMIT ?))
+""", (10,), ("texts",))
+
+# DASHBOARD for databases the analyzer has not migrated to db_meta yet, counted
+# the slow way. The first is for schema versions 4 and 5 (vocab and texts.bytes),
+# the second for older ones that still keep the token text in tokens, like the
+# shipped analysis.db. Not audited, they only run against those old schemas.
+LEGACY_DASHBOARD_SQL = (
+    """
+    SELECT
+        (SELECT COUNT(*) FROM texts),
+        (SELECT COUNT(*) FROM tokens),
+        (SELECT COALESCE(SUM(COALESCE(bytes, LENGTH(CAST(content AS BLOB)))), 0) FROM texts),
+        (SELECT COUNT(*) FROM vocab),
+        (SELECT json_group_array(json_array(id, bytes))
+         FROM (SELECT id, COALESCE(bytes, LENGTH(CAST(content AS BLOB))) AS bytes
+               FROM texts ORDER BY id DESC LIMIT ?))
+    """,
+    """
+    SELECT
+        (SELECT COUNT(*) FROM texts),
+        (SELECT COUNT(*) FROM tokens),
+        (SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM texts),
+        (SELECT COUNT(DISTINCT token) FROM tokens),
+        (SELECT json_group_array(json_array(id, bytes))
+         FROM (SELECT id, LENGTH(CAST(content AS BLOB)) AS bytes
+               FROM texts ORDER BY id DESC LIMIT ?))
+    """,
+)
+
+ALL_QUERIES = {
+    name: value for name, value in sorted(globals().items())
+    if isinstance(value, Query)
+}
+
+def plan_problems(conn, query):
+    """Return the EXPLAIN QUERY PLAN lines that show an unindexed scan or a sort"""
+    problems = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + query.sql, query.params):
+        detail = row[-1]
+        words = detail.split()
+        if words[:1] == ["SCAN"]:
+            table = words[1] if len(words) > 1 else ""
+            # A constant row or an unnamed subquery's own result is not a table
+            if detail == "SCAN CONSTANT ROW" or table.startswith("(subquery"):
+                continue
+            if table not in query.scans:
+                problems.append(detail)
+        elif "USE TEMP B-TREE" in detail:
+            problems.append(detail)
+    return problems
+
+def audit(db_path="analysis.db"):
+    """Check every shipped query against the schema in db_path, return True if all use an index"""
+    conn = sqlite3.connect(db_path)
+    ok = True
+    try:
+        for name, query in ALL_QUERIES.items():
+            try:
+                problems = plan_problems(conn, query)
+            except sqlite3.OperationalError as e:
+                print(f"{name}: cannot plan: {e}")
+                ok = False
+                continue
+            if problems:
+                ok = False
+                print(f"{name}: " + "; ".join(problems))
+            else:
+                print(f"{name}: ok")
+    finally:
+        conn.close()
+    return ok
+
+if __name__ == "__main__":
+    # Usage: python db_queries.py [analysis.db]
+    # Run the analyzer on the database first so the schema migrations are applied
+    sys.exit(0 if audit(sys.argv[1] if len(sys.argv) > 1 else "analysis.db") else 1)
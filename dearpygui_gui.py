@@ -1,8 +1,9 @@
 import dearpygui.dearpygui as dpg
 import subprocess
-import sqlite3
 import os
 import sys
+import text_analyzer
+import db_access
 
 # 创建上下文
 dpg.create_context()
@@ -10,9 +11,19 @@ dpg.create_context()
 # 全局变量
 text_id = None
 analysis_db = "analysis.db"
+database = db_access.Database(analysis_db)  # 长期保持的只读连接，刷新时不再重复连接
+analyzer = None  # 进程内分析器，整个会话共用一个数据库连接
+
+def get_analyzer():
+    """返回进程内分析器，共享库未编译时返回None"""
+    global analyzer
+    if analyzer is None and text_analyzer.is_available():
+        analyzer = text_analyzer.Analyzer(analysis_db)
+    return analyzer
 
 def analyze_text_callback():
     """分析文本回调函数"""
+    global text_id
     text = dpg.get_value("input_text")
     
     if not text.strip():
@@ -20,6 +31,22 @@ def analyze_text_callback():
         return
         
     try:
+        # 有共享库时在进程内分析，不必每次启动分析器进程
+        lib_analyzer = get_analyzer()
+        if lib_analyzer is not None:
+            result = lib_analyzer.analyze(text)
+            
+            text_id = result.text_id
+            dpg.set_value("analysis_output",
+                          f"Found and saved {result.tokens} tokens\n"
+                          f"Distinct tokens: {result.distinct_tokens}\n"
+                          f"Bytes analyzed: {result.bytes}\n"
+                          f"Analysis complete! Text ID: {text_id}\n")
+            dpg.set_value("text_id_input", str(text_id))
+            dpg.set_value("status_text", f"Analysis complete! Text ID: {text_id}")
+            refresh_database_info()
+            return
+        
         # 运行分析器
         result = subprocess.run(
             ["./text_analyzer.exe"],
@@ -37,12 +64,10 @@ def analyze_text_callback():
         for line in lines:
             if "Text ID:" in line:
                 try:
-                    global text_id
                     text_id = int(line.split(":")[-1].strip())
                     dpg.set_value("text_id_input", str(text_id))
                     dpg.set_value("status_text", f"Analysis complete! Text ID: {text_id}")
                     refresh_database_info()
-                    refresh_available_ids()
                     return
                 except ValueError:
                     pass
@@ -98,12 +123,7 @@ def generate_visualizations_callback():
         
     try:
         # 检查数据库中是否存在该text_id
-        conn = sqlite3.connect(analysis_db)
-        cursor = conn.execute("SELECT COUNT(*) FROM texts WHERE id = ?", (text_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        if count == 0:
+        if not database.text_exists(text_id):
             dpg.set_value("status_text", f"No text found with ID {text_id}")
             return
             
@@ -124,52 +144,36 @@ def generate_visualizations_callback():
         dpg.set_value("status_text", f"Visualization failed:\n{str(e)}")
 
 def refresh_database_info():
-    """刷新数据库信息"""
+    """刷新数据库信息和可用ID列表，两者共用一次查询"""
     try:
-        conn = sqlite3.connect(analysis_db)
-        
-        # 获取文本总数
-        cursor = conn.execute("SELECT COUNT(*) FROM texts")
-        texts_count = cursor.fetchone()[0]
-        
-        # 获取tokens总数
-        cursor = conn.execute("SELECT COUNT(*) FROM tokens")
-        tokens_count = cursor.fetchone()[0]
-        
-        # 获取最新的文本ID
-        cursor = conn.execute("SELECT id, LENGTH(content) FROM texts ORDER BY id DESC LIMIT 5")
-        latest_texts = cursor.fetchall()
-        
-        conn.close()
-        
-        # 显示信息
+        dashboard = database.dashboard(10)
+    except Exception as e:
+        for tag in ("database_info", "available_ids"):
+            if dpg.does_item_exist(tag):
+                dpg.set_value(tag, f"Failed to get database info:\n{str(e)}")
+        return
+    
+    # 显示信息
+    if dpg.does_item_exist("database_info"):
         info = f"Database: {analysis_db}\n"
-        info += f"Total texts analyzed: {texts_count}\n"
-        info += f"Total tokens: {tokens_count}\n\n"
+        info += f"Total texts analyzed: {dashboard.text_count}\n"
+        info += f"Total tokens: {dashboard.token_total}\n"
+        info += f"Total bytes: {dashboard.total_bytes}\n"
+        info += f"Distinct tokens: {dashboard.vocab_size}\n\n"
         info += "Latest texts:\n"
         
-        for text_id, content_length in latest_texts:
-            info += f"  ID {text_id}: {content_length} characters\n"
+        for text_id, text_bytes in dashboard.recent[:5]:
+            info += f"  ID {text_id}: {text_bytes} bytes\n"
             
         dpg.set_value("database_info", info)
-        
-    except Exception as e:
-        dpg.set_value("database_info", f"Failed to get database info:\n{str(e)}")
-
-def refresh_available_ids():
-    """刷新可用ID列表"""
-    try:
-        conn = sqlite3.connect(analysis_db)
-        cursor = conn.execute("SELECT id FROM texts ORDER BY id DESC LIMIT 10")
-        ids = [str(row[0]) for row in cursor.fetchall()]
-        conn.close()
-        
+    
+    # 可用ID列表
+    if dpg.does_item_exist("available_ids"):
+        ids = [str(row[0]) for row in dashboard.recent]
         if ids:
             dpg.set_value("available_ids", "Available IDs: " + ", ".join(ids))
         else:
             dpg.set_value("available_ids", "No texts analyzed yet")
-    except Exception as e:
-        dpg.set_value("available_ids", f"Error: {str(e)}")
 
 # ==================== 可自定义部分 1: 文件对话框 ====================
 # 创建文件对话框
@@ -209,7 +213,7 @@ with dpg.window(label="Text Analyzer", width=1000, height=700, tag="main_window"
     
     # 可用ID文本
     dpg.add_text("", tag="available_ids")
-    refresh_available_ids()
+    refresh_database_info()
     
     # ==================== 可自定义部分 4: 主内容区域 ====================
     with dpg.tab_bar():
@@ -265,5 +269,8 @@ dpg.show_viewport()
 # 启动主循环
 dpg.start_dearpygui()
 
+# 关闭数据库连接
+database.close()
+
 # 销毁上下文
 dpg.destroy_context()
\ No newline at end of file
@@ -0,0 +1,459 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.parse
+import zipfile
+import numpy as np
+import db_access
+import db_queries
+
+# Columnar copies of analysis.db for offline analysis with NumPy or pandas.
+# An export is a directory with manifest.json and the columns in one layout:
+#   npy      one .npy file per column, opened with np.load(mmap_mode="r") so a
+#            text's tokens are a slice of the mapped file, nothing is copied
+#   npz      the same arrays deflate-compressed into data.npz, a column is
+#            decompressed whole on first use
+#   parquet  one zstd-compressed file per table, needs pyarrow
+# Tables, in every layout:
+#   texts           id, bytes, content, token_count, avg_len, max_len, min_len, token_offset
+#   token_len_hist  text_id, length, count
+#   token_freq      text_id, token_id, count
+#   vocab           id, token, only the tokens the exported texts use
+#   tokens          token_id in position order, text after text, so a text's tokens
+#                   are tokens[token_offset:token_offset + token_count]. Parquet also
+#                   stores text_id and position, with one row group per text
+# In npy and npz a string column is a uint8 array of the UTF-8 bytes plus a
+# "<column>.offsets" int64 array, string i is bytes[offsets[i]:offsets[i + 1]].
+# Ids are those of the source database; import gives the texts new ones.
+# Texts analyzed with --sketch are exported without their sketches; import
+# counts their token_freq rows from the tokens, so they come back as exact texts.
+
+EXPORT_FORMAT = 1
+LAYOUTS = ("npy", "npz", "parquet")
+MANIFEST = "manifest.json"
+FETCH_ROWS = 1 << 16  # token rows per fetch, the export never holds more than one text's tokens
+VOCAB_BATCH = 50000   # tokens per JSON array when matching vocab on import
+
+def have_pyarrow():
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def resolve_layout(layout):
+    """"auto" is parquet when pyarrow is installed, npy otherwise"""
+    if layout == "auto":
+        return "parquet" if have_pyarrow() else "npy"
+    if layout == "parquet" and not have_pyarrow():
+        raise ValueError("The parquet layout needs pyarrow (pip install pyarrow), or use --layout=npy")
+    return layout
+
+def encode_strings(strings):
+    """(uint8 bytes, int64 offsets) of a string column"""
+    encoded = [s.encode("utf-8", "surrogateescape") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def decode_strings(data, offsets, indices=None):
+    """Strings of a column, all of them or those at indices"""
+    raw = bytes(data)
+    if indices is None:
+        indices = range(len(offsets) - 1)
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8", "surrogateescape") for i in indices]
+
+class ArrayWriter:
+    """Writes the columns of an npy or npz export, large columns in chunks"""
+
+    def __init__(self, path, layout):
+        self.path = path
+        self._zip = None
+        if layout == "npz":
+            self._zip = zipfile.ZipFile(os.path.join(path, "data.npz"), "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def _open(self, name):
+        if self._zip is not None:
+            return self._zip.open(name + ".npy", "w", force_zip64=True)
+        return open(os.path.join(self.path, name + ".npy"), "wb")
+
+    def array(self, name, values):
+        with self._open(name) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(values))
+
+    def table(self, table, columns):
+        for name, values in columns.items():
+            if isinstance(values, list):
+                data, offsets = encode_strings(values)
+                self.array(f"{table}.{name}", data)
+                self.array(f"{table}.{name}.offsets", offsets)
+            else:
+                self.array(f"{table}.{name}", values)
+
+    @contextlib.contextmanager
+    def tokens(self, length, dtype):
+        """Yield write(text_id, token_ids), called text by text for `length` tokens in all"""
+        dtype = np.dtype(dtype)
+        written = [0]
+        with self._open("tokens.token_id") as f:
+            header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (length,)}
+            np.lib.format.write_array_header_2_0(f, header)
+
+            def write(text_id, token_ids):
+                f.write(np.ascontiguousarray(token_ids, dtype=dtype).tobytes())
+                written[0] += len(token_ids)
+
+            yield write
+        if written[0] != length:
+            raise ValueError(f"Wrote {written[0]} tokens, the header promised {length}")
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+class ParquetWriter:
+    """Writes the tables of a parquet export"""
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+
+    def table(self, table, columns):
+        arrays = {name: self.pa.array(values) for name, values in columns.items()}
+        self.pq.write_table(self.pa.table(arrays), os.path.join(self.path, table + ".parquet"), compression="zstd")
+
+    @contextlib.contextmanager
+    def tokens(self, length, dtype):
+        schema = self.pa.schema([("text_id", self.pa.int64()), ("position", self.pa.int64()),
+                                 ("token_id", self.pa.from_numpy_dtype(np.dtype(dtype)))])
+        with self.pq.ParquetWriter(os.path.join(self.path, "tokens.parquet"), schema, compression="zstd") as writer:
+
+            def write(text_id, token_ids):
+                writer.write_table(self.pa.table({
+                    "text_id": np.full(len(token_ids), text_id, dtype=np.int64),
+                    "position": np.arange(1, len(token_ids) + 1, dtype=np.int64),
+                    "token_id": np.asarray(token_ids, dtype=dtype),
+                }, schema=schema), row_group_size=max(1, len(token_ids)))
+
+            yield write
+
+    def close(self):
+        pass
+
+def read_text_tokens(conn, text_id, count, dtype):
+    """Token ids of a text in position order, fetched in chunks and placed by position"""
+    token_ids = np.zeros(count, dtype=dtype)
+    seen = 0
+    cursor = conn.execute(db_queries.EXPORT_TEXT_TOKENS.sql, (text_id,))
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        positions = chunk[:, 0] - 1
+        if positions.min() < 0 or positions.max() >= count:
+            raise ValueError(f"Text ID {text_id} has token positions outside 1..{count}")
+        token_ids[positions] = chunk[:, 1]
+        seen += len(rows)
+    if seen != count:
+        raise ValueError(f"Text ID {text_id} has {seen} token rows but a token count of {count}")
+    return token_ids
+
+def read_pairs(conn, query, text_id):
+    """An (n, 2) int64 array of a two column query"""
+    return np.array(conn.execute(query.sql, (text_id,)).fetchall(), dtype=np.int64).reshape(-1, 2)
+
+def lookup_vocab(conn, token_ids):
+    """Token strings of vocab ids, in the order of token_ids"""
+    tokens = {}
+    for start in range(0, len(token_ids), VOCAB_BATCH):
+        batch = json.dumps(token_ids[start:start + VOCAB_BATCH].tolist())
+        tokens.update(conn.execute(db_queries.VOCAB_TOKENS_FOR_IDS.sql, (batch,)).fetchall())
+    return [tokens[token_id] for token_id in token_ids.tolist()]
+
+def export(db_path, out_dir, text_ids, layout="auto"):
+    """Write the given texts of a database to out_dir, returns the manifest"""
+    layout = resolve_layout(layout)
+    os.makedirs(out_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    # Tokens are split on bytes, so a token is not always valid UTF-8; keep its bytes as they are
+    conn.text_factory = lambda b: b.decode("utf-8", "surrogateescape")
+    writer = ParquetWriter(out_dir) if layout == "parquet" else ArrayWriter(out_dir, layout)
+    try:
+        texts = []
+        for text_id in text_ids:
+            row = conn.execute(db_queries.EXPORT_TEXT.sql, (text_id,)).fetchone()
+            if row is None:
+                print(f"Skipping text ID {text_id}: not found")
+                continue
+            texts.append(row)
+        counts = np.array([row[3] or 0 for row in texts], dtype=np.int64)
+        offsets = np.zeros(len(texts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+
+        max_id = conn.execute(db_queries.VOCAB_MAX_ID.sql).fetchone()[0] or 0
+        dtype = np.uint32 if max_id < 2 ** 32 else np.int64
+        used = np.zeros(max_id + 1, dtype=bool)  # vocab ids the exported texts refer to
+        lengths, frequencies = [], []
+        with writer.tokens(int(counts.sum()), dtype) as write_tokens:
+            for row, count in zip(texts, counts.tolist()):
+                text_id = row[0]
+                token_ids = read_text_tokens(conn, text_id, count, dtype)
+                write_tokens(text_id, token_ids)
+                used[token_ids] = True
+                pairs = read_pairs(conn, db_queries.TOKEN_LENGTHS, text_id)
+                lengths.append(np.column_stack([np.full(len(pairs), text_id, dtype=np.int64), pairs]))
+                pairs = read_pairs(conn, db_queries.EXPORT_TEXT_FREQUENCIES, text_id)
+                frequencies.append(np.column_stack([np.full(len(pairs), text_id, dtype=np.int64), pairs]))
+                used[pairs[:, 0]] = True
+
+        lengths = np.concatenate(lengths) if lengths else np.zeros((0, 3), dtype=np.int64)
+        frequencies = np.concatenate(frequencies) if frequencies else np.zeros((0, 3), dtype=np.int64)
+        vocab_ids = np.flatnonzero(used).astype(np.int64)
+
+        writer.table("texts", {
+            "id": np.array([row[0] for row in texts], dtype=np.int64),
+            "bytes": np.array([row[1] or 0 for row in texts], dtype=np.int64),
+            "content": [row[2] or "" for row in texts],
+            "token_count": counts,
+            "avg_len": np.array([row[4] or 0 for row in texts], dtype=np.int64),
+            "max_len": np.array([row[5] or 0 for row in texts], dtype=np.int64),
+            "min_len": np.array([row[6] or 0 for row in texts], dtype=np.int64),
+            "token_offset": offsets,
+        })
+        writer.table("token_len_hist", {"text_id": lengths[:, 0], "length": lengths[:, 1], "count": lengths[:, 2]})
+        writer.table("token_freq", {"text_id": frequencies[:, 0], "token_id": frequencies[:, 1], "count": frequencies[:, 2]})
+        writer.table("vocab", {"id": vocab_ids, "token": lookup_vocab(conn, vocab_ids)})
+    finally:
+        writer.close()
+        conn.close()
+
+    manifest = {
+        "format": EXPORT_FORMAT,
+        "layout": layout,
+        "source": os.path.abspath(db_path),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "texts": len(texts),
+        "tokens": int(counts.sum()),
+        "vocab": len(vocab_ids),
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+class ColumnarExport:
+    """An export opened for reading, columns come back as NumPy arrays
+
+    Usage:
+        data = ColumnarExport("exports/logs")
+        token_ids = data.tokens(3)              # a view into the mapped file for npy
+        words = data.token_strings(token_ids[:20])
+        freq = data.table("token_freq")         # {"text_id": array, "token_id": array, "count": array}
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != EXPORT_FORMAT:
+            raise ValueError(f"{path} is export format {self.manifest.get('format')}, this reader handles {EXPORT_FORMAT}")
+        self.path = path
+        self.layout = self.manifest["layout"]
+        self._npz = np.load(os.path.join(path, "data.npz")) if self.layout == "npz" else None
+        self._columns = {}
+        texts = self.table("texts", ["id", "token_count", "token_offset"])
+        self._texts = {text_id: (offset, count) for text_id, offset, count in
+                       zip(texts["id"].tolist(), texts["token_offset"].tolist(), texts["token_count"].tolist())}
+        self._vocab = None
+
+    def _has(self, name):
+        if self._npz is not None:
+            return name in self._npz.files
+        return os.path.exists(os.path.join(self.path, name + ".npy"))
+
+    def _array(self, name):
+        if name not in self._columns:
+            if self._npz is not None:
+                self._columns[name] = self._npz[name]
+            else:
+                self._columns[name] = np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def column(self, table, name):
+        """One column as an array, string columns as a list of str"""
+        if self.layout == "parquet":
+            import pyarrow.parquet as pq
+            values = pq.read_table(os.path.join(self.path, table + ".parquet"), columns=[name]).column(name)
+            return values.to_pylist() if values.type == "string" else values.to_numpy()
+        key = f"{table}.{name}"
+        if self._has(key + ".offsets"):
+            return decode_strings(self._array(key), self._array(key + ".offsets"))
+        return self._array(key)
+
+    def table(self, table, columns=None):
+        """{column: array} of a table, every column unless named"""
+        if columns is None:
+            columns = {
+                "texts": ["id", "bytes", "content", "token_count", "avg_len", "max_len", "min_len", "token_offset"],
+                "token_len_hist": ["text_id", "length", "count"],
+                "token_freq": ["text_id", "token_id", "count"],
+                "vocab": ["id", "token"],
+            }[table]
+        return {name: self.column(table, name) for name in columns}
+
+    def text_ids(self):
+        return list(self._texts)
+
+    def tokens(self, text_id):
+        """Token ids of a text in position order"""
+        offset, count = self._texts[text_id]
+        if self.layout == "parquet":
+            import pyarrow.parquet as pq
+            table = pq.read_table(os.path.join(self.path, "tokens.parquet"), columns=["token_id"],
+                                  filters=[("text_id", "=", text_id)])
+            return table.column("token_id").to_numpy()
+        return self._array("tokens.token_id")[offset:offset + count]
+
+    def token_strings(self, token_ids):
+        """Token strings of vocab ids"""
+        if self._vocab is None:
+            ids = np.asarray(self.column("vocab", "id"))
+            self._vocab = (ids, self.column("vocab", "token"))
+        ids, tokens = self._vocab
+        positions = np.searchsorted(ids, np.asarray(token_ids))
+        return [tokens[i] for i in positions.tolist()]
+
+def group_bounds(text_ids):
+    """{text_id: (start, end)} of the rows of each text, rows are grouped by text"""
+    if len(text_ids) == 0:
+        return {}
+    starts = np.flatnonzero(np.diff(text_ids)) + 1
+    bounds = np.concatenate([[0], starts, [len(text_ids)]])
+    return {int(text_ids[a]): (int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])}
+
+def schema_version(db_path):
+    """PRAGMA user_version of a database, None if it does not exist; never creates the file"""
+    try:
+        conn = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=rw", uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        return conn.execute(db_queries.SCHEMA_VERSION.sql).fetchone()[0]
+    finally:
+        conn.close()
+
+def prepare_database(db_path):
+    """Create or migrate a database to the current schema by opening it with the analyzer once"""
+    version = schema_version(db_path)
+    if version is not None and version >= 6:
+        return
+    import text_analyzer
+    if not text_analyzer.is_available():
+        raise ValueError(f"{db_path} is missing or has an old schema and the analyzer library is not built, "
+                         "see the readme, or run text_analyzer on it once first")
+    try:
+        text_analyzer.Analyzer(db_path).close()
+    except text_analyzer.AnalyzerError as e:
+        raise ValueError(str(e)) from e
+
+def import_export(path, db_path):
+    """Add the texts of an export to a database under new ids, returns {old_id: new_id}
+
+    A missing database is created and an old one migrated first, through the
+    analyzer library; everything goes in one transaction.
+    """
+    data = ColumnarExport(path)
+    prepare_database(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.text_factory = lambda b: b.decode("utf-8", "surrogateescape")
+    try:
+        vocab_ids = np.asarray(data.column("vocab", "id"), dtype=np.int64)
+        vocab_tokens = data.column("vocab", "token")
+        remap = np.zeros(int(vocab_ids.max()) + 1 if len(vocab_ids) else 1, dtype=np.int64)
+        texts = data.table("texts")
+        lengths = data.table("token_len_hist")
+        length_rows = group_bounds(np.asarray(lengths["text_id"]))
+        frequencies = data.table("token_freq")
+        frequency_rows = group_bounds(np.asarray(frequencies["text_id"]))
+        new_ids = {}
+        with conn:
+            for start in range(0, len(vocab_tokens), VOCAB_BATCH):
+                batch = json.dumps(vocab_tokens[start:start + VOCAB_BATCH])
+                conn.execute(db_queries.IMPORT_VOCAB.sql, (batch,))
+                for key, new_token_id in conn.execute(db_queries.IMPORT_VOCAB_IDS.sql, (batch,)):
+                    remap[vocab_ids[start + key]] = new_token_id
+
+            for index, old_id in enumerate(np.asarray(texts["id"]).tolist()):
+                cursor = conn.execute(db_queries.IMPORT_TEXT.sql, (texts["content"][index], int(texts["bytes"][index])))
+                text_id = new_ids[old_id] = cursor.lastrowid
+                conn.execute(db_queries.IMPORT_STATS.sql, (text_id,) + tuple(
+                    int(texts[name][index]) for name in ("token_count", "avg_len", "max_len", "min_len")))
+
+                start, end = length_rows.get(old_id, (0, 0))
+                conn.executemany(db_queries.IMPORT_LENGTH_COUNT.sql, zip(
+                    itertools.repeat(text_id), lengths["length"][start:end].tolist(), lengths["count"][start:end].tolist()))
+
+                tokens = remap[np.asarray(data.tokens(old_id), dtype=np.int64)]
+                start, end = frequency_rows.get(old_id, (0, 0))
+                if end > start:
+                    token_ids = remap[np.asarray(frequencies["token_id"][start:end], dtype=np.int64)]
+                    counts = np.asarray(frequencies["count"][start:end])
+                else:
+                    # a --sketch text has no frequency rows; counted from its tokens
+                    # it becomes an exact text and takes part in --corpus and --tfidf
+                    token_ids, counts = np.unique(tokens, return_counts=True)
+                token_ids, counts = token_ids.tolist(), counts.tolist()
+                conn.executemany(db_queries.IMPORT_TOKEN_FREQUENCY.sql, zip(itertools.repeat(text_id), token_ids, counts))
+                conn.executemany(db_queries.IMPORT_CORPUS_TERM.sql, zip(token_ids, counts))
+
+                tokens = tokens.tolist()
+                conn.executemany(db_queries.IMPORT_TOKEN.sql, zip(
+                    itertools.repeat(text_id), tokens, range(1, len(tokens) + 1)))
+    finally:
+        conn.close()
+    return new_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Export texts to columnar files for NumPy/pandas, or import them back")
+    commands = parser.add_subparsers(dest="command", required=True)
+    out = commands.add_parser("export", help="write texts of a database to a directory")
+    out.add_argument("directory", help="export directory, created if missing")
+    out.add_argument("--db", default="analysis.db", help="database path (default analysis.db)")
+    out.add_argument("--texts", default="all", help="ids and ranges such as 1-100,205, or all (default all)")
+    out.add_argument("--layout", default="auto", choices=("auto",) + LAYOUTS,
+                     help="auto = parquet with pyarrow installed, npy otherwise")
+    into = commands.add_parser("import", help="add the texts of an export to a database")
+    into.add_argument("directory", help="export directory")
+    into.add_argument("--db", default="analysis.db", help="database path (default analysis.db)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            conn = sqlite3.connect(args.db)
+            try:
+                text_ids = db_access.parse_id_ranges(args.texts, conn)
+            finally:
+                conn.close()
+            manifest = export(args.db, args.directory, text_ids, args.layout)
+            print(f"Exported {manifest['texts']} texts, {manifest['tokens']} tokens and "
+                  f"{manifest['vocab']} vocab entries as {manifest['layout']} to {args.directory}")
+        else:
+            new_ids = import_export(args.directory, args.db)
+            print(f"Imported {len(new_ids)} texts into {args.db}: " +
+                  ", ".join(f"{old} -> {new}" for old, new in itertools.islice(new_ids.items(), 10)) +
+                  (", ..." if len(new_ids) > 10 else ""))
+    except (OSError, ValueError, UnicodeError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Done in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
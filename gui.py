@@ -1,9 +1,22 @@
 import dearpygui.dearpygui as dpg
 import subprocess
-import sqlite3
 import os
 import sys
+import queue
+import tempfile
+import threading
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import text_analyzer
+import db_access
+import metrics
+import vis
+
+# Texts analyzed with --sketch are charted from their sketches, a window should
+# never count millions of token rows to draw 15 bars
+vis.APPROXIMATE = True
 
 # Create context
 dpg.create_context()
@@ -11,66 +24,398 @@ dpg.create_context()
 # Global variables
 text_id = None
 analysis_db = "analysis.db"
+database = db_access.Database(analysis_db)  # Long-lived read connections, one per thread
+vis.use_database(database)  # chart previews query through them too
+loaded_file_path = None  # File selected for analysis, handed to the analyzer by path
+ANALYZER_EXE = "./text_analyzer.exe"  # subprocess fallback when the library is not built
+analyzer_probes = {}  # (path, mtime, size) -> whether that build accepts a FILE argument
+analyzer = None  # In-process analyzer, keeps one database connection for the whole session
+analyzer_lock = threading.Lock()
 
-def analyze_text_callback():
-    """Analyze text callback function"""
-    text = dpg.get_value("input_text")
+# Background work: jobs run on the pool, widget updates go back through ui_updates
+MAX_WORKERS = 4
+MAX_JOBS_SHOWN = 8
+VIS_CHART_COUNT = 3  # charts vis.py renders per text
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+ui_updates = queue.Queue()
+jobs = {}  # queued and running jobs by id, a job leaves once its result is shown
+finished_jobs = deque(maxlen=MAX_JOBS_SHOWN)  # the most recent finished jobs, for the job list
+job_ids = itertools.count(1)
+
+# In-window charts: native plots plus the word cloud uploaded as a texture
+PREVIEW_TOP = 15
+CLOUD_WIDTH = 800
+CLOUD_HEIGHT = 400
+PREVIEW_CACHE_SIZE = 16
+preview_cache = OrderedDict()  # chart key -> (aggregates, cloud RGBA or None), most recent last
+preview_lock = threading.Lock()
+preview_requests = itertools.count(1)
+latest_preview = 0  # only the newest request may update the view
+
+# Stage timings of recent jobs, collected while "Collect metrics" is checked
+MAX_METRICS_SHOWN = 5
+metrics_history = deque(maxlen=MAX_METRICS_SHOWN)  # formatted reports, newest first
+
+def get_analyzer():
+    """Return the in-process analyzer, or None if the shared library is not built"""
+    global analyzer
+    with analyzer_lock:
+        if analyzer is None and text_analyzer.is_available():
+            analyzer = text_analyzer.Analyzer(analysis_db)
+    return analyzer
+
+# ==================== Background Jobs ====================
+class Job:
+    """One unit of background work shown in the Jobs panel"""
+
+    def __init__(self, job_id, description):
+        self.id = job_id
+        self.description = description
+        self.state = "queued"
+        self.progress = 0.0  # 0..1, or None while the amount of work is unknown
+        self.cancel_event = threading.Event()
+        self.process = None  # subprocess to kill on cancel, if any
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+def run_on_ui(func, *args):
+    """Queue a call for the render thread, workers never touch widgets directly"""
+    ui_updates.put((func, args))
+
+def process_ui_updates():
+    """Run the widget updates queued by workers, called once per frame"""
+    while True:
+        try:
+            func, args = ui_updates.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            func(*args)
+        except Exception as e:
+            dpg.set_value("status_text", f"UI update failed: {e}")
+
+def submit_job(description, work):
+    """Run work(job) on the worker pool and track it in the Jobs panel"""
+    job = Job(next(job_ids), description)
+    jobs[job.id] = job
     
-    if not text.strip():
-        dpg.set_value("status_text", "Please enter some text to analyze.")
+    def runner():
+        if job.cancelled():
+            job.state = "cancelled"
+            run_on_ui(retire_job, job)
+            return
+        job.state = "running"
+        run_on_ui(refresh_jobs_view)
+        try:
+            work(job)
+            job.state = "cancelled" if job.cancelled() else "done"
+        except Exception as e:
+            job.state = "cancelled" if job.cancelled() else f"failed: {e}"
+        job.progress = 1.0
+        run_on_ui(retire_job, job)
+    
+    executor.submit(runner)
+    refresh_jobs_view()
+    return job
+
+def retire_job(job):
+    """Move a finished job from the active jobs to the recent list, runs on the render thread"""
+    jobs.pop(job.id, None)
+    finished_jobs.append(job)
+    refresh_jobs_view()
+
+def refresh_jobs_view():
+    """Update the progress bar and the job list"""
+    active = [job for job in jobs.values() if job.state in ("queued", "running")]
+    if active:
+        known = [job.progress for job in active if job.progress is not None]
+        overall = sum(known) / len(active) if known else 0.0
+        dpg.configure_item("job_progress", overlay=f"{len(active)} job(s) running")
+        dpg.set_value("job_progress", overall)
+    else:
+        dpg.configure_item("job_progress", overlay="Idle")
+        dpg.set_value("job_progress", 0.0)
+    
+    lines = []
+    for job in sorted([*jobs.values(), *finished_jobs], key=lambda j: j.id, reverse=True)[:MAX_JOBS_SHOWN]:
+        progress = "" if job.progress is None or job.state != "running" else f" {job.progress:.0%}"
+        lines.append(f"#{job.id} {job.description}: {job.state}{progress}")
+    dpg.set_value("job_status", "\n".join(lines))
+
+def cancel_jobs_callback():
+    """Cancel every queued or running job"""
+    for job in list(jobs.values()):
+        if job.state in ("queued", "running"):
+            job.cancel()
+    dpg.set_value("status_text", "Cancelling running jobs...")
+# ==================== Background Jobs End ====================
+
+# ==================== Metrics ====================
+def show_metrics(description, report):
+    """Add a job's metrics report to the Metrics tab, runs on the render thread"""
+    metrics_history.appendleft(f"{description}\n{metrics.format_report(report)}")
+    dpg.set_value("metrics_view", "\n\n".join(metrics_history))
+
+def metrics_file(collect):
+    """Temporary path for a subprocess' metrics report, None when not collecting"""
+    if not collect:
+        return None
+    fd, path = tempfile.mkstemp(prefix="text_analyzer_metrics_", suffix=".json")
+    os.close(fd)
+    return path
+
+def analyzer_takes_files(path=ANALYZER_EXE):
+    """True if the analyzer binary accepts a FILE argument
+
+    A build from before FILE and --metrics ignores its arguments and reads
+    stdin. Running it to ask would analyze whatever it read, so its usage text
+    is looked for in the binary instead, once per build.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key not in analyzer_probes:
+        with open(path, "rb") as f:
+            analyzer_probes[key] = b"--metrics=" in f.read()
+    return analyzer_probes[key]
+
+def take_metrics(job, path):
+    """Show the report a subprocess left in path and remove the file"""
+    if path is None:
         return
-        
+    report = metrics.read_report(path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if report is not None:
+        run_on_ui(show_metrics, job.description, report)
+
+def clear_metrics_callback():
+    metrics_history.clear()
+    dpg.set_value("metrics_view", "")
+# ==================== Metrics End ====================
+
+# ==================== Chart Preview ====================
+def load_preview(preview_text_id):
+    """Load the aggregates and word cloud pixels of a text, reusing recent results"""
+    key = vis.chart_key('preview', [preview_text_id], db_path=analysis_db)
+    with preview_lock:
+        if key in preview_cache:
+            preview_cache.move_to_end(key)
+            return preview_cache[key]
+    
+    aggregates = vis.TextAggregates.load(preview_text_id, analysis_db)
+    cloud = None
+    if not aggregates.is_empty():
+        try:
+            cloud = vis.word_cloud_rgba(aggregates, CLOUD_WIDTH, CLOUD_HEIGHT)
+        except Exception as e:
+            run_on_ui(dpg.set_value, "status_text", f"Word cloud unavailable: {e}")
+    
+    with preview_lock:
+        preview_cache[key] = (aggregates, cloud)
+        while len(preview_cache) > PREVIEW_CACHE_SIZE:
+            preview_cache.popitem(last=False)
+    return aggregates, cloud
+
+def show_preview(request_id, preview_text_id, aggregates, cloud):
+    """Put a loaded preview into the plots and the texture, runs on the render thread"""
+    if request_id != latest_preview:
+        return  # the user has moved on to another text
+    
+    top = aggregates.top_tokens(PREVIEW_TOP)
+    positions = list(range(len(top)))
+    dpg.set_value("freq_series", [positions, [float(row[1]) for row in top]])
+    dpg.set_axis_ticks("freq_x_axis", tuple((row[0], position) for row, position in zip(top, positions)))
+    
+    lengths = aggregates.length_distribution
+    dpg.set_value("length_series", [[float(row[0]) for row in lengths], [float(row[1]) for row in lengths]])
+    
+    for axis in ("freq_x_axis", "freq_y_axis", "length_x_axis", "length_y_axis"):
+        dpg.fit_axis_data(axis)
+    
+    if cloud is not None:
+        dpg.set_value("cloud_texture", cloud)
+    dpg.configure_item("cloud_image", show=cloud is not None)
+    
+    if aggregates.is_empty():
+        dpg.set_value("preview_label", f"No token data found for text ID {preview_text_id}")
+    else:
+        dpg.set_value("preview_label", f"Text #{preview_text_id}" + (" (approx.)" if aggregates.approximate else ""))
+
+def run_preview(job, request_id, preview_text_id):
+    aggregates, cloud = load_preview(preview_text_id)
+    if not job.cancelled():
+        run_on_ui(show_preview, request_id, preview_text_id, aggregates, cloud)
+
+def preview_callback():
+    """Show the charts of the Text ID in the window, without writing any file"""
+    global latest_preview
+    try:
+        preview_text_id = int(dpg.get_value("text_id_input"))
+    except ValueError:
+        dpg.set_value("status_text", "Text ID must be a number.")
+        return
+    latest_preview = request_id = next(preview_requests)
+    dpg.set_value("preview_label", f"Loading text #{preview_text_id}...")
+    submit_job(f"Preview text {preview_text_id}", lambda job: run_preview(job, request_id, preview_text_id))
+# ==================== Chart Preview End ====================
+
+def show_analysis_result(output, new_text_id):
+    """Show an analyzer result, runs on the render thread"""
+    global text_id
+    dpg.set_value("analysis_output", output)
+    if new_text_id is None:
+        dpg.set_value("status_text", "Analysis completed but failed to extract Text ID")
+        return
+    text_id = new_text_id
+    dpg.set_value("text_id_input", str(text_id))
+    dpg.set_value("status_text", f"Analysis complete! Text ID: {text_id}")
+    refresh_database_info()
+    preview_callback()
+
+def show_analysis_error(message):
+    dpg.set_value("analysis_output", f"Analysis failed:\n{message}")
+    dpg.set_value("status_text", "Analysis failed")
+
+def run_analysis(job, text, file_path, collect_metrics=False):
+    """Analyze text or a file on a worker thread"""
     try:
-        # Run analyzer
-        result = subprocess.run(
-            ["./text_analyzer.exe"],
-            input=text,
-            text=True,
-            capture_output=True,
-            encoding="utf-8"
-        )
+        # Analyze in-process when the library is available, without a process start per click
+        lib_analyzer = get_analyzer()
+        if lib_analyzer is not None:
+            if lib_analyzer.metrics != collect_metrics:
+                lib_analyzer.enable_metrics(collect_metrics)
+            def report(done, total):
+                job.progress = done / total if total > 0 else None
+                run_on_ui(refresh_jobs_view)
+                return job.cancelled()
+            
+            if file_path is not None:
+                result = lib_analyzer.analyze(path=file_path, progress=report)
+            else:
+                result = lib_analyzer.analyze(text, progress=report)
+            if collect_metrics and lib_analyzer.last_metrics is not None:
+                run_on_ui(show_metrics, job.description, lib_analyzer.last_metrics)
+            
+            output = (f"Found and saved {result.tokens} tokens\n"
+                      f"Distinct tokens: {result.distinct_tokens}\n"
+                      f"Bytes analyzed: {result.bytes}\n"
+                      f"Analysis complete! Text ID: {result.text_id}\n")
+            run_on_ui(show_analysis_result, output, result.text_id)
+            return
         
-        # Display results
-        dpg.set_value("analysis_output", result.stdout)
+        # Run analyzer, a loaded file is memory mapped by the analyzer instead of piped through stdin
+        job.progress = None
+        metrics_path = metrics_file(collect_metrics)
+        # The report path goes through the environment, which a build without --metrics ignores
+        env = dict(os.environ, TEXT_ANALYZER_METRICS=metrics_path) if metrics_path else None
+        if file_path is not None and analyzer_takes_files():
+            job.process = subprocess.Popen(
+                [ANALYZER_EXE, file_path],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                env=env
+            )
+            stdout, _ = job.process.communicate()
+        elif file_path is not None:
+            # An older build only reads stdin, give it the file there
+            with open(file_path, "rb") as source:
+                job.process = subprocess.Popen(
+                    [ANALYZER_EXE],
+                    stdin=source,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    encoding="utf-8",
+                    env=env
+                )
+                stdout, _ = job.process.communicate()
+        else:
+            job.process = subprocess.Popen(
+                [ANALYZER_EXE],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                env=env
+            )
+            stdout, _ = job.process.communicate(input=text)
+        take_metrics(job, metrics_path)
+        if job.cancelled():
+            run_on_ui(show_analysis_error, "cancelled")
+            return
         
         # Extract text_id
-        lines = result.stdout.split('\n')
-        for line in lines:
+        new_text_id = None
+        for line in stdout.split('\n'):
             if "Text ID:" in line:
                 try:
-                    global text_id
-                    text_id = int(line.split(":")[-1].strip())
-                    dpg.set_value("text_id_input", str(text_id))
-                    dpg.set_value("status_text", f"Analysis complete! Text ID: {text_id}")
-                    refresh_database_info()
-                    refresh_available_ids()
-                    return
+                    new_text_id = int(line.split(":")[-1].strip())
+                    break
                 except ValueError:
                     pass
-                    
-        dpg.set_value("status_text", "Analysis completed but failed to extract Text ID")
+        run_on_ui(show_analysis_result, stdout, new_text_id)
         
+    except text_analyzer.AnalysisCancelled:
+        run_on_ui(show_analysis_error, "cancelled")
     except Exception as e:
-        dpg.set_value("analysis_output", f"Analysis failed:\n{str(e)}")
-        dpg.set_value("status_text", "Analysis failed")
+        run_on_ui(show_analysis_error, str(e))
+        raise
+
+def analyze_text_callback():
+    """Analyze text callback function"""
+    text = dpg.get_value("input_text")
+    file_path = loaded_file_path
+    
+    if file_path is None and not text.strip():
+        dpg.set_value("status_text", "Please enter some text to analyze.")
+        return
+    
+    description = f"Analyze {os.path.basename(file_path)}" if file_path is not None else f"Analyze text ({len(text)} chars)"
+    collect_metrics = dpg.get_value("collect_metrics")
+    submit_job(description, lambda job: run_analysis(job, text, file_path, collect_metrics))
+    dpg.set_value("status_text", f"{description} started")
 
 def file_dialog_callback(sender, app_data):
     """File dialog callback function"""
+    global loaded_file_path
     try:
         # Get selected file path
         file_path = app_data['file_path_name']
         
-        # Read file content
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-            
-        # Set content to input text box
-        dpg.set_value("input_text", content)
+        # Only remember the path, the analyzer reads the file itself
+        file_size = os.path.getsize(file_path)
+        loaded_file_path = file_path
+        
+        dpg.set_value("input_text", "")
+        dpg.set_value("source_file_text", f"Source file: {file_path} ({file_size} bytes)")
         dpg.set_value("status_text", f"Loaded file: {file_path}")
         
     except Exception as e:
         dpg.set_value("status_text", f"Failed to load file: {str(e)}")
 
+def input_text_changed_callback():
+    """Typed text replaces a previously loaded file"""
+    global loaded_file_path
+    if loaded_file_path is not None:
+        loaded_file_path = None
+        dpg.set_value("source_file_text", "")
+
 def load_file_callback():
     """Load file callback function"""
     # Show file dialog
@@ -78,10 +423,41 @@ def load_file_callback():
 
 def clear_text_callback():
     """Clear text callback function"""
+    global loaded_file_path
+    loaded_file_path = None
+    dpg.set_value("source_file_text", "")
     dpg.set_value("input_text", "")
     dpg.set_value("analysis_output", "")
     dpg.set_value("status_text", "Text cleared")
 
+def run_visualization(job, vis_text_id, output_dir, collect_metrics=False):
+    """Render the charts of one text in a vis.py subprocess, progress follows its output"""
+    metrics_path = metrics_file(collect_metrics)
+    job.process = subprocess.Popen(
+        [sys.executable, "-u", "vis.py", str(vis_text_id), output_dir, "--approx"]
+        + ([f"--metrics={metrics_path}"] if metrics_path else []),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    charts_done = 0
+    for line in job.process.stdout:
+        if "saved as" in line:
+            charts_done += 1
+            job.progress = min(charts_done / VIS_CHART_COUNT, 1.0)
+            run_on_ui(refresh_jobs_view)
+    stderr = job.process.stderr.read()
+    returncode = job.process.wait()
+    take_metrics(job, metrics_path)
+    
+    if job.cancelled():
+        return
+    if returncode == 0:
+        run_on_ui(dpg.set_value, "status_text", f"Visualizations generated for Text ID {vis_text_id} in {output_dir}")
+    else:
+        run_on_ui(dpg.set_value, "status_text", f"Visualization failed:\n{stderr}")
+        raise RuntimeError(f"vis.py exited with {returncode}")
+
 def generate_visualizations_callback():
     """Generate visualizations callback function"""
     global text_id
@@ -104,27 +480,16 @@ def generate_visualizations_callback():
         
     try:
         # Check if the text_id exists in the database
-        conn = sqlite3.connect(analysis_db)
-        cursor = conn.execute("SELECT COUNT(*) FROM texts WHERE id = ?", (text_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
-        
-        if count == 0:
+        if not database.text_exists(text_id):
             dpg.set_value("status_text", f"No text found with ID {text_id}")
             return
             
-        # Run visualization script with output directory parameter
-        result = subprocess.run(
-            [sys.executable, "vis.py", str(text_id), output_dir],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode == 0:
-            dpg.set_value("status_text", f"Visualizations generated for Text ID {text_id} in {output_dir}")
-            # In a future version, we might implement image display functionality here
-        else:
-            dpg.set_value("status_text", f"Visualization failed:\n{result.stderr}")
+        # Render on the worker pool, several texts can be rendered at the same time
+        vis_text_id = text_id
+        collect_metrics = dpg.get_value("collect_metrics")
+        submit_job(f"Visualize text {vis_text_id}",
+                   lambda job: run_visualization(job, vis_text_id, output_dir, collect_metrics))
+        dpg.set_value("status_text", f"Generating visualizations for Text ID {vis_text_id}...")
             
     except Exception as e:
         dpg.set_value("status_text", f"Visualization failed:\n{str(e)}")
@@ -147,52 +512,41 @@ def select_output_directory():
     root.destroy()
 
 def refresh_database_info():
-    """Refresh database information"""
+    """Refresh database information and the available IDs list with one query"""
     try:
-        conn = sqlite3.connect(analysis_db)
-        
-        # Get total number of texts
-        cursor = conn.execute("SELECT COUNT(*) FROM texts")
-        texts_count = cursor.fetchone()[0]
-        
-        # Get total number of tokens
-        cursor = conn.execute("SELECT COUNT(*) FROM tokens")
-        tokens_count = cursor.fetchone()[0]
-        
-        # Get latest text IDs
-        cursor = conn.execute("SELECT id, LENGTH(content) FROM texts ORDER BY id DESC LIMIT 5")
-        latest_texts = cursor.fetchall()
-        
-        conn.close()
-        
-        # Display information
+        dashboard = database.dashboard(10)
+    except Exception as e:
+        for tag in ("database_info", "available_ids"):
+            if dpg.does_item_exist(tag):
+                dpg.set_value(tag, f"Failed to get database info:\n{str(e)}")
+        return
+    
+    # Display information
+    if dpg.does_item_exist("database_info"):
         info = f"Database: {analysis_db}\n"
-        info += f"Total texts analyzed: {texts_count}\n"
-        info += f"Total tokens: {tokens_count}\n\n"
+        info += f"Total texts analyzed: {dashboard.text_count}\n"
+        info += f"Total tokens: {dashboard.token_total}\n"
+        info += f"Total bytes: {dashboard.total_bytes}\n"
+        info += f"Distinct tokens: {dashboard.vocab_size}\n\n"
         info += "Latest texts:\n"
         
-        for text_id, content_length in latest_texts:
-            info += f"  ID {text_id}: {content_length} characters\n"
+        for text_id, text_bytes in dashboard.recent[:5]:
+            info += f"  ID {text_id}: {text_bytes} bytes\n"
             
         dpg.set_value("database_info", info)
-        
-    except Exception as e:
-        dpg.set_value("database_info", f"Failed to get database info:\n{str(e)}")
-
-def refresh_available_ids():
-    """Refresh available IDs list"""
-    try:
-        conn = sqlite3.connect(analysis_db)
-        cursor = conn.execute("SELECT id FROM texts ORDER BY id DESC LIMIT 10")
-        ids = [str(row[0]) for row in cursor.fetchall()]
-        conn.close()
-        
+    
+    # Available IDs, newest first
+    if dpg.does_item_exist("available_ids"):
+        ids = [str(row[0]) for row in dashboard.recent]
         if ids:
             dpg.set_value("available_ids", "Available IDs: " + ", ".join(ids))
         else:
             dpg.set_value("available_ids", "No texts analyzed yet")
-    except Exception as e:
-        dpg.set_value("available_ids", f"Error: {str(e)}")
+
+# Word cloud pixels are uploaded here directly, no PNG in between
+with dpg.texture_registry():
+    dpg.add_dynamic_texture(width=CLOUD_WIDTH, height=CLOUD_HEIGHT,
+                            default_value=[1.0] * (CLOUD_WIDTH * CLOUD_HEIGHT * 4), tag="cloud_texture")
 
 # ==================== Customizable Part 1: File Dialog ====================
 # Create file dialog
@@ -230,16 +584,22 @@ with dpg.window(label="Text Analyzer", width=1000, height=700, tag="main_window"
     # Status text
     dpg.add_text("Ready", tag="status_text")
     
+    # Background job progress
+    with dpg.group(horizontal=True):
+        dpg.add_progress_bar(tag="job_progress", default_value=0.0, overlay="Idle", width=400)
+        dpg.add_button(label="Cancel Jobs", callback=cancel_jobs_callback)
+    
     # Available ID text
     dpg.add_text("", tag="available_ids")
-    refresh_available_ids()
+    refresh_database_info()
     
     # ==================== Customizable Part 4: Main Content Area ====================
     with dpg.tab_bar():
         # Analysis tab
         with dpg.tab(label="Text Analysis"):
             # Input area
-            dpg.add_input_text(label="Input Text", multiline=True, height=200, tag="input_text")
+            dpg.add_input_text(label="Input Text", multiline=True, height=200, tag="input_text", callback=input_text_changed_callback)
+            dpg.add_text("", tag="source_file_text")
             
             # Button group
             with dpg.group(horizontal=True):
@@ -258,7 +618,10 @@ with dpg.window(label="Text Analyzer", width=1000, height=700, tag="main_window"
         with dpg.tab(label="Visualization"):
             # Visualization controls
             with dpg.group():
-                dpg.add_input_text(label="Text ID", tag="text_id_input", width=100)
+                with dpg.group(horizontal=True):
+                    dpg.add_input_text(label="Text ID", tag="text_id_input", width=100,
+                                       on_enter=True, callback=preview_callback)
+                    dpg.add_button(label="Show Charts", callback=preview_callback)
                 
                 # Output directory selection
                 with dpg.group(horizontal=True):
@@ -271,15 +634,36 @@ with dpg.window(label="Text Analyzer", width=1000, height=700, tag="main_window"
                 # Separator
                 dpg.add_separator()
                 
-                # Visualization display area
+                # Visualization display area, press Enter in Text ID to switch texts
                 with dpg.group():
-                    dpg.add_text("Visualization Area")
-                    dpg.add_text("Generated charts will be displayed here")
-                    # Customizable part: Add image display components
-                    dpg.add_text("Supported charts:")
-                    dpg.add_text("1. Word Frequency Bar Chart")
-                    dpg.add_text("2. Token Length Distribution Chart")
-                    dpg.add_text("3. Word Cloud Chart")
+                    dpg.add_text("Enter a Text ID and press Enter to show its charts", tag="preview_label")
+                    
+                    with dpg.plot(label="Word Frequency", height=300, width=-1):
+                        dpg.add_plot_axis(dpg.mvXAxis, label="Words", tag="freq_x_axis")
+                        with dpg.plot_axis(dpg.mvYAxis, label="Frequency", tag="freq_y_axis"):
+                            dpg.add_bar_series([], [], weight=0.6, tag="freq_series")
+                    
+                    with dpg.plot(label="Token Length Distribution", height=250, width=-1):
+                        dpg.add_plot_axis(dpg.mvXAxis, label="Token Length", tag="length_x_axis")
+                        with dpg.plot_axis(dpg.mvYAxis, label="Count", tag="length_y_axis"):
+                            dpg.add_line_series([], [], tag="length_series")
+                    
+                    dpg.add_text("Word Cloud")
+                    dpg.add_image("cloud_texture", width=CLOUD_WIDTH, height=CLOUD_HEIGHT, show=False, tag="cloud_image")
+        
+        # Jobs tab
+        with dpg.tab(label="Jobs"):
+            dpg.add_text("Recent background jobs:")
+            dpg.add_input_text(label="", multiline=True, height=300, readonly=True, tag="job_status")
+        
+        # Metrics tab
+        with dpg.tab(label="Metrics"):
+            with dpg.group(horizontal=True):
+                dpg.add_checkbox(label="Collect metrics", tag="collect_metrics", default_value=False)
+                dpg.add_button(label="Clear", callback=clear_metrics_callback)
+            dpg.add_text("Time per stage of recent jobs. CPU well below 100% means the stage was waiting,\n"
+                         "on the disk for read, on the sync or the write lock for commit.")
+            dpg.add_input_text(label="", multiline=True, height=400, width=-1, readonly=True, tag="metrics_view")
         
         # Database Info tab
         with dpg.tab(label="Database Info"):
@@ -295,8 +679,16 @@ dpg.create_viewport(title="Text Analyzer GUI", width=1050, height=750)
 dpg.setup_dearpygui()
 dpg.show_viewport()
 
-# Start main loop
-dpg.start_dearpygui()
+# Start main loop, draining worker updates between frames keeps rendering responsive
+while dpg.is_dearpygui_running():
+    process_ui_updates()
+    dpg.render_dearpygui_frame()
+
+# Stop background work
+for job in list(jobs.values()):
+    job.cancel()
+executor.shutdown(wait=False, cancel_futures=True)
+database.close()
 
 # Destroy context
 dpg.destroy_context()
\ No newline at end of file
@@ -0,0 +1,521 @@
+#include "ingest.h"
+#include "analyzer.h" /*stream API*/
+#include "db.h"       /*database API*/
+#include "mapfile.h"  /*memory mapped input*/
+#include "metrics.h"  /*stage timers*/
+#include "parallel.h" /*multi-threaded analysis*/
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h> /*file size for appends*/
+
+static size_t utf8_boundary(const char *buf, size_t len) {
+    /*step back over continuation bytes so the preview never ends mid-character*/
+    size_t cut = len;
+    while (cut > 0 && ((unsigned char)buf[cut - 1] & 0xC0) == 0x80) {
+        cut--;
+    }
+    if (cut > 0 && ((unsigned char)buf[cut - 1] & 0x80)) {
+        /*lead byte: keep it only if all its continuation bytes made it in*/
+        unsigned char lead = (unsigned char)buf[cut - 1];
+        size_t need = (lead & 0xE0) == 0xC0 ? 2 : (lead & 0xF0) == 0xE0 ? 3 : 4;
+        if (len - (cut - 1) < need) {
+            return cut - 1;
+        }
+    }
+    return len;
+}
+
+static int save_preview(int text_id, const char *preview, size_t preview_len, long long bytes) {
+    // Remove possible trailing newline from the stored preview
+    if (bytes == (long long)preview_len && preview_len > 0 && preview[preview_len-1] == '\n') {
+        preview_len--;
+    }
+    preview_len = utf8_boundary(preview, preview_len);
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = db_update_text(text_id, preview, (int)preview_len, bytes);
+    metrics_leave(stage);
+    return rc;
+}/*fill in texts.content and texts.bytes once the input has been read*/
+
+static int append_preview(int text_id, const text_state *from, const char *preview, size_t preview_len, long long bytes) {
+    // The stored preview of a text that fit whole lost its trailing newline, put it back before extending it
+    char *joined = NULL;
+    if (preview_len > 0 && from->preview_len + 1 == from->bytes) {
+        joined = malloc(preview_len + 1);
+        if (joined == NULL) {
+            return -1;
+        }
+        joined[0] = '\n';
+        memcpy(joined + 1, preview, preview_len);
+        preview = joined;
+        preview_len++;
+    }
+    if (from->preview_len >= MAX_TEXT_LEN) {
+        preview_len = 0;
+    } else if (from->preview_len + (long long)preview_len > MAX_TEXT_LEN) {
+        preview_len = (size_t)(MAX_TEXT_LEN - from->preview_len);
+    }
+    preview_len = utf8_boundary(preview, preview_len);
+    int stage = metrics_enter(STAGE_INSERT);
+    int rc = db_append_text(text_id, preview, (int)preview_len, bytes);
+    metrics_leave(stage);
+    free(joined);
+    return rc;
+}/*extend the preview of an appended text while it is shorter than MAX_TEXT_LEN, and store the new size*/
+
+static int end_text(int rc, const ingest_result *out);
+
+static int text_nested = 0; /*the current text runs inside a caller's transaction*/
+
+static int open_text(void) {
+    // One transaction per text, so the whole text costs a single sync. Inside a
+    // group transaction a savepoint keeps a failed text from undoing the others
+    text_nested = db_in_transaction();
+    int stage = metrics_enter(STAGE_COMMIT);
+    int rc = text_nested ? db_savepoint("ingest_text") : db_begin();
+    metrics_leave(stage);
+    return rc;
+}
+
+static int begin_text(ingest_result *out) {
+    memset(out, 0, sizeof(*out));
+    if (open_text() != 0) {
+        return -1;
+    }
+
+    // Insert text into database, the content preview is filled in once the input is read
+    int stage = metrics_enter(STAGE_INSERT);
+    out->text_id = db_insert_text("");
+    metrics_leave(stage);
+    if (out->text_id < 0) {
+        fprintf(stderr, "Failed to insert text\n");
+        end_text(-1, out);
+        return -1;
+    }
+    return 0;
+}
+
+static int end_text(int rc, const ingest_result *out) {
+    int stage = metrics_enter(STAGE_COMMIT);
+    if (rc != 0) {
+        if (text_nested) {
+            db_rollback_to("ingest_text");
+        } else {
+            db_rollback();
+        }
+        metrics_leave(stage);
+        return -1;
+    }
+    rc = text_nested ? db_release("ingest_text") : db_commit();
+    metrics_leave(stage);
+    if (rc != 0) {
+        fprintf(stderr, "Failed to commit analysis\n");
+        end_text(-1, out);
+        return -1;
+    }
+    metrics_count_text(out->bytes, out->tokens);
+    return 0;
+}
+
+static int finish_stream(analyzer_stream *s, ingest_result *out) {
+    out->tokens = analyzer_stream_finish(s);
+    out->distinct = analyzer_stream_distinct(s); /*finish may still add the last token*/
+    return out->tokens < 0 ? -1 : 0;
+}
+
+static int report_progress(const ingest_options *opt, long long done, long long total) {
+    if (opt->progress == NULL) {
+        return 0;
+    }
+    int stage = metrics_enter(STAGE_OTHER);
+    int cancel = opt->progress(done, total);
+    metrics_leave(stage);
+    if (cancel != 0) {
+        fprintf(stderr, "Analysis cancelled\n");
+        return -1;
+    }
+    return 0;
+}
+
+static int parallel_progress(long long done, long long total, const void *ctx) {
+    return report_progress(ctx, done, total);
+}/*report_progress in the shape analyze_parallel calls it*/
+
+static int feed_memory(analyzer_stream *s, const char *buf, size_t len, const ingest_options *opt) {
+    if (opt->n_threads > 1 && !opt->sketch) {
+        return analyze_parallel(s, buf, len, opt->n_threads, opt->progress != NULL ? parallel_progress : NULL, opt);
+    }
+    if (opt->progress == NULL) {
+        return analyzer_stream_feed(s, buf, len); /*tokens are bound straight from buf without copies*/
+    }
+
+    // Feed in slices so progress can be reported, only a token cut by a slice edge is copied
+    for (size_t done = 0; done < len; ) {
+        size_t n = len - done < PROGRESS_SLICE ? len - done : PROGRESS_SLICE;
+        if (analyzer_stream_feed(s, buf + done, n) != 0) {
+            return -1;
+        }
+        done += n;
+        if (report_progress(opt, (long long)done, (long long)len) != 0) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static int start_stream(analyzer_stream *s, int text_id, const ingest_options *opt) {
+    if (analyzer_stream_init(s, text_id, &opt->cfg) != 0) {
+        return -1;
+    }
+    if (opt->sketch && analyzer_stream_use_sketch(s) != 0) {
+        analyzer_stream_free(s);
+        return -1;
+    }
+    return 0;
+}
+
+static int analyze_memory(const char *buf, size_t len, const ingest_options *opt, ingest_result *out) {
+    analyzer_stream s;
+
+    if (start_stream(&s, out->text_id, opt) != 0) {
+        return -1;
+    }
+
+    int stage = metrics_enter(STAGE_TOKENIZE);
+    int rc = feed_memory(&s, buf, len, opt);
+    if (rc == 0) {
+        rc = finish_stream(&s, out);
+    }
+    metrics_leave(stage);
+    analyzer_stream_free(&s);
+    if (rc != 0) {
+        return -1;
+    }
+
+    out->bytes = (long long)len;
+    return save_preview(out->text_id, buf, len < MAX_TEXT_LEN ? len : MAX_TEXT_LEN, out->bytes);
+}
+
+static int seek_to(FILE *in, long long offset, long long *size);
+
+static int reopen_last_token(FILE *in, const text_state *from, analyzer_stream *s) {
+    // A log may have been read while a token was half written. When the new bytes go on
+    // with that token, take the stored half back and feed it again ahead of them
+    long long size;
+    int next = fgetc(in);
+    if (seek_to(in, from->bytes, &size) != 0) {
+        fprintf(stderr, "Failed to seek in the input\n");
+        return -1;
+    }
+    if (next == EOF || from->tokens == 0 || s->cfg.delim[(unsigned char)next]) {
+        return 0;
+    }
+
+    // Read backwards to the delimiter in front of the last token, a chunk at a time
+    char *token = NULL;
+    size_t len = 0;
+    long long start = from->bytes;
+    int rc = 0;
+    while (rc == 0 && start > 0) {
+        size_t n = start < CHUNK_SIZE ? (size_t)start : CHUNK_SIZE;
+        char *grown = realloc(token, len + n);
+        if (grown == NULL) {
+            fprintf(stderr, "Failed to allocate token buffer\n");
+            rc = -1;
+            break;
+        }
+        token = grown;
+        memmove(token + n, token, len);
+        if (seek_to(in, start - (long long)n, &size) != 0 || fread(token, 1, n, in) != n) {
+            fprintf(stderr, "Failed to read input\n");
+            rc = -1;
+            break;
+        }
+        size_t keep = n;
+        while (keep > 0 && !s->cfg.delim[(unsigned char)token[keep - 1]]) {
+            keep--;
+        }
+        start -= (long long)(n - keep);
+        if (keep > 0) {
+            memmove(token, token + keep, len + n - keep);
+            len += n - keep;
+            break; /*found the delimiter*/
+        }
+        len += n;
+    }
+    if (rc == 0 && len > 0) {
+        rc = analyzer_stream_retract(s, token, len);
+        if (rc == 0) {
+            rc = analyzer_stream_feed(s, token, len); /*ends in the carry, the next chunk finishes it*/
+        }
+    }
+    free(token);
+    if (rc == 0 && seek_to(in, from->bytes, &size) != 0) {
+        fprintf(stderr, "Failed to seek in the input\n");
+        rc = -1;
+    }
+    return rc;
+}/*re-tokenize the token an append continues, from->bytes is where the file is positioned*/
+
+static int analyze_stream(FILE *in, const ingest_options *opt, const text_state *from, ingest_result *out) {
+    char *chunk = malloc(CHUNK_SIZE);
+    char *preview = malloc(MAX_TEXT_LEN);
+    size_t preview_len = 0;
+    size_t preview_cap = from == NULL ? MAX_TEXT_LEN : from->bytes < MAX_TEXT_LEN ? (size_t)(MAX_TEXT_LEN - from->bytes) : 0;
+    analyzer_stream s;
+    size_t n;
+    int rc = 0;
+
+    if (chunk == NULL || preview == NULL || start_stream(&s, out->text_id, opt) != 0) {
+        free(chunk);
+        free(preview);
+        return -1;
+    }
+    if (from != NULL && (analyzer_stream_resume(&s, from->tokens) != 0 || reopen_last_token(in, from, &s) != 0)) {
+        analyzer_stream_free(&s);
+        free(chunk);
+        free(preview);
+        return -1;
+    }
+
+    // Memory stays constant: one chunk, the preview and whatever token spans the chunk boundary
+    int stage = metrics_enter(STAGE_READ);
+    while (rc == 0 && (n = fread(chunk, 1, CHUNK_SIZE, in)) > 0) {
+        metrics_enter(STAGE_TOKENIZE);
+        if (preview_len < preview_cap) {
+            size_t take = preview_cap - preview_len;
+            if (take > n) take = n;
+            memcpy(preview + preview_len, chunk, take);
+            preview_len += take;
+        }
+        out->bytes += (long long)n;
+        rc = analyzer_stream_feed(&s, chunk, n);
+        if (rc == 0 && opt->progress != NULL && out->bytes % PROGRESS_SLICE < CHUNK_SIZE) {
+            rc = report_progress(opt, out->bytes, -1);
+        }
+        metrics_enter(STAGE_READ);
+    }
+    metrics_enter(STAGE_TOKENIZE);
+    if (rc == 0 && ferror(in)) {
+        fprintf(stderr, "Failed to read input\n");
+        rc = -1;
+    }
+    if (rc == 0) {
+        rc = finish_stream(&s, out);
+    }
+    metrics_leave(stage);
+    analyzer_stream_free(&s);
+    if (rc == 0) {
+        rc = from == NULL
+            ? save_preview(out->text_id, preview, preview_len, out->bytes)
+            : append_preview(out->text_id, from, preview, preview_len, from->bytes + out->bytes);
+    }
+
+    free(chunk);
+    free(preview);
+    return rc;
+}
+
+void ingest_options_init(ingest_options *opt) {
+    tokenizer_config_init(&opt->cfg, TOK_SPLIT_DEFAULT);
+    opt->n_threads = 1;
+    opt->force_stream = 0;
+    opt->sketch = 0;
+    opt->progress = NULL;
+}
+
+int ingest_buffer(const char *buf, size_t len, const ingest_options *opt, ingest_result *out) {
+    if (begin_text(out) != 0) {
+        return -1;
+    }
+    return end_text(analyze_memory(buf, len, opt, out), out);
+}
+
+int ingest_stream(FILE *in, const ingest_options *opt, ingest_result *out) {
+    if (begin_text(out) != 0) {
+        return -1;
+    }
+    return end_text(analyze_stream(in, opt, NULL, out), out);
+}
+
+int ingest_file(const char *path, const ingest_options *opt, ingest_result *out) {
+    mapped_file mf;
+
+    int stage = metrics_enter(STAGE_READ);
+    int mapped = !opt->force_stream && map_file(path, &mf) == 0;
+    metrics_leave(stage);
+    if (mapped) {
+        int rc = -1;
+        if (begin_text(out) == 0) {
+            rc = end_text(analyze_memory(mf.data, mf.size, opt, out), out);
+        }
+        stage = metrics_enter(STAGE_READ);
+        unmap_file(&mf);
+        metrics_leave(stage);
+        return rc;
+    }
+
+    // Not mappable (pipe, empty file, ...) or streaming requested: read it in chunks
+    FILE *in = fopen(path, "rb");
+    if (in == NULL) {
+        fprintf(stderr, "Failed to open %s\n", path);
+        return -1;
+    }
+    int rc = ingest_stream(in, opt, out);
+    fclose(in);
+    return rc;
+}
+
+static int seek_to(FILE *in, long long offset, long long *size) {
+#ifdef _WIN32
+    struct _stat64 st;
+    if (_fstat64(_fileno(in), &st) != 0) {
+        return -1;
+    }
+    *size = (long long)st.st_size;
+    return _fseeki64(in, offset, SEEK_SET);
+#else
+    struct stat st;
+    if (fstat(fileno(in), &st) != 0) {
+        return -1;
+    }
+    *size = (long long)st.st_size;
+    return fseeko(in, (off_t)offset, SEEK_SET);
+#endif
+}/*position a file at a 64-bit offset and report its current size*/
+
+int ingest_append_file(int text_id, const char *path, const ingest_options *opt, ingest_result *out) {
+    text_state from;
+    long long size;
+
+    memset(out, 0, sizeof(*out));
+    out->text_id = text_id;
+    if (db_get_text_state(text_id, &from) != 0) {
+        fprintf(stderr, "No text with ID %d to append to\n", text_id);
+        return -1;
+    }
+    if (from.sketched || opt->sketch) {
+        fprintf(stderr, "Sketched texts cannot be appended to\n");
+        return -1;
+    }
+
+    FILE *in = fopen(path, "rb");
+    if (in == NULL) {
+        fprintf(stderr, "Failed to open %s\n", path);
+        return -1;
+    }
+    int stage = metrics_enter(STAGE_READ);
+    int rc = seek_to(in, from.bytes, &size);
+    metrics_leave(stage);
+    if (rc != 0) {
+        fprintf(stderr, "Failed to seek in %s\n", path);
+    } else if (size < from.bytes) {
+        fprintf(stderr, "%s is shorter than the %lld bytes already analyzed, was it truncated or rotated?\n", path, from.bytes);
+        rc = -1;
+    } else if (size > from.bytes && open_text() == 0) {
+        rc = end_text(analyze_stream(in, opt, &from, out), out);
+    } else if (size > from.bytes) {
+        rc = -1;
+    } /*nothing new, no transaction needed*/
+    fclose(in);
+    return rc;
+}
+
+/*state of the Python binding, calls are serialized on the Python side.
+  There is one connection and one set of options per process, so a second open is refused
+  instead of quietly sharing them*/
+static ingest_options ta_options;
+static int ta_is_open = 0;
+
+TA_API int ta_open(const char *db_path, const char *journal_mode, const char *synchronous) {
+    if (ta_is_open) {
+        fprintf(stderr, "The analyzer library already has a database open, close it first\n");
+        return TA_ALREADY_OPEN;
+    }
+    if (db_init(db_path) != 0 ||
+        db_configure(journal_mode ? journal_mode : DB_JOURNAL_MODE, synchronous ? synchronous : DB_SYNCHRONOUS) != 0) {
+        db_close();
+        return -1;
+    }
+    ingest_options_init(&ta_options);
+    ta_is_open = 1;
+    return 0;
+}
+
+TA_API int ta_set_options(const char *delimiters, int fold_case, int n_threads) {
+    tokenizer_config_init(&ta_options.cfg, TOK_SPLIT_DEFAULT);
+    if (delimiters != NULL) {
+        tokenizer_config_delimiters(&ta_options.cfg, delimiters);
+    }
+    tokenizer_config_fold_case(&ta_options.cfg, fold_case);
+    ta_options.n_threads = n_threads > 0 ? n_threads : parallel_default_threads();
+    return 0;
+}
+
+TA_API void ta_set_sketch(int on) {
+    ta_options.sketch = on;
+}
+
+TA_API void ta_set_progress(ingest_progress_fn progress) {
+    ta_options.progress = progress;
+}
+
+TA_API int ta_analyze_text(const char *text, long long len, ingest_result *out) {
+    if (!ta_is_open) {
+        return -1;
+    }
+    return ingest_buffer(text, (size_t)len, &ta_options, out);
+}
+
+TA_API int ta_analyze_file(const char *path, ingest_result *out) {
+    if (!ta_is_open) {
+        return -1;
+    }
+    return ingest_file(path, &ta_options, out);
+}
+
+TA_API int ta_append_file(int text_id, const char *path, ingest_result *out) {
+    if (!ta_is_open) {
+        return -1;
+    }
+    return ingest_append_file(text_id, path, &ta_options, out);
+}
+
+TA_API int ta_begin(void) {
+    int stage = metrics_enter(STAGE_COMMIT);
+    int rc = ta_is_open ? db_begin() : -1;
+    metrics_leave(stage);
+    return rc;
+}
+
+TA_API int ta_commit(void) {
+    int stage = metrics_enter(STAGE_COMMIT);
+    int rc = ta_is_open ? db_commit() : -1;
+    metrics_leave(stage);
+    return rc;
+}
+
+TA_API int ta_rollback(void) {
+    int stage = metrics_enter(STAGE_COMMIT);
+    int rc = ta_is_open ? db_rollback() : -1;
+    metrics_leave(stage);
+    return rc;
+}
+
+TA_API void ta_set_metrics(int on) {
+    metrics_enable(on);
+    db_trace_statements(on);
+}
+
+TA_API void ta_reset_metrics(void) {
+    metrics_reset();
+}
+
+TA_API long long ta_metrics_json(char *buf, long long cap) {
+    return (long long)metrics_format(buf, buf != NULL && cap > 0 ? (size_t)cap : 0);
+}
+
+TA_API void ta_close(void) {
+    db_close();
+    ta_is_open = 0;
+}
\ No newline at end of file
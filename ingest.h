@@ -0,0 +1,63 @@
+#ifndef INGEST_H
+#define INGEST_H
+
+/* The head of "ingest", one call per text: insert it, tokenize it and commit it*/
+
+#include <stdio.h>
+#include "tokenizer.h" /*byte class tokenizer*/
+
+#define MAX_TEXT_LEN 200000 /*leading bytes kept in texts.content, the full input is always tokenized*/
+#define PROGRESS_SLICE (4 << 20) /*bytes tokenized between progress reports*/
+
+#ifdef _WIN32
+#define TA_API __declspec(dllexport)
+#else
+#define TA_API
+#endif
+
+/*progress hook, total is -1 when the input size is unknown, return nonzero to cancel the text*/
+typedef int (*ingest_progress_fn)(long long done, long long total);
+
+typedef struct {
+    tokenizer_config cfg;
+    int n_threads;    /*threads used for mapped files, 1 = single-threaded*/
+    int force_stream; /*read files in chunks instead of mapping them*/
+    int sketch;       /*summarize token counts in fixed size sketches instead of token_freq, single-threaded*/
+    ingest_progress_fn progress; /*optional, NULL for no reports*/
+} ingest_options;
+
+typedef struct {
+    int text_id;
+    long long tokens;   /*tokens written for the text*/
+    long long distinct; /*distinct tokens after normalization*/
+    long long bytes;    /*input size*/
+} ingest_result;
+
+void ingest_options_init(ingest_options *opt);/*default delimiters, no folding, one thread*/
+
+int ingest_buffer(const char *buf, size_t len, const ingest_options *opt, ingest_result *out);/*analyze an in-memory text, buf is never modified*/
+
+int ingest_file(const char *path, const ingest_options *opt, ingest_result *out);/*analyze a file, memory mapped when possible*/
+
+int ingest_stream(FILE *in, const ingest_options *opt, ingest_result *out);/*analyze everything readable from in, chunk by chunk*/
+
+int ingest_append_file(int text_id, const char *path, const ingest_options *opt, ingest_result *out);/*analyze the bytes of path past those text_id already holds, a token the previous read cut off is counted again whole; out counts only the new part*/
+
+/*flat entry points for the Python binding (text_analyzer.py), one open database per process.
+  The ta_set_* options apply to that one database until ta_close*/
+#define TA_ALREADY_OPEN (-2)
+TA_API int ta_open(const char *db_path, const char *journal_mode, const char *synchronous);/*TA_ALREADY_OPEN until ta_close*/
+TA_API int ta_set_options(const char *delimiters, int fold_case, int n_threads);
+TA_API void ta_set_sketch(int on);/*see ingest_options.sketch*/
+TA_API void ta_set_progress(ingest_progress_fn progress);/*NULL turns reports off*/
+TA_API int ta_analyze_text(const char *text, long long len, ingest_result *out);
+TA_API int ta_analyze_file(const char *path, ingest_result *out);
+TA_API int ta_append_file(int text_id, const char *path, ingest_result *out);
+TA_API int ta_begin(void);/*group the following texts into one transaction*/
+TA_API int ta_commit(void);
+TA_API int ta_rollback(void);
+TA_API void ta_set_metrics(int on);/*collect stage timers and statement counts, see metrics.h*/
+TA_API void ta_reset_metrics(void);
+TA_API long long ta_metrics_json(char *buf, long long cap);/*JSON report, returns the length it needs without the NUL*/
+TA_API void ta_close(void);
+#endif
\ No newline at end of file
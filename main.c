@@ -1,51 +1,186 @@
-#include "analyzer.h"  /*tokenizer API*/
+#include "ingest.h"    /*text ingest API*/
 #include "db.h"        /*database API*/
+#include "parallel.h"  /*multi-threaded analysis*/
+#include "metrics.h"   /*stage timers*/
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#ifdef _WIN32
+#include <windows.h> /*Sleep*/
+#else
+#include <unistd.h>  /*usleep*/
+#endif
 
 #define DB_PATH "analysis.db"
-#define MAX_TEXT_LEN 200000
 
-int main() {
-    char buf[MAX_TEXT_LEN];
-    printf("Please enter text to analyze: ");
-    
-    // Fix fgets call
-    if (fgets(buf, sizeof(buf), stdin) == NULL) {
-        fprintf(stderr, "Failed to read input\n");
+static void usage(const char *prog) {
+    fprintf(stderr, "Usage: %s [--journal=MODE] [--synchronous=MODE] [--stream] [--delimiters=CHARS] [--fold-case] [--sketch] [--threads=N] [--metrics=FILE]\n"
+                    "       [--append=ID] [--follow[=SECONDS]] [FILE|-]\n", prog);
+    fprintf(stderr, "  FILE           text to analyze, memory mapped when possible (default: stdin until EOF)\n");
+    fprintf(stderr, "  --stream       read FILE in chunks instead of mapping it\n");
+    fprintf(stderr, "  --delimiters   split on exactly these bytes, \\t \\n \\r \\\\ escapes allowed\n");
+    fprintf(stderr, "                 (default: whitespace, ASCII punctuation and control bytes)\n");
+    fprintf(stderr, "  --fold-case    lowercase ASCII letters before counting\n");
+    fprintf(stderr, "  --sketch       keep approximate top tokens, counts and distinct count in fixed memory\n");
+    fprintf(stderr, "                 instead of the exact frequency table, for huge texts (vis.py --approx)\n");
+    fprintf(stderr, "  --threads      count a mapped FILE on N threads, 0 = one per CPU (default 1)\n");
+    fprintf(stderr, "  --append       add the bytes of FILE past those text ID already holds to that text,\n");
+    fprintf(stderr, "                 a token cut off at the previous read is counted again whole\n");
+    fprintf(stderr, "  --follow       keep appending FILE as it grows, one commit per poll (default every 1 s),\n");
+    fprintf(stderr, "                 to the --append text or to a new one\n");
+    fprintf(stderr, "  --journal      SQLite journal mode (default %s)\n", DB_JOURNAL_MODE);
+    fprintf(stderr, "  --synchronous  SQLite synchronous mode (default %s)\n", DB_SYNCHRONOUS);
+    fprintf(stderr, "  --metrics      write per-stage timings and statement counts as JSON, - = stderr\n");
+    fprintf(stderr, "                 (default: $%s if set, otherwise no metrics)\n", METRICS_ENV);
+}
+
+static void unescape(char *s) {
+    char *out = s;
+    for (; *s; s++) {
+        if (*s == '\\' && s[1] != '\0') {
+            s++;
+            *out++ = *s == 't' ? '\t' : *s == 'n' ? '\n' : *s == 'r' ? '\r' : *s;
+        } else {
+            *out++ = *s;
+        }
+    }
+    *out = '\0';
+}/*expand the escapes accepted by --delimiters in place*/
+
+static int finish(int rc, const char *metrics_path) {
+    db_close();
+    if (metrics_path != NULL && metrics_write(metrics_path) != 0) {
+        fprintf(stderr, "Failed to write metrics to %s\n", metrics_path);
+    }
+    return rc;
+}/*close the database and write the metrics report if one was asked for*/
+
+static void pause_ms(int ms) {
+#ifdef _WIN32
+    Sleep((DWORD)ms);
+#else
+    usleep((useconds_t)ms * 1000);
+#endif
+}
+
+static int follow(int text_id, const char *path, const ingest_options *opt, int interval_ms) {
+    ingest_result result;
+
+    printf("Following %s into text ID %d, Ctrl+C to stop\n", path, text_id);
+    fflush(stdout);
+    for (;;) {
+        if (ingest_append_file(text_id, path, opt, &result) != 0) {
+            return -1;
+        }
+        if (result.bytes > 0) {
+            printf("Appended %lld tokens (%lld bytes)\n", result.tokens, result.bytes);
+            fflush(stdout);
+        }
+        pause_ms(interval_ms);
+    }
+}/*append whatever the file gained since the last poll, until an error or the process is stopped*/
+
+int main(int argc, char *argv[]) {
+    const char *journal_mode = DB_JOURNAL_MODE;
+    const char *synchronous = DB_SYNCHRONOUS;
+    const char *path = NULL;
+    const char *metrics_path = getenv(METRICS_ENV);
+    int append_id = 0;
+    int follow_ms = 0;
+    ingest_options opt;
+    ingest_result result;
+
+    ingest_options_init(&opt);
+
+    for (int i = 1; i < argc; i++) {
+        if (strncmp(argv[i], "--journal=", 10) == 0) {
+            journal_mode = argv[i] + 10;
+        } else if (strncmp(argv[i], "--synchronous=", 14) == 0) {
+            synchronous = argv[i] + 14;
+        } else if (strcmp(argv[i], "--stream") == 0) {
+            opt.force_stream = 1;
+        } else if (strncmp(argv[i], "--delimiters=", 13) == 0) {
+            unescape(argv[i] + 13);
+            tokenizer_config_delimiters(&opt.cfg, argv[i] + 13);
+        } else if (strcmp(argv[i], "--fold-case") == 0) {
+            tokenizer_config_fold_case(&opt.cfg, 1);
+        } else if (strcmp(argv[i], "--sketch") == 0) {
+            opt.sketch = 1;
+        } else if (strncmp(argv[i], "--threads=", 10) == 0) {
+            opt.n_threads = atoi(argv[i] + 10);
+            if (opt.n_threads <= 0) {
+                opt.n_threads = parallel_default_threads();
+            }
+        } else if (strncmp(argv[i], "--append=", 9) == 0) {
+            append_id = atoi(argv[i] + 9);
+        } else if (strcmp(argv[i], "--follow") == 0) {
+            follow_ms = 1000;
+        } else if (strncmp(argv[i], "--follow=", 9) == 0) {
+            follow_ms = (int)(atof(argv[i] + 9) * 1000);
+            if (follow_ms <= 0) {
+                follow_ms = 1000;
+            }
+        } else if (strncmp(argv[i], "--metrics=", 10) == 0) {
+            metrics_path = argv[i] + 10;
+        } else if (path == NULL && (argv[i][0] != '-' || strcmp(argv[i], "-") == 0)) {
+            path = argv[i];
+        } else {
+            usage(argv[0]);
+            return 1;
+        }
+    }
+
+    if ((append_id > 0 || follow_ms > 0) && (path == NULL || strcmp(path, "-") == 0)) {
+        fprintf(stderr, "--append and --follow need a FILE\n");
         return 1;
     }
-    
-    // Remove possible newline character
-    size_t len = strlen(buf);
-    if (len > 0 && buf[len-1] == '\n') {
-        buf[len-1] = '\0';
+
+    if (metrics_path != NULL && metrics_path[0] == '\0') {
+        metrics_path = NULL;
+    }
+    metrics_enable(metrics_path != NULL);
+
+    if (path == NULL) {
+        printf("Please enter text to analyze: ");
+        fflush(stdout);
     }
     
     // Initialize database
-    if (db_init(DB_PATH) != 0) {
+    if (db_init(DB_PATH) != 0 || db_configure(journal_mode, synchronous) != 0) {
         fprintf(stderr, "Database initialization failed\n");
-        return 1;
+        return finish(1, metrics_path);
     }
 
-    // Insert text into database
-    int text_id = db_insert_text(buf);
-    if (text_id < 0) {
-        fprintf(stderr, "Failed to insert text\n");
-        db_close();
-        return 1;
+    if (follow_ms > 0) {
+        if (append_id <= 0) {
+            // Start an empty text, the first poll fills it in
+            if (ingest_buffer("", 0, &opt, &result) != 0) {
+                return finish(1, metrics_path);
+            }
+            append_id = result.text_id;
+        }
+        follow(append_id, path, &opt, follow_ms);
+        return finish(1, metrics_path);
+    }
+    if (append_id > 0) {
+        if (ingest_append_file(append_id, path, &opt, &result) != 0) {
+            fprintf(stderr, "Append failed\n");
+            return finish(1, metrics_path);
+        }
+        printf("\nAppended %lld tokens (%lld bytes) to text ID %d\n", result.tokens, result.bytes, result.text_id);
+        return finish(0, metrics_path);
     }
 
     // Perform tokenization
-    int result = tokenize_with_id(buf, text_id);
-    if (result < 0) {
+    int rc = path == NULL || strcmp(path, "-") == 0
+        ? ingest_stream(stdin, &opt, &result)
+        : ingest_file(path, &opt, &result);
+    if (rc != 0) {
         fprintf(stderr, "Tokenization process error\n");
-        db_close();
-        return 1;
+        return finish(1, metrics_path);
     }
 
-    printf("Analysis complete! Text ID: %d\n", text_id);
-    db_close();
-    return 0;
+    printf("\nFound and saved %lld tokens\n", result.tokens);
+    printf("Analysis complete! Text ID: %d\n", result.text_id);
+    return finish(0, metrics_path);
 }
\ No newline at end of file
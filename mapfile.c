@@ -0,0 +1,88 @@
+#include "mapfile.h"
+#include <stdio.h> /*file*/
+
+#ifdef _WIN32
+#include <windows.h>
+
+int map_file(const char *path, mapped_file *mf)
+{
+    LARGE_INTEGER size;
+
+    mf->data = NULL;
+    mf->file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ | FILE_SHARE_WRITE, NULL,
+                           OPEN_EXISTING, FILE_FLAG_SEQUENTIAL_SCAN, NULL);
+    if (mf->file == INVALID_HANDLE_VALUE) {
+        return -1;
+    }
+    if (!GetFileSizeEx(mf->file, &size) || size.QuadPart == 0) {
+        CloseHandle(mf->file); /*empty files cannot be mapped, the caller falls back to reading*/
+        return -1;
+    }
+
+    mf->mapping = CreateFileMappingA(mf->file, NULL, PAGE_READONLY, 0, 0, NULL);
+    if (mf->mapping == NULL) {
+        CloseHandle(mf->file);
+        return -1;
+    }
+    mf->data = MapViewOfFile(mf->mapping, FILE_MAP_READ, 0, 0, 0);
+    if (mf->data == NULL) {
+        CloseHandle(mf->mapping);
+        CloseHandle(mf->file);
+        return -1;
+    }
+    mf->size = (size_t)size.QuadPart;
+    return 0;
+}
+
+void unmap_file(mapped_file *mf)
+{
+    if (mf->data != NULL) {
+        UnmapViewOfFile(mf->data);
+        CloseHandle(mf->mapping);
+        CloseHandle(mf->file);
+        mf->data = NULL;
+    }
+}
+
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+int map_file(const char *path, mapped_file *mf)
+{
+    struct stat st;
+
+    mf->data = NULL;
+    mf->fd = open(path, O_RDONLY);
+    if (mf->fd < 0) {
+        return -1;
+    }
+    if (fstat(mf->fd, &st) != 0 || !S_ISREG(st.st_mode) || st.st_size == 0) {
+        close(mf->fd); /*pipes and empty files cannot be mapped, the caller falls back to reading*/
+        return -1;
+    }
+
+    void *data = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_PRIVATE, mf->fd, 0);
+    if (data == MAP_FAILED) {
+        close(mf->fd);
+        return -1;
+    }
+#ifdef MADV_SEQUENTIAL
+    madvise(data, (size_t)st.st_size, MADV_SEQUENTIAL); /*let the kernel read ahead aggressively*/
+#endif
+    mf->data = data;
+    mf->size = (size_t)st.st_size;
+    return 0;
+}
+
+void unmap_file(mapped_file *mf)
+{
+    if (mf->data != NULL) {
+        munmap((void *)mf->data, mf->size);
+        close(mf->fd);
+        mf->data = NULL;
+    }
+}
+#endif
\ No newline at end of file
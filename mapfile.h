@@ -0,0 +1,22 @@
+#ifndef MAPFILE_H
+#define MAPFILE_H
+
+/* The head of "mapfile", read-only memory mapping of input files*/
+
+#include <stddef.h>
+
+typedef struct {
+    const char *data; /*start of the mapped region, never written to*/
+    size_t size;      /*file size in bytes*/
+#ifdef _WIN32
+    void *file;       /*HANDLE of the open file*/
+    void *mapping;    /*HANDLE of the file mapping object*/
+#else
+    int fd;
+#endif
+} mapped_file;
+
+int map_file(const char *path, mapped_file *mf);/*map a whole regular file read-only, returns -1 if it cannot be mapped*/
+
+void unmap_file(mapped_file *mf);/*release the mapping and the file*/
+#endif
\ No newline at end of file
@@ -0,0 +1,274 @@
+#include "metrics.h"
+#include <stdarg.h> /*variadic formatting*/
+#include <stdlib.h> /*dynamic allocation*/
+#include <string.h> /*string*/
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
+static const char *stage_names[STAGE_COUNT] = {"other", "read", "tokenize", "insert", "commit"};
+
+typedef struct {
+    double wall;
+    double cpu;
+} stage_time;
+
+typedef struct {
+    const char *sql;            /*statement text last seen, compared by pointer before the key*/
+    char key[METRICS_SQL_KEY];  /*leading SQL with runs of whitespace collapsed*/
+    long long count;
+    long long ns;
+} statement_count;
+
+static int enabled = 0;
+static int current = STAGE_OTHER;
+static double start_wall, start_cpu; /*clocks at the last reset*/
+static double mark_wall, mark_cpu;   /*clocks at the last stage switch*/
+static stage_time stages[STAGE_COUNT];
+static long long texts, bytes, tokens;
+static statement_count statements[METRICS_MAX_STATEMENTS];
+static int statement_kinds = 0;
+static statement_count other_statements;
+
+static void clock_now(double *wall, double *cpu)
+{
+#ifdef _WIN32
+    LARGE_INTEGER freq, count;
+    FILETIME created, exited, kernel, user;
+    QueryPerformanceFrequency(&freq);
+    QueryPerformanceCounter(&count);
+    *wall = (double)count.QuadPart / (double)freq.QuadPart;
+    GetProcessTimes(GetCurrentProcess(), &created, &exited, &kernel, &user);
+    *cpu = ((double)(((unsigned long long)kernel.dwHighDateTime << 32) | kernel.dwLowDateTime) +
+            (double)(((unsigned long long)user.dwHighDateTime << 32) | user.dwLowDateTime)) * 1e-7;
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    *wall = (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+    clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &ts);
+    *cpu = (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+#endif
+}/*monotonic wall clock and CPU time of every thread of the process, in seconds*/
+
+static void charge(void)
+{
+    double wall, cpu;
+    clock_now(&wall, &cpu);
+    stages[current].wall += wall - mark_wall;
+    stages[current].cpu += cpu - mark_cpu;
+    mark_wall = wall;
+    mark_cpu = cpu;
+}/*add the time since the last switch to the running stage*/
+
+void metrics_reset(void)
+{
+    memset(stages, 0, sizeof(stages));
+    memset(statements, 0, sizeof(statements));
+    memset(&other_statements, 0, sizeof(other_statements));
+    statement_kinds = 0;
+    texts = bytes = tokens = 0;
+    current = STAGE_OTHER;
+    clock_now(&start_wall, &start_cpu);
+    mark_wall = start_wall;
+    mark_cpu = start_cpu;
+}
+
+void metrics_enable(int on)
+{
+    if (on && !enabled) {
+        metrics_reset();
+    }
+    enabled = on;
+}
+
+int metrics_enabled(void)
+{
+    return enabled;
+}
+
+int metrics_enter(int stage)
+{
+    if (!enabled) {
+        return STAGE_OTHER;
+    }
+    int previous = current;
+    charge();
+    current = stage;
+    return previous;
+}
+
+void metrics_leave(int previous)
+{
+    if (enabled) {
+        charge();
+        current = previous;
+    }
+}
+
+void metrics_count_text(long long text_bytes, long long text_tokens)
+{
+    if (enabled) {
+        texts++;
+        bytes += text_bytes;
+        tokens += text_tokens;
+    }
+}
+
+static void make_key(const char *sql, char *key)
+{
+    size_t n = 0;
+    int space = 1; /*drops leading whitespace too*/
+    for (; *sql && n < METRICS_SQL_KEY - 1; sql++) {
+        if (*sql == ' ' || *sql == '\t' || *sql == '\n' || *sql == '\r') {
+            if (!space) {
+                key[n++] = ' ';
+            }
+            space = 1;
+        } else {
+            key[n++] = *sql;
+            space = 0;
+        }
+    }
+    while (n > 0 && key[n - 1] == ' ') {
+        n--;
+    }
+    key[n] = '\0';
+}
+
+void metrics_statement(const char *sql, long long ns)
+{
+    char key[METRICS_SQL_KEY];
+    statement_count *found = NULL;
+
+    if (!enabled || sql == NULL) {
+        return;
+    }
+    /*cached statements keep their SQL pointer, so the key is only built for the others*/
+    for (int i = 0; i < statement_kinds && found == NULL; i++) {
+        if (statements[i].sql == sql) {
+            found = &statements[i];
+        }
+    }
+    if (found == NULL) {
+        make_key(sql, key);
+        for (int i = 0; i < statement_kinds && found == NULL; i++) {
+            if (strcmp(statements[i].key, key) == 0) {
+                found = &statements[i];
+            }
+        }
+        if (found == NULL && statement_kinds < METRICS_MAX_STATEMENTS) {
+            found = &statements[statement_kinds++];
+            memcpy(found->key, key, sizeof(key));
+        }
+        if (found == NULL) {
+            found = &other_statements;
+        }
+        found->sql = sql;
+    }
+    found->count++;
+    found->ns += ns;
+}
+
+typedef struct {
+    char *buf;
+    size_t cap;
+    size_t len;
+} json_out;
+
+static void put(json_out *o, const char *fmt, ...)
+{
+    va_list ap;
+    char *dst = o->buf != NULL && o->len < o->cap ? o->buf + o->len : NULL;
+    va_start(ap, fmt);
+    int n = vsnprintf(dst, dst != NULL ? o->cap - o->len : 0, fmt, ap);
+    va_end(ap);
+    if (n > 0) {
+        o->len += (size_t)n;
+    }
+}/*append to the report, only counting the length once buf is full*/
+
+static void put_string(json_out *o, const char *s)
+{
+    put(o, "\"");
+    for (; *s; s++) {
+        if (*s == '"' || *s == '\\') {
+            put(o, "\\%c", *s);
+        } else if ((unsigned char)*s < 0x20) {
+            put(o, "\\u%04x", (unsigned char)*s);
+        } else {
+            put(o, "%c", *s);
+        }
+    }
+    put(o, "\"");
+}
+
+static void put_statement(json_out *o, const char *key, const statement_count *st, int first)
+{
+    put(o, "%s\n    {\"sql\": ", first ? "" : ",");
+    put_string(o, key);
+    put(o, ", \"count\": %lld, \"time_s\": %.6f}", st->count, (double)st->ns * 1e-9);
+}
+
+size_t metrics_format(char *buf, size_t cap)
+{
+    json_out o = {buf, cap, 0};
+    double wall, cpu;
+
+    if (enabled) {
+        charge();
+    }
+    clock_now(&wall, &cpu);
+    if (!enabled) {
+        wall = mark_wall;
+        cpu = mark_cpu;
+    }
+
+    put(&o, "{\n  \"source\": \"analyzer\",\n  \"wall_s\": %.6f,\n  \"cpu_s\": %.6f,\n  \"stages\": {",
+        wall - start_wall, cpu - start_cpu);
+    for (int i = 0; i < STAGE_COUNT; i++) {
+        put(&o, "%s\n    \"%s\": {\"wall_s\": %.6f, \"cpu_s\": %.6f}",
+            i ? "," : "", stage_names[i], stages[i].wall, stages[i].cpu);
+    }
+    put(&o, "\n  },\n  \"counters\": {\"texts\": %lld, \"bytes\": %lld, \"tokens\": %lld},\n  \"statements\": [",
+        texts, bytes, tokens);
+    for (int i = 0; i < statement_kinds; i++) {
+        put_statement(&o, statements[i].key, &statements[i], i == 0);
+    }
+    if (other_statements.count > 0) {
+        put_statement(&o, "other", &other_statements, statement_kinds == 0);
+    }
+    put(&o, "\n  ]\n}\n");
+    return o.len;
+}
+
+int metrics_write(const char *path)
+{
+    /*the clocks move between the sizing pass and the real one, so leave some slack*/
+    size_t cap = metrics_format(NULL, 0) + 64;
+    char *report = malloc(cap);
+    if (report == NULL) {
+        fprintf(stderr, "Failed to allocate metrics report\n");
+        return -1;
+    }
+    size_t len = metrics_format(report, cap);
+    if (len >= cap) {
+        len = cap - 1; /*cannot happen in practice, never write past the buffer*/
+    }
+
+    int to_stderr = strcmp(path, "-") == 0;
+    FILE *out = to_stderr ? stderr : fopen(path, "w");
+    if (out == NULL) {
+        fprintf(stderr, "Failed to open %s\n", path);
+        free(report);
+        return -1;
+    }
+    int rc = fwrite(report, 1, len, out) == len ? 0 : -1;
+    if (!to_stderr && fclose(out) != 0) {
+        rc = -1;
+    }
+    free(report);
+    return rc;
+}
\ No newline at end of file
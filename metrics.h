@@ -0,0 +1,40 @@
+#ifndef METRICS_H
+#define METRICS_H
+
+/* The head of "metrics", opt-in stage timers and counters for one process*/
+
+#include <stddef.h>
+#include <stdio.h>
+
+#define METRICS_ENV "TEXT_ANALYZER_METRICS" /*report path for the CLI when --metrics is not given, - = stderr*/
+#define METRICS_MAX_STATEMENTS 32 /*distinct SQL texts counted, later ones are summed under "other"*/
+#define METRICS_SQL_KEY 64 /*leading characters of a statement shown in the report*/
+
+/*every moment between metrics_reset and the report is charged to exactly one stage*/
+typedef enum {
+    STAGE_OTHER,    /*setup, schema migration, progress callbacks*/
+    STAGE_READ,     /*reading a stream, mapping and unmapping a file (mapped pages fault in while tokenizing)*/
+    STAGE_TOKENIZE, /*splitting, counting and merging tokens*/
+    STAGE_INSERT,   /*vocab lookups and every row written*/
+    STAGE_COMMIT,   /*begin, commit and savepoints, includes waiting for the write lock and the sync*/
+    STAGE_COUNT
+} metrics_stage;
+
+void metrics_enable(int on);/*start collecting, resets the counters when turned on*/
+
+int metrics_enabled(void);
+
+void metrics_reset(void);/*zero every counter and restart the clocks*/
+
+int metrics_enter(int stage);/*charge the time so far to the running stage and switch to stage, returns the stage to restore*/
+
+void metrics_leave(int previous);/*switch back to the stage metrics_enter returned*/
+
+void metrics_count_text(long long bytes, long long tokens);/*one text analyzed*/
+
+void metrics_statement(const char *sql, long long ns);/*one SQLite statement finished after ns nanoseconds*/
+
+size_t metrics_format(char *buf, size_t cap);/*JSON report into buf, returns the length it needs without the NUL, buf may be NULL*/
+
+int metrics_write(const char *path);/*write the JSON report to a file, "-" for stderr*/
+#endif
\ No newline at end of file
@@ -0,0 +1,127 @@
+import contextlib
+import json
+import sys
+import time
+
+# The Python half of metrics.c: reports from both share one JSON layout,
+#   {"source", "wall_s", "cpu_s", "stages": {name: {"wall_s", "cpu_s"}},
+#    "counters": {name: n}, "statements": [{"sql", "count", "time_s"}]}
+# so the GUI metrics panel shows either with format_report().
+
+class StageMetrics:
+    """Wall and CPU time per stage, every moment is charged to the innermost running stage
+
+    Usage:
+        recorder = StageMetrics("vis")
+        with recorder.stage("query"):
+            rows = load()
+            with recorder.stage("render"):  # query stops counting meanwhile
+                draw(rows)
+        write_report(recorder.report(), "metrics.json")
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self._stack = ["other"]
+        self._start = self._mark = (time.perf_counter(), time.process_time())
+
+    def _charge(self):
+        now = (time.perf_counter(), time.process_time())
+        entry = self.stages.setdefault(self._stack[-1], {"wall_s": 0.0, "cpu_s": 0.0})
+        entry["wall_s"] += now[0] - self._mark[0]
+        entry["cpu_s"] += now[1] - self._mark[1]
+        self._mark = now
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._charge()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self._stack.pop()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        self._charge()
+        return {
+            "source": self.source,
+            "wall_s": self._mark[0] - self._start[0],
+            "cpu_s": self._mark[1] - self._start[1],
+            "stages": {name: dict(times) for name, times in self.stages.items()},
+            "counters": dict(self.counters),
+            "statements": [],
+        }
+
+def merge_reports(reports, source):
+    """Sum reports of parallel workers, wall_s is the sum of their busy time"""
+    merged = {"source": source, "wall_s": 0.0, "cpu_s": 0.0, "stages": {}, "counters": {}, "statements": []}
+    statements = {}
+    for report in reports:
+        merged["wall_s"] += report["wall_s"]
+        merged["cpu_s"] += report["cpu_s"]
+        for name, times in report["stages"].items():
+            entry = merged["stages"].setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0})
+            entry["wall_s"] += times["wall_s"]
+            entry["cpu_s"] += times["cpu_s"]
+        for name, n in report.get("counters", {}).items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + n
+        for statement in report.get("statements", []):
+            entry = statements.setdefault(statement["sql"], {"sql": statement["sql"], "count": 0, "time_s": 0.0})
+            entry["count"] += statement["count"]
+            entry["time_s"] += statement["time_s"]
+    merged["statements"] = list(statements.values())
+    return merged
+
+def write_report(report, path):
+    """Write a report as JSON, "-" writes to stderr"""
+    if path == "-":
+        json.dump(report, sys.stderr, indent=2)
+        sys.stderr.write("\n")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+def read_report(path):
+    """Load a report, None if the run did not leave a readable one"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def format_report(report, statements=8):
+    """Human readable summary: stages by time, CPU share and the busiest statements
+
+    A stage whose CPU time is well below its wall time was waiting, on the disk
+    for read and commit (the sync), on the write lock, or on another process.
+    """
+    wall = report.get("wall_s") or 0.0
+    lines = [f"{report.get('source', 'run')}: {wall * 1000:.1f} ms wall, {report.get('cpu_s', 0.0) * 1000:.1f} ms CPU"]
+    for name, times in sorted(report["stages"].items(), key=lambda item: item[1]["wall_s"], reverse=True):
+        if times["wall_s"] <= 0:
+            continue
+        share = times["wall_s"] / wall if wall > 0 else 0.0
+        busy = times["cpu_s"] / times["wall_s"]
+        lines.append(f"  {name:<10} {times['wall_s'] * 1000:9.1f} ms  {share:6.1%}  CPU {busy:6.1%}")
+    counters = report.get("counters") or {}
+    if counters:
+        lines.append("  " + ", ".join(f"{name} {value}" for name, value in counters.items()))
+        if counters.get("tokens") and wall > 0:
+            lines.append(f"  {counters['tokens'] / wall:.0f} tokens/s, {counters.get('bytes', 0) / wall / 1e6:.1f} MB/s")
+    busiest = sorted(report.get("statements") or [], key=lambda s: s["time_s"], reverse=True)[:statements]
+    if busiest:
+        lines.append("  Statements:")
+        for statement in busiest:
+            lines.append(f"    {statement['count']:>9} x {statement['time_s'] * 1000:9.1f} ms  {statement['sql']}")
+    if report.get("workers"):
+        lines.append(format_report(report["workers"], statements))
+    return "\n".join(lines)
@@ -0,0 +1,434 @@
+#include "parallel.h"
+#include "db.h"      /*vocab ids*/
+#include "metrics.h" /*stage timers*/
+#include <stdio.h>  /*file*/
+#include <stdlib.h> /*dynamic allocation*/
+#include <string.h> /*string*/
+
+#ifdef _WIN32
+#include <windows.h>
+typedef CRITICAL_SECTION pipe_lock;
+typedef CONDITION_VARIABLE pipe_cond;
+#else
+#include <pthread.h>
+#include <unistd.h>
+typedef pthread_mutex_t pipe_lock;
+typedef pthread_cond_t pipe_cond;
+#endif
+
+/*shared by the workers and the writer, guards every shard's chunk counters*/
+typedef struct {
+    pipe_lock lock;
+    pipe_cond changed; /*a chunk was filled or taken, or the run was cancelled*/
+    int cancel;
+} pipeline;
+
+typedef struct {
+    int *ids;                /*shard-local token ids in input order*/
+    int n;
+    const char **fresh;      /*tokens first seen in this chunk, their ids follow those of the chunk before*/
+    size_t *fresh_lens;
+    int n_fresh;
+    int fresh_cap;
+    size_t end;              /*shard bytes tokenized once this chunk is stored*/
+} token_chunk;
+
+typedef struct {
+    const tokenizer_config *cfg;
+    pipeline *pipe;
+    const char *buf;         /*shard start, always at a token boundary*/
+    size_t len;
+    size_t pos;              /*where the worker goes on tokenizing*/
+    counter ids;             /*token -> shard-local id from 1, the entry count holds the id until the merge*/
+    long long *freq;         /*occurrences by local id*/
+    int n_ids;
+    int freq_cap;
+    char *folded;            /*case folded copy of the current token*/
+    size_t folded_cap;
+    token_chunk ring[PARALLEL_CHUNKS_AHEAD];
+    long long filled;        /*chunks filled by the worker, under the pipeline lock*/
+    long long taken;         /*chunks stored by the writer, under the pipeline lock*/
+    int done;                /*the worker filled its last chunk or failed*/
+    int failed;
+} shard;
+
+static void pipe_init(pipeline *p)
+{
+#ifdef _WIN32
+    InitializeCriticalSection(&p->lock);
+    InitializeConditionVariable(&p->changed);
+#else
+    pthread_mutex_init(&p->lock, NULL);
+    pthread_cond_init(&p->changed, NULL);
+#endif
+    p->cancel = 0;
+}
+
+static void pipe_free(pipeline *p)
+{
+#ifdef _WIN32
+    DeleteCriticalSection(&p->lock);
+#else
+    pthread_mutex_destroy(&p->lock);
+    pthread_cond_destroy(&p->changed);
+#endif
+}
+
+static void pipe_enter(pipeline *p)
+{
+#ifdef _WIN32
+    EnterCriticalSection(&p->lock);
+#else
+    pthread_mutex_lock(&p->lock);
+#endif
+}
+
+static void pipe_leave(pipeline *p)
+{
+#ifdef _WIN32
+    LeaveCriticalSection(&p->lock);
+#else
+    pthread_mutex_unlock(&p->lock);
+#endif
+}
+
+static void pipe_wait(pipeline *p)
+{
+#ifdef _WIN32
+    SleepConditionVariableCS(&p->changed, &p->lock, INFINITE);
+#else
+    pthread_cond_wait(&p->changed, &p->lock);
+#endif
+}
+
+static void pipe_wake(pipeline *p)
+{
+#ifdef _WIN32
+    WakeAllConditionVariable(&p->changed);
+#else
+    pthread_cond_broadcast(&p->changed);
+#endif
+}
+
+static int new_local_id(shard *sh, token_chunk *c, const counter_entry *e)
+{
+    if (sh->n_ids + 1 >= sh->freq_cap) {
+        int cap = sh->freq_cap ? sh->freq_cap * 2 : 1024;
+        long long *grown = realloc(sh->freq, cap * sizeof(long long));
+        if (grown == NULL) {
+            return -1;
+        }
+        sh->freq = grown;
+        sh->freq_cap = cap;
+    }
+    if (c->n_fresh == c->fresh_cap) {
+        int cap = c->fresh_cap ? c->fresh_cap * 2 : 256;
+        const char **fresh = realloc(c->fresh, cap * sizeof(*fresh));
+        if (fresh == NULL) {
+            return -1;
+        }
+        c->fresh = fresh;
+        size_t *lens = realloc(c->fresh_lens, cap * sizeof(*lens));
+        if (lens == NULL) {
+            return -1;
+        }
+        c->fresh_lens = lens;
+        c->fresh_cap = cap;
+    }
+    /*the entry's token copy stays put when the table grows, so the writer may read it*/
+    c->fresh[c->n_fresh] = e->token;
+    c->fresh_lens[c->n_fresh] = e->len;
+    c->n_fresh++;
+    sh->n_ids++;
+    sh->freq[sh->n_ids] = 0;
+    return sh->n_ids;
+}/*give a token its shard-local id and announce it in the chunk*/
+
+static int fill_chunk(shard *sh, token_chunk *c)
+{
+    tok_span span;
+
+    c->n = 0;
+    c->n_fresh = 0;
+    if (c->ids == NULL && (c->ids = malloc(PARALLEL_CHUNK_TOKENS * sizeof(int))) == NULL) {
+        return -1;
+    }
+
+    /*a shard ends at a delimiter or at the end of the input, so TOK_PARTIAL is a whole token too*/
+    while (c->n < PARALLEL_CHUNK_TOKENS && tok_next(sh->cfg, sh->buf, sh->len, &sh->pos, &span) != TOK_END) {
+        const char *token = sh->buf + span.offset;
+        if (sh->cfg->fold_case) {
+            if (span.length > sh->folded_cap) {
+                char *grown = realloc(sh->folded, span.length);
+                if (grown == NULL) {
+                    return -1;
+                }
+                sh->folded = grown;
+                sh->folded_cap = span.length;
+            }
+            tok_normalize(sh->cfg, token, span.length, sh->folded);
+            token = sh->folded;
+        }
+        counter_entry *e = counter_add(&sh->ids, token, span.length, 0);
+        if (e == NULL) {
+            return -1;
+        }
+        if (e->count == 0 && (e->count = new_local_id(sh, c, e)) < 0) {
+            return -1;
+        }
+        sh->freq[e->count]++;
+        c->ids[c->n++] = (int)e->count;
+    }
+    int more = c->n == PARALLEL_CHUNK_TOKENS;
+    c->end = more ? sh->pos : sh->len;
+    return more;
+}/*tokenize up to PARALLEL_CHUNK_TOKENS tokens of a shard, returns 1 if it has more, 0 at its end, -1 on failure*/
+
+static void fill_shard(shard *sh)
+{
+    pipeline *p = sh->pipe;
+    int more = 1;
+
+    while (more > 0) {
+        pipe_enter(p);
+        while (sh->filled - sh->taken == PARALLEL_CHUNKS_AHEAD && !p->cancel) {
+            pipe_wait(p);
+        }
+        if (p->cancel) {
+            sh->done = 1;
+            pipe_leave(p);
+            return;
+        }
+        token_chunk *c = &sh->ring[sh->filled % PARALLEL_CHUNKS_AHEAD];
+        pipe_leave(p);
+
+        more = fill_chunk(sh, c); /*the slot is the worker's until filled goes past it*/
+
+        pipe_enter(p);
+        if (more < 0) {
+            sh->failed = 1;
+        } else {
+            sh->filled++;
+        }
+        sh->done = more <= 0;
+        pipe_wake(p);
+        pipe_leave(p);
+    }
+}
+
+#ifdef _WIN32
+static DWORD WINAPI shard_worker(LPVOID arg)
+{
+    fill_shard(arg);
+    return 0;
+}
+#else
+static void *shard_worker(void *arg)
+{
+    fill_shard(arg);
+    return NULL;
+}
+#endif
+
+int parallel_default_threads(void)
+{
+#ifdef _WIN32
+    SYSTEM_INFO info;
+    GetSystemInfo(&info);
+    int n = (int)info.dwNumberOfProcessors;
+#else
+    int n = (int)sysconf(_SC_NPROCESSORS_ONLN);
+#endif
+    if (n < 1) n = 1;
+    if (n > PARALLEL_MAX_THREADS) n = PARALLEL_MAX_THREADS;
+    return n;
+}
+
+static size_t next_boundary(const tokenizer_config *cfg, const char *buf, size_t len, size_t at)
+{
+    /*move a cut forward onto a delimiter so no token is split between shards*/
+    return at + tok_word_prefix(cfg, buf + at, len - at);
+}
+
+typedef struct {
+    analyzer_stream *s;
+    long long *vocab_ids;    /*shard-local id -> vocab id of the shard being stored*/
+    int resolved;            /*local ids with a vocab id so far*/
+    int vocab_cap;
+    long long batch[PARALLEL_CHUNK_TOKENS];
+} writer;
+
+static int store_chunk(writer *w, const token_chunk *c)
+{
+    /*only tokens new to the shard are looked up, every other token is an array index*/
+    int stage = metrics_enter(STAGE_INSERT);
+    if (w->resolved + c->n_fresh + 1 > w->vocab_cap) {
+        int cap = w->vocab_cap ? w->vocab_cap : 1024;
+        while (cap < w->resolved + c->n_fresh + 1) {
+            cap *= 2;
+        }
+        long long *grown = realloc(w->vocab_ids, cap * sizeof(long long));
+        if (grown == NULL) {
+            metrics_leave(stage);
+            fprintf(stderr, "Failed to allocate token ids\n");
+            return -1;
+        }
+        w->vocab_ids = grown;
+        w->vocab_cap = cap;
+    }
+    for (int i = 0; i < c->n_fresh; i++) {
+        long long id = db_token_id(c->fresh[i], (int)c->fresh_lens[i]);
+        if (id < 0) {
+            metrics_leave(stage);
+            return -1;
+        }
+        w->vocab_ids[++w->resolved] = id;
+    }
+    for (int i = 0; i < c->n; i++) {
+        w->batch[i] = w->vocab_ids[c->ids[i]];
+    }
+    metrics_leave(stage);
+    return analyzer_stream_insert_ids(w->s, w->batch, c->n);
+}/*bind the vocab ids of a chunk's tokens and insert them at the next positions*/
+
+static int store_shard(writer *w, shard *sh, int threaded, size_t offset, size_t total,
+                       parallel_progress_fn progress, const void *ctx)
+{
+    pipeline *p = sh->pipe;
+    int rc = 0;
+
+    w->resolved = 0;
+    for (int more = 1; rc == 0 && more > 0; ) {
+        token_chunk *c = &sh->ring[0];
+        if (threaded) {
+            pipe_enter(p);
+            while (sh->taken == sh->filled && !sh->done) {
+                pipe_wait(p);
+            }
+            more = sh->taken < sh->filled;
+            c = &sh->ring[sh->taken % PARALLEL_CHUNKS_AHEAD];
+            if (!more && sh->failed) {
+                fprintf(stderr, "Failed to count tokens\n");
+                rc = -1;
+            }
+            pipe_leave(p);
+            if (!more) {
+                break;
+            }
+        } else if ((more = fill_chunk(sh, c)) < 0) {
+            fprintf(stderr, "Failed to count tokens\n"); /*no thread for this shard, it is tokenized here a chunk at a time*/
+            rc = -1;
+            break;
+        }
+
+        rc = store_chunk(w, c);
+        if (rc == 0 && progress != NULL && progress((long long)(offset + c->end), (long long)total, ctx) != 0) {
+            rc = -1;
+        }
+
+        if (threaded) {
+            pipe_enter(p);
+            sh->taken++;
+            pipe_wake(p);
+            pipe_leave(p);
+        }
+    }
+    return rc;
+}/*insert the tokens of one shard in input order as its worker hands them over*/
+
+int analyze_parallel(analyzer_stream *s, const char *buf, size_t len, int n_threads, parallel_progress_fn progress, const void *ctx)
+{
+    shard shards[PARALLEL_MAX_THREADS];
+#ifdef _WIN32
+    HANDLE threads[PARALLEL_MAX_THREADS];
+#else
+    pthread_t threads[PARALLEL_MAX_THREADS];
+#endif
+    int started[PARALLEL_MAX_THREADS] = {0};
+    size_t offsets[PARALLEL_MAX_THREADS];
+    pipeline pipe;
+    int rc = 0;
+
+    if (n_threads > PARALLEL_MAX_THREADS) n_threads = PARALLEL_MAX_THREADS;
+    if ((size_t)n_threads > len / PARALLEL_MIN_SHARD) n_threads = (int)(len / PARALLEL_MIN_SHARD);
+    if (n_threads < 1) n_threads = 1;
+
+    writer *w = calloc(1, sizeof(writer));
+    if (w == NULL) {
+        fprintf(stderr, "Failed to allocate token ids\n");
+        return -1;
+    }
+    w->s = s;
+    pipe_init(&pipe);
+
+    /*split the input into n_threads shards of roughly equal size*/
+    size_t start = 0;
+    for (int k = 0; k < n_threads; k++) {
+        size_t end = k == n_threads - 1 ? len : next_boundary(&s->cfg, buf, len, len / n_threads * (k + 1));
+        if (end < start) end = start;
+        memset(&shards[k], 0, sizeof(shard));
+        shards[k].cfg = &s->cfg;
+        shards[k].pipe = &pipe;
+        shards[k].buf = buf + start;
+        shards[k].len = end - start;
+        offsets[k] = start;
+        if (counter_init(&shards[k].ids, 1024) != 0) {
+            rc = -1;
+        }
+        start = end;
+    }
+
+    /*every shard gets a worker, this thread is the only one that talks to the database*/
+    for (int k = 0; k < n_threads && rc == 0; k++) {
+#ifdef _WIN32
+        threads[k] = CreateThread(NULL, 0, shard_worker, &shards[k], 0, NULL);
+        started[k] = threads[k] != NULL;
+#else
+        started[k] = pthread_create(&threads[k], NULL, shard_worker, &shards[k]) == 0;
+#endif
+    }
+    for (int k = 0; k < n_threads && rc == 0; k++) {
+        rc = store_shard(w, &shards[k], started[k], offsets[k], len, progress, ctx);
+    }
+
+    /*on failure or cancel the workers still waiting for room stop early*/
+    pipe_enter(&pipe);
+    pipe.cancel = 1;
+    pipe_wake(&pipe);
+    pipe_leave(&pipe);
+    for (int k = 0; k < n_threads; k++) {
+        if (!started[k]) continue;
+#ifdef _WIN32
+        WaitForSingleObject(threads[k], INFINITE);
+        CloseHandle(threads[k]);
+#else
+        pthread_join(threads[k], NULL);
+#endif
+    }
+
+    /*the local ids have served their purpose, the entries take the frequencies for the merge*/
+    for (int k = 0; k < n_threads && rc == 0; k++) {
+        size_t iter = 0;
+        counter_entry *e;
+        while ((e = counter_next(&shards[k].ids, &iter)) != NULL) {
+            e->count = shards[k].freq[e->count];
+        }
+        if (analyzer_stream_merge(s, &shards[k].ids) != 0) {
+            rc = -1;
+        }
+    }
+    for (int k = 0; k < n_threads; k++) {
+        counter_free(&shards[k].ids);
+        free(shards[k].freq);
+        free(shards[k].folded);
+        for (int i = 0; i < PARALLEL_CHUNKS_AHEAD; i++) {
+            free(shards[k].ring[i].ids);
+            free(shards[k].ring[i].fresh);
+            free(shards[k].ring[i].fresh_lens);
+        }
+    }
+    free(w->vocab_ids);
+    free(w);
+    pipe_free(&pipe);
+    return rc;
+}
\ No newline at end of file
@@ -0,0 +1,19 @@
+#ifndef PARALLEL_H
+#define PARALLEL_H
+
+/* The head of "parallel", multi-threaded tokenizing of one large in-memory text*/
+
+#include "analyzer.h" /*stream API*/
+
+#define PARALLEL_MIN_SHARD (1 << 20) /*inputs are not split into shards smaller than this*/
+#define PARALLEL_MAX_THREADS 64
+#define PARALLEL_CHUNK_TOKENS 65536 /*tokens a worker hands to the writer at once*/
+#define PARALLEL_CHUNKS_AHEAD 4 /*chunks a worker may fill before the writer takes them*/
+
+/*called after every chunk the writer stored, done counts input bytes, return nonzero to cancel*/
+typedef int (*parallel_progress_fn)(long long done, long long total, const void *ctx);
+
+int parallel_default_threads(void);/*number of online CPUs, at least 1*/
+
+int analyze_parallel(analyzer_stream *s, const char *buf, size_t len, int n_threads, parallel_progress_fn progress, const void *ctx);/*tokenize buf on n_threads workers while this thread stores their tokens, merge the counts into s, finish s afterwards*/
+#endif
\ No newline at end of file
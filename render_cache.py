@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# One row per chart the cache manages, kept next to them in the output directory
+CACHE_DB_NAME = ".render_cache.db"
+# Size bound for the managed charts, VIS_CACHE_MAX_MB overrides it
+DEFAULT_MAX_BYTES = int(os.environ.get("VIS_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+def make_key(text_id, chart, params, data_version):
+    """Hash everything a rendered chart depends on into one cache key"""
+    payload = json.dumps([text_id, chart, params, data_version], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class RenderCache:
+    """Rendered charts of one output directory, evicted least recently used first
+
+    Usage:
+        cache = RenderCache("output")
+        if not cache.fresh(path, key):
+            render(path)
+            cache.store(path, key)
+        cache.close()
+
+    Only files recorded through store() are ever evicted. Entries live in a
+    small SQLite table, so a check reads one row and a store writes one, and
+    several processes may share a directory. A hit only writes when the cache
+    is flushed: hits() and touch() carry them from batch workers to whoever
+    flushes them once.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(directory, CACHE_DB_NAME)
+        self._conn = None
+        self._hits = {}  # chart file name -> time of its last hit, not yet written
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS charts (
+                    name TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS charts_last_used ON charts (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def fresh(self, path, key):
+        """Return True if path holds the chart rendered for key, the hit is remembered until flush()"""
+        name = os.path.basename(path)
+        try:
+            entry = self._db().execute("SELECT key, size, mtime_ns FROM charts WHERE name = ?", (name,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: failed to read render cache: {e}")
+            return False
+        if entry is None or entry[0] != key:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        # A file replaced behind the cache's back is not trusted
+        if st.st_size != entry[1] or st.st_mtime_ns != entry[2]:
+            return False
+        self._hits[name] = time.time()
+        return True
+
+    def store(self, path, key):
+        """Record a freshly rendered chart, then evict old charts over the size bound"""
+        name = os.path.basename(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._hits.pop(name, None)
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO charts (name, key, size, mtime_ns, last_used) VALUES (?, ?, ?, ?, ?)",
+                             (name, key, st.st_size, st.st_mtime_ns, time.time()))
+                self._evict(conn, keep=name)
+        except sqlite3.Error as e:
+            print(f"Warning: failed to update render cache: {e}")
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM charts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for name, size in conn.execute("SELECT name, size FROM charts ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Warning: failed to evict {name}: {e}")
+                continue
+            conn.execute("DELETE FROM charts WHERE name = ?", (name,))
+            total -= size
+
+    def hits(self):
+        """(name, time) of the hits not written yet, handed over instead of flushed, see touch()"""
+        hits = list(self._hits.items())
+        self._hits.clear()
+        return hits
+
+    def touch(self, hits):
+        """Take over hits() of another RenderCache of the same directory"""
+        for name, used in hits:
+            self._hits[name] = max(used, self._hits.get(name, 0))
+
+    def flush(self):
+        """Write the remembered hits as the charts' last use, one transaction for all of them"""
+        if not self._hits:
+            return
+        try:
+            conn = self._db()
+            with conn:
+                conn.executemany("UPDATE charts SET last_used = ? WHERE name = ?",
+                                 [(used, name) for name, used in self._hits.items()])
+            self._hits.clear()
+        except sqlite3.Error as e:
+            print(f"Warning: failed to update render cache: {e}")
+
+    def close(self):
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,306 @@
+#include "sketch.h"
+#include <math.h>   /*HyperLogLog estimate*/
+#include <stdio.h>  /*error messages*/
+#include <stdlib.h> /*dynamic allocation*/
+#include <string.h> /*string*/
+
+#define SLOT_MASK (SKETCH_TOPK * 2 - 1)
+#define HLL_REGISTERS (1 << SKETCH_HLL_BITS)
+
+unsigned long long sketch_hash(const char *token, size_t len)
+{
+    unsigned long long h = 14695981039346656037ULL;
+    for (size_t i = 0; i < len; i++) {
+        h ^= (unsigned char)token[i];
+        h *= 1099511628211ULL;
+    }
+    /*FNV alone leaves the high bits HyperLogLog looks at poorly mixed*/
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+    h *= 0xc4ceb9fe1a85ec53ULL;
+    h ^= h >> 33;
+    return h;
+}
+
+int sketch_init(token_sketch *s)
+{
+    memset(s->entries, 0, sizeof(s->entries));
+    memset(s->slots, -1, sizeof(s->slots));
+    s->used = 0;
+    s->total = 0;
+    s->cms = calloc((size_t)SKETCH_CMS_WIDTH * SKETCH_CMS_DEPTH, sizeof(unsigned long long));
+    s->hll = calloc(HLL_REGISTERS, 1);
+    if (s->cms == NULL || s->hll == NULL) {
+        fprintf(stderr, "Failed to allocate token sketches\n");
+        sketch_free(s);
+        return -1;
+    }
+    return 0;
+}
+
+static void heap_swap(token_sketch *s, int a, int b)
+{
+    int ea = s->heap[a], eb = s->heap[b];
+    s->heap[a] = eb;
+    s->heap[b] = ea;
+    s->entries[eb].heap_pos = a;
+    s->entries[ea].heap_pos = b;
+}
+
+static void heap_down(token_sketch *s, int pos)
+{
+    for (;;) {
+        int smallest = pos;
+        int left = pos * 2 + 1, right = left + 1;
+        if (left < s->used && s->entries[s->heap[left]].count < s->entries[s->heap[smallest]].count) smallest = left;
+        if (right < s->used && s->entries[s->heap[right]].count < s->entries[s->heap[smallest]].count) smallest = right;
+        if (smallest == pos) {
+            return;
+        }
+        heap_swap(s, pos, smallest);
+        pos = smallest;
+    }
+}/*restore the heap after the count at pos grew*/
+
+static void heap_up(token_sketch *s, int pos)
+{
+    while (pos > 0) {
+        int parent = (pos - 1) / 2;
+        if (s->entries[s->heap[parent]].count <= s->entries[s->heap[pos]].count) {
+            return;
+        }
+        heap_swap(s, pos, parent);
+        pos = parent;
+    }
+}
+
+static size_t slot_find(const token_sketch *s, const char *token, size_t len, unsigned long long hash)
+{
+    size_t i = hash & SLOT_MASK;
+    while (s->slots[i] >= 0) {
+        const topk_entry *e = &s->entries[s->slots[i]];
+        if (e->hash == hash && e->len == len && memcmp(e->token, token, len) == 0) {
+            return i;
+        }
+        i = (i + 1) & SLOT_MASK;
+    }
+    return i; /*the free slot ending the probe*/
+}/*slot holding the token, or the free slot where it belongs*/
+
+static void slot_remove(token_sketch *s, size_t i)
+{
+    /*backward shift deletion: pull later entries of the probe run into the hole*/
+    for (;;) {
+        s->slots[i] = -1;
+        size_t j = i;
+        for (;;) {
+            j = (j + 1) & SLOT_MASK;
+            if (s->slots[j] < 0) {
+                return;
+            }
+            size_t home = s->entries[s->slots[j]].hash & SLOT_MASK;
+            int stays = i <= j ? (i < home && home <= j) : (i < home || home <= j);
+            if (!stays) {
+                break;
+            }
+        }
+        s->slots[i] = s->slots[j];
+        i = j;
+    }
+}
+
+static int entry_set_token(topk_entry *e, const char *token, size_t len, unsigned long long hash)
+{
+    if (len + 1 > e->cap) {
+        char *grown = realloc(e->token, len + 1);
+        if (grown == NULL) {
+            return -1;
+        }
+        e->token = grown;
+        e->cap = len + 1;
+    }
+    memcpy(e->token, token, len);
+    e->token[len] = '\0';
+    e->len = len;
+    e->hash = hash;
+    return 0;
+}/*reuse the entry's buffer, evictions do not allocate once it is large enough*/
+
+static void topk_add(token_sketch *s, const char *token, size_t len, unsigned long long hash)
+{
+    size_t slot = slot_find(s, token, len, hash);
+    if (s->slots[slot] >= 0) {
+        topk_entry *e = &s->entries[s->slots[slot]];
+        e->count++;
+        heap_down(s, e->heap_pos);
+        return;
+    }
+
+    if (s->used < SKETCH_TOPK) {
+        int index = s->used;
+        topk_entry *e = &s->entries[index];
+        if (entry_set_token(e, token, len, hash) != 0) {
+            return; /*out of memory, the token only goes uncounted in the top list*/
+        }
+        e->count = 1;
+        e->error = 0;
+        e->heap_pos = s->used;
+        s->heap[s->used++] = index;
+        s->slots[slot] = index;
+        heap_up(s, e->heap_pos);
+        return;
+    }
+
+    /*Space-Saving: the new token takes over the smallest counter and its count*/
+    int index = s->heap[0];
+    topk_entry *e = &s->entries[index];
+    slot_remove(s, slot_find(s, e->token, e->len, e->hash));
+    if (entry_set_token(e, token, len, hash) != 0) {
+        s->slots[slot_find(s, e->token, e->len, e->hash)] = index; /*keep the old token*/
+        return;
+    }
+    s->slots[slot_find(s, token, len, hash)] = index;
+    e->error = e->count;
+    e->count++;
+    heap_down(s, 0);
+}
+
+static unsigned int cms_column(unsigned long long hash, int row)
+{
+    unsigned int h1 = (unsigned int)hash;
+    unsigned int h2 = (unsigned int)(hash >> 32) | 1u;
+    return (h1 + (unsigned int)row * h2) & (SKETCH_CMS_WIDTH - 1);
+}/*double hashing, row i looks at h1 + i * h2*/
+
+void sketch_add(token_sketch *s, const char *token, size_t len)
+{
+    unsigned long long hash = sketch_hash(token, len);
+
+    for (int row = 0; row < SKETCH_CMS_DEPTH; row++) {
+        s->cms[(size_t)row * SKETCH_CMS_WIDTH + cms_column(hash, row)]++;
+    }
+
+    /*the top bits pick the register, the position of the first 1 bit after them is the rank*/
+    unsigned int reg = (unsigned int)(hash >> (64 - SKETCH_HLL_BITS));
+    unsigned long long rest = hash << SKETCH_HLL_BITS;
+    unsigned char rank = 1;
+    while (rank <= 64 - SKETCH_HLL_BITS && !(rest & (1ULL << 63))) {
+        rank++;
+        rest <<= 1;
+    }
+    if (rank > s->hll[reg]) {
+        s->hll[reg] = rank;
+    }
+
+    topk_add(s, token, len, hash);
+    s->total++;
+}
+
+long long sketch_estimate(const token_sketch *s, const char *token, size_t len)
+{
+    unsigned long long hash = sketch_hash(token, len);
+    unsigned long long best = 0;
+    for (int row = 0; row < SKETCH_CMS_DEPTH; row++) {
+        unsigned long long n = s->cms[(size_t)row * SKETCH_CMS_WIDTH + cms_column(hash, row)];
+        if (row == 0 || n < best) {
+            best = n;
+        }
+    }
+    return (long long)best;
+}
+
+long long sketch_distinct(const token_sketch *s)
+{
+    double m = HLL_REGISTERS;
+    double sum = 0;
+    int zeros = 0;
+    for (int i = 0; i < HLL_REGISTERS; i++) {
+        sum += ldexp(1.0, -s->hll[i]);
+        zeros += s->hll[i] == 0;
+    }
+    double estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum;
+    if (estimate <= 2.5 * m && zeros > 0) {
+        estimate = m * log(m / zeros); /*linear counting is more accurate for small sets*/
+    }
+    return (long long)(estimate + 0.5);
+}
+
+static size_t put_u64(unsigned char *buf, size_t cap, size_t at, unsigned long long v)
+{
+    for (int i = 0; i < 8; i++) {
+        if (at + i < cap) buf[at + i] = (unsigned char)(v >> (8 * i));
+    }
+    return at + 8;
+}
+
+static size_t put_u32(unsigned char *buf, size_t cap, size_t at, unsigned int v)
+{
+    for (int i = 0; i < 4; i++) {
+        if (at + i < cap) buf[at + i] = (unsigned char)(v >> (8 * i));
+    }
+    return at + 4;
+}
+
+static int by_count_desc(const void *a, const void *b)
+{
+    const topk_entry *ea = *(const topk_entry *const *)a;
+    const topk_entry *eb = *(const topk_entry *const *)b;
+    return ea->count < eb->count ? 1 : ea->count > eb->count ? -1 : 0;
+}
+
+size_t sketch_serialize_topk(const token_sketch *s, unsigned char *buf, size_t cap)
+{
+    const topk_entry *order[SKETCH_TOPK];
+    for (int i = 0; i < s->used; i++) {
+        order[i] = &s->entries[i];
+    }
+    qsort(order, (size_t)s->used, sizeof(order[0]), by_count_desc);
+
+    size_t at = put_u32(buf, cap, 0, (unsigned int)s->used);
+    for (int i = 0; i < s->used; i++) {
+        at = put_u64(buf, cap, at, (unsigned long long)order[i]->count);
+        at = put_u64(buf, cap, at, (unsigned long long)order[i]->error);
+        at = put_u32(buf, cap, at, (unsigned int)order[i]->len);
+        if (at + order[i]->len <= cap) {
+            memcpy(buf + at, order[i]->token, order[i]->len);
+        }
+        at += order[i]->len;
+    }
+    return at;
+}
+
+size_t sketch_serialize_cms(const token_sketch *s, unsigned char *buf, size_t cap)
+{
+    size_t at = put_u32(buf, cap, 0, SKETCH_CMS_WIDTH);
+    at = put_u32(buf, cap, at, SKETCH_CMS_DEPTH);
+    for (size_t i = 0; i < (size_t)SKETCH_CMS_WIDTH * SKETCH_CMS_DEPTH; i++) {
+        at = put_u64(buf, cap, at, s->cms[i]);
+    }
+    return at;
+}
+
+size_t sketch_serialize_hll(const token_sketch *s, unsigned char *buf, size_t cap)
+{
+    if (cap > 0) {
+        buf[0] = SKETCH_HLL_BITS;
+    }
+    if (cap >= 1 + HLL_REGISTERS) {
+        memcpy(buf + 1, s->hll, HLL_REGISTERS);
+    }
+    return 1 + HLL_REGISTERS;
+}
+
+void sketch_free(token_sketch *s)
+{
+    for (int i = 0; i < SKETCH_TOPK; i++) {
+        free(s->entries[i].token);
+        s->entries[i].token = NULL;
+        s->entries[i].cap = 0;
+    }
+    free(s->cms);
+    s->cms = NULL;
+    free(s->hll);
+    s->hll = NULL;
+    s->used = 0;
+}
\ No newline at end of file
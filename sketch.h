@@ -0,0 +1,53 @@
+#ifndef SKETCH_H
+#define SKETCH_H
+
+/* The head of "sketch", fixed size summaries of one token stream: Space-Saving
+   for the top tokens, Count-Min for the count of any token and HyperLogLog for
+   the number of distinct tokens. sketch.py reads the serialized form*/
+
+#include <stddef.h>
+
+#define SKETCH_TOPK 1024        /*tokens tracked by Space-Saving, the charts show at most 200*/
+#define SKETCH_CMS_WIDTH 4096   /*Count-Min counters per row, a power of two*/
+#define SKETCH_CMS_DEPTH 4      /*Count-Min rows, the estimate is the smallest of them*/
+#define SKETCH_HLL_BITS 14      /*2^14 HyperLogLog registers, about 0.8% standard error*/
+#define SKETCH_FORMAT 1         /*bump when a serialized layout changes*/
+
+typedef struct {
+    char *token;            /*owned, NUL terminated*/
+    size_t len;
+    size_t cap;
+    unsigned long long hash;
+    long long count;        /*never below the true count*/
+    long long error;        /*count inherited from the evicted token, count - error never exceeds the true count*/
+    int heap_pos;
+} topk_entry;
+
+typedef struct {
+    topk_entry entries[SKETCH_TOPK];
+    int heap[SKETCH_TOPK];          /*entry indices, a min-heap on count*/
+    int slots[SKETCH_TOPK * 2];     /*linear probing index of the entries, -1 marks a free slot*/
+    int used;                       /*entries in use*/
+    unsigned long long *cms;        /*SKETCH_CMS_DEPTH rows of SKETCH_CMS_WIDTH counters*/
+    unsigned char *hll;             /*1 << SKETCH_HLL_BITS registers*/
+    long long total;                /*tokens added*/
+} token_sketch;
+
+unsigned long long sketch_hash(const char *token, size_t len);/*64-bit hash shared by every sketch, FNV-1a then the MurmurHash3 finalizer*/
+
+int sketch_init(token_sketch *s);/*allocate empty sketches*/
+
+void sketch_add(token_sketch *s, const char *token, size_t len);/*count one occurrence of a token*/
+
+long long sketch_estimate(const token_sketch *s, const char *token, size_t len);/*Count-Min estimate, never below the true count*/
+
+long long sketch_distinct(const token_sketch *s);/*HyperLogLog estimate of the distinct tokens*/
+
+size_t sketch_serialize_topk(const token_sketch *s, unsigned char *buf, size_t cap);/*u32 n, then n x (u64 count, u64 error, u32 len, bytes), highest count first, little endian; returns the size it needs*/
+
+size_t sketch_serialize_cms(const token_sketch *s, unsigned char *buf, size_t cap);/*u32 width, u32 depth, then depth rows of u64 counters*/
+
+size_t sketch_serialize_hll(const token_sketch *s, unsigned char *buf, size_t cap);/*u8 bits, then the registers*/
+
+void sketch_free(token_sketch *s);/*release the token copies and counters*/
+#endif
\ No newline at end of file
@@ -0,0 +1,83 @@
+import struct
+from collections import namedtuple
+
+# The Python half of sketch.c: reads the blobs the analyzer stores in the
+# sketches table for texts analyzed with --sketch. Layouts, all little endian:
+#   topk  u32 n, then n x (u64 count, u64 error, u32 len, token bytes), highest count first
+#   cms   u32 width, u32 depth, then depth rows of width u64 counters
+#   hll   u8 bits, then 2^bits registers
+# Keep sketch_hash in step with sketch_hash() in sketch.c, the Count-Min
+# columns of a token are only found again with the very same hash.
+
+SKETCH_FORMAT = 1
+
+_MASK64 = (1 << 64) - 1
+
+# (token, count, error), count - error <= true count <= count
+TopEntry = namedtuple("TopEntry", ["token", "count", "error"])
+
+def sketch_hash(data):
+    """64-bit FNV-1a of the bytes, then the MurmurHash3 finalizer"""
+    h = 14695981039346656037
+    for byte in data:
+        h = ((h ^ byte) * 1099511628211) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _MASK64
+    h ^= h >> 33
+    return h
+
+class TokenSketch:
+    """Approximate token statistics of one text"""
+
+    def __init__(self, text_id, tokens, distinct, topk, cms):
+        self.text_id = text_id
+        self.tokens = tokens          # exact number of tokens
+        self.distinct = distinct      # HyperLogLog estimate, about 1% off
+        self.entries = self._decode_topk(topk)
+        self._cms = cms
+        self._width, self._depth = struct.unpack_from("<II", cms, 0)
+
+    @classmethod
+    def from_row(cls, text_id, row):
+        """Build from a (format, tokens, distinct_estimate, topk, cms) row, None for an unknown format"""
+        format_version, tokens, distinct, topk, cms = row
+        if format_version != SKETCH_FORMAT:
+            return None
+        return cls(text_id, tokens, distinct, bytes(topk), bytes(cms))
+
+    @staticmethod
+    def _decode_topk(blob):
+        (n,) = struct.unpack_from("<I", blob, 0)
+        offset = 4
+        entries = []
+        for _ in range(n):
+            count, error, length = struct.unpack_from("<QQI", blob, offset)
+            offset += 20
+            token = blob[offset:offset + length].decode("utf-8", errors="replace")
+            offset += length
+            entries.append(TopEntry(token, count, error))
+        return entries
+
+    def estimate(self, token):
+        """Count-Min estimate of a token's count, never below the true count"""
+        h = sketch_hash(token.encode("utf-8") if isinstance(token, str) else token)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        best = None
+        for row in range(self._depth):
+            column = (h1 + row * h2) & 0xFFFFFFFF & (self._width - 1)
+            (n,) = struct.unpack_from("<Q", self._cms, 8 + 8 * (row * self._width + column))
+            best = n if best is None else min(best, n)
+        return best or 0
+
+    def top(self, limit):
+        """(token, count) for the most frequent tokens
+
+        Both Space-Saving and Count-Min only overestimate, so the smaller of the
+        two is the tighter count.
+        """
+        rows = [(e.token, min(e.count, self.estimate(e.token))) for e in self.entries]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows[:limit]
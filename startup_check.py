@@ -0,0 +1,60 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules vis.py must not load at import time, only the charts that draw need them
+HEAVY_MODULES = ("matplotlib", "numpy", "wordcloud", "PIL")
+
+# Runs in a fresh interpreter, prints the import time in ms and the heavy modules it loaded
+_CHILD = """
+import sys, time
+start = time.perf_counter()
+import vis
+elapsed = (time.perf_counter() - start) * 1000
+heavy = sorted(name for name in sys.modules if name.split(".")[0] in {heavy!r})
+print(elapsed, ",".join(heavy))
+"""
+
+def measure(runs):
+    """Import vis in `runs` fresh interpreters, return (median ms, heavy modules seen)"""
+    times = []
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD.format(heavy=set(HEAVY_MODULES))],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.split()
+        times.append(float(output[0]))
+        if len(output) > 1:
+            heavy.update(output[1].split(","))
+    return statistics.median(times), sorted(heavy)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing vis.py stays within its startup budget")
+    parser.add_argument("--budget-ms", type=float, default=150, help="allowed median import time (default 150)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure (default 5)")
+    args = parser.parse_args()
+
+    try:
+        median_ms, heavy = measure(max(1, args.runs))
+    except subprocess.CalledProcessError as e:
+        print(f"Error: importing vis failed:\n{e.stderr}")
+        sys.exit(1)
+
+    print(f"import vis: {median_ms:.1f} ms median over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    ok = True
+    if heavy:
+        print(f"Loaded at import time: {', '.join(heavy)}")
+        ok = False
+    if median_ms > args.budget_ms:
+        print("Over budget")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import contextlib
+import ctypes
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+
+# Result of one analysis, mirrors ingest_result in ingest.h
+AnalysisResult = namedtuple("AnalysisResult", ["text_id", "tokens", "distinct_tokens", "bytes"])
+
+class AnalyzerError(Exception):
+    """Raised when the C analyzer reports a failure"""
+
+class AnalysisCancelled(AnalyzerError):
+    """Raised when a progress callback asked to stop, the text is rolled back"""
+
+# int progress(long long done, long long total), nonzero cancels
+_PROGRESS_FN = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+
+class _IngestResult(ctypes.Structure):
+    _fields_ = [
+        ("text_id", ctypes.c_int),
+        ("tokens", ctypes.c_longlong),
+        ("distinct", ctypes.c_longlong),
+        ("bytes", ctypes.c_longlong),
+    ]
+
+def _library_path():
+    """Locate the shared analyzer library, TEXT_ANALYZER_LIB overrides the default"""
+    override = os.environ.get("TEXT_ANALYZER_LIB")
+    if override:
+        return override
+    if sys.platform == "win32":
+        name = "text_analyzer.dll"
+    elif sys.platform == "darwin":
+        name = "libtext_analyzer.dylib"
+    else:
+        name = "libtext_analyzer.so"
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+_lib = None
+_lib_lock = threading.Lock()  # the C side keeps one connection, so calls are serialized
+_open_analyzer = None  # the one Analyzer the library serves, see ta_open in ingest.h
+# ta_open's result while another database is open
+_ALREADY_OPEN = -2
+
+def _load():
+    global _lib
+    if _lib is None:
+        lib = ctypes.CDLL(_library_path())
+        lib.ta_open.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
+        lib.ta_open.restype = ctypes.c_int
+        lib.ta_set_options.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+        lib.ta_set_options.restype = ctypes.c_int
+        lib.ta_set_sketch.argtypes = [ctypes.c_int]
+        lib.ta_set_sketch.restype = None
+        lib.ta_set_progress.argtypes = [_PROGRESS_FN]
+        lib.ta_set_progress.restype = None
+        lib.ta_analyze_text.argtypes = [ctypes.c_char_p, ctypes.c_longlong, ctypes.POINTER(_IngestResult)]
+        lib.ta_analyze_text.restype = ctypes.c_int
+        lib.ta_analyze_file.argtypes = [ctypes.c_char_p, ctypes.POINTER(_IngestResult)]
+        lib.ta_analyze_file.restype = ctypes.c_int
+        lib.ta_append_file.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(_IngestResult)]
+        lib.ta_append_file.restype = ctypes.c_int
+        for name in ("ta_begin", "ta_commit", "ta_rollback"):
+            getattr(lib, name).argtypes = []
+            getattr(lib, name).restype = ctypes.c_int
+        lib.ta_set_metrics.argtypes = [ctypes.c_int]
+        lib.ta_set_metrics.restype = None
+        lib.ta_reset_metrics.argtypes = []
+        lib.ta_reset_metrics.restype = None
+        lib.ta_metrics_json.argtypes = [ctypes.c_char_p, ctypes.c_longlong]
+        lib.ta_metrics_json.restype = ctypes.c_longlong
+        lib.ta_close.argtypes = []
+        lib.ta_close.restype = None
+        _lib = lib
+    return _lib
+
+def _metrics_report(lib):
+    """The C side's metrics report as a dict, see metrics.h"""
+    size = lib.ta_metrics_json(None, 0) + 64  # the clocks keep moving between the two calls
+    buf = ctypes.create_string_buffer(size)
+    lib.ta_metrics_json(buf, size)
+    return json.loads(buf.value.decode("utf-8"))
+
+def is_available():
+    """Return True if the shared library can be loaded"""
+    try:
+        _load()
+        return True
+    except OSError:
+        return False
+
+class Analyzer:
+    """In-process analyzer that keeps one database connection open
+
+    Usage:
+        with Analyzer("analysis.db") as analyzer:
+            result = analyzer.analyze("some text")
+            result = analyzer.analyze(path="big.log")
+
+    With metrics=True every analyze() also leaves its stage timings and
+    statement counts in last_metrics, in the layout of the CLI's --metrics.
+    With sketch=True texts are summarized like the CLI's --sketch, in fixed
+    memory, and distinct_tokens is an estimate.
+
+    The library holds one connection and one set of options per process, so
+    only one Analyzer can be open at a time; close it before opening another.
+    The module's analyze() makes room for it by closing its own.
+    """
+
+    def __init__(self, db_path="analysis.db", delimiters=None, fold_case=False, threads=1,
+                 journal_mode="WAL", synchronous="NORMAL", metrics=False, sketch=False):
+        global _open_analyzer
+        lib = _load()
+        self.db_path = os.path.abspath(db_path)
+        self.metrics = metrics
+        self.last_metrics = None
+        if _open_analyzer is not None and _open_analyzer is _default_analyzer:
+            _default_analyzer.close()
+        with _lib_lock:
+            if _open_analyzer is not None:
+                raise AnalyzerError(f"An Analyzer is already open on {_open_analyzer.db_path}, "
+                                    "close it first, the library serves one at a time")
+            rc = lib.ta_open(os.fsencode(self.db_path), journal_mode.encode(), synchronous.encode())
+            if rc == _ALREADY_OPEN:
+                raise AnalyzerError("The analyzer library already has a database open")
+            if rc != 0:
+                raise AnalyzerError(f"Failed to open database {self.db_path}")
+            _open_analyzer = self
+            lib.ta_set_options(delimiters.encode() if delimiters is not None else None,
+                               1 if fold_case else 0, threads)
+            lib.ta_set_sketch(1 if sketch else 0)
+            lib.ta_set_metrics(1 if metrics else 0)
+
+    def enable_metrics(self, on=True):
+        """Turn metrics collection on or off for the following analyses"""
+        with _lib_lock:
+            self._check_open()
+            _load().ta_set_metrics(1 if on else 0)
+            self.metrics = on
+            if not on:
+                self.last_metrics = None
+
+    def analyze(self, text=None, path=None, progress=None):
+        """Analyze a string or a file and return an AnalysisResult
+
+        progress(done_bytes, total_bytes) is called every few MB, total_bytes is
+        -1 for inputs of unknown size. Returning True cancels the analysis.
+        """
+        if (text is None) == (path is None):
+            raise ValueError("Pass exactly one of text or path")
+        if path is not None:
+            return self._run(lambda lib, out: lib.ta_analyze_file(os.fsencode(path), out), progress)
+        data = text.encode("utf-8") if isinstance(text, str) else bytes(text)
+        return self._run(lambda lib, out: lib.ta_analyze_text(data, len(data), out), progress)
+
+    def append(self, text_id, path, progress=None):
+        """Analyze what a file gained since text_id last read it and add it to that text
+
+        Reads from the stored size to the end. A token the last read cut off is
+        taken back and counted again whole, so tokens counts only what the text
+        gained and bytes is 0 when the file has not grown.
+        """
+        return self._run(lambda lib, out: lib.ta_append_file(text_id, os.fsencode(path), out), progress)
+
+    def _run(self, call, progress):
+        lib = _load()
+        out = _IngestResult()
+        cancelled = []
+        
+        def report(done, total):
+            if progress(done, total):
+                cancelled.append(True)
+                return 1
+            return 0
+        
+        # Keep the ctypes callback referenced until the C side is done with it
+        callback = _PROGRESS_FN(report) if progress is not None else _PROGRESS_FN()
+        with _lib_lock:
+            self._check_open()
+            lib.ta_set_progress(callback)
+            if self.metrics:
+                lib.ta_reset_metrics()
+            try:
+                rc = call(lib, ctypes.byref(out))
+            finally:
+                lib.ta_set_progress(_PROGRESS_FN())
+                if self.metrics:
+                    self.last_metrics = _metrics_report(lib)
+        if cancelled:
+            raise AnalysisCancelled("Analysis cancelled")
+        if rc != 0:
+            raise AnalyzerError("Analysis failed, see stderr for details")
+        return AnalysisResult(out.text_id, out.tokens, out.distinct, out.bytes)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group several analyses into one transaction, a failed text only undoes itself"""
+        lib = _load()
+        with _lib_lock:
+            self._check_open()
+            if lib.ta_begin() != 0:
+                raise AnalyzerError("Failed to begin transaction")
+        try:
+            yield self
+        except BaseException:
+            with _lib_lock:
+                lib.ta_rollback()
+            raise
+        with _lib_lock:
+            if lib.ta_commit() != 0:
+                lib.ta_rollback()
+                raise AnalyzerError("Failed to commit transaction")
+
+    def _check_open(self):
+        if _open_analyzer is not self:
+            raise AnalyzerError("Analyzer has been closed")
+
+    def close(self):
+        """Close the connection, a no-op when already closed"""
+        global _open_analyzer
+        with _lib_lock:
+            if _open_analyzer is self:
+                _load().ta_close()
+                _open_analyzer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+_default_analyzer = None
+
+def analyze(text=None, path=None, db_path="analysis.db"):
+    """Analyze with a process-wide analyzer that stays open between calls
+
+    Fails while an Analyzer of the caller's is open, use that one instead.
+    """
+    global _default_analyzer
+    if _default_analyzer is None or _default_analyzer is not _open_analyzer \
+            or _default_analyzer.db_path != os.path.abspath(db_path):
+        if _default_analyzer is not None:
+            _default_analyzer.close()
+        _default_analyzer = None
+        _default_analyzer = Analyzer(db_path)
+    return _default_analyzer.analyze(text=text, path=path)
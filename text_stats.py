@@ -0,0 +1,212 @@
+import argparse
+import math
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+import db_access
+import db_queries
+
+# Distribution statistics of a text, computed with NumPy from the two
+# aggregates the analyzer keeps: the token length histogram (token_len_hist)
+# and the frequency spectrum, how many distinct tokens occur n times, which
+# SQLite groups from token_freq. Both are small whatever the size of the
+# text, so nothing here touches the token rows and the cost does not grow
+# with the token count. Results go to the stats columns added in schema
+# version 8; appending to a text clears them until this runs again.
+
+# Length percentiles stored in stats
+PERCENTILES = (50, 90, 99)
+# Log-spaced ranks the Zipf line is fitted through, so every decade of
+# ranks counts the same and the long tail of rare tokens does not swamp it
+ZIPF_POINTS = 200
+
+# Frequency based fields are None for texts analyzed with --sketch, which keep no token_freq rows
+TextStats = namedtuple("TextStats", [
+    "text_id", "tokens", "distinct_tokens", "mean_len", "min_len", "max_len",
+    "median_len", "p90_len", "p99_len", "len_stddev",
+    "entropy", "type_token_ratio", "hapax_ratio", "zipf_exponent", "zipf_r2",
+])
+
+class TextDistributions:
+    """Length histogram and frequency spectrum of one text as NumPy arrays"""
+
+    def __init__(self, text_id, lengths, length_counts, frequencies, frequency_counts):
+        self.text_id = text_id
+        # token lengths, shortest first, and how many tokens have each
+        self.lengths = lengths
+        self.length_counts = length_counts
+        # token frequencies, highest first, and how many distinct tokens have each
+        self.frequencies = frequencies
+        self.frequency_counts = frequency_counts
+        self.tokens = int(length_counts.sum())
+        self.distinct = int(frequency_counts.sum())
+
+    @classmethod
+    def load(cls, conn, text_id):
+        lengths = pairs(conn, db_queries.TOKEN_LENGTHS, text_id)
+        spectrum = pairs(conn, db_queries.FREQUENCY_SPECTRUM, text_id)
+        return cls(text_id, lengths[:, 0], lengths[:, 1], spectrum[:, 0], spectrum[:, 1])
+
+    def length_percentiles(self, percentiles=PERCENTILES):
+        """Token length at each percentile, nearest rank, None for an empty text"""
+        if self.tokens == 0:
+            return [None] * len(percentiles)
+        ranks = np.maximum(np.ceil(np.asarray(percentiles) / 100 * self.tokens), 1)
+        positions = np.searchsorted(np.cumsum(self.length_counts), ranks)
+        return self.lengths[positions].tolist()
+
+    def length_moments(self):
+        """(mean, standard deviation) of the token lengths"""
+        if self.tokens == 0:
+            return None, None
+        mean = np.dot(self.lengths, self.length_counts) / self.tokens
+        variance = np.dot(self.length_counts, (self.lengths - mean) ** 2) / self.tokens
+        return float(mean), float(math.sqrt(variance))
+
+    def length_histogram(self, bins=None):
+        """(counts, edges) of the token lengths
+
+        bins is None for one bin per length, a number of equal width bins, or
+        the bin edges as a sequence, as in np.histogram.
+        """
+        if self.tokens == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(1)
+        # edges halfway between lengths, so each length sits in the middle of its bin
+        low, high = self.lengths[0] - 0.5, self.lengths[-1] + 0.5
+        if bins is None:
+            bins = np.arange(low, high + 1)
+        elif np.ndim(bins) == 0:
+            bins = np.linspace(low, high, int(bins) + 1)
+        counts, edges = np.histogram(self.lengths, bins=bins, weights=self.length_counts)
+        return counts.astype(np.int64), edges
+
+    def entropy(self):
+        """Shannon entropy of the token distribution in bits"""
+        total = np.dot(self.frequencies, self.frequency_counts)
+        if total == 0:
+            return None
+        p = self.frequencies / total
+        return float(-np.dot(self.frequency_counts, p * np.log2(p)))
+
+    def rank_frequency(self, points=ZIPF_POINTS):
+        """(ranks, frequencies) at up to `points` log-spaced ranks, rank 1 is the most frequent token"""
+        if self.distinct == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        ranks = np.unique(np.geomspace(1, self.distinct, points).round().astype(np.int64))
+        # the tokens of spectrum row i hold ranks up to cumsum(frequency_counts)[i]
+        rows = np.searchsorted(np.cumsum(self.frequency_counts), ranks)
+        return ranks, self.frequencies[rows]
+
+    def zipf_fit(self, points=ZIPF_POINTS):
+        """(exponent, r2) of frequency ~ rank ** -exponent, fitted on log-log axes"""
+        ranks, frequencies = self.rank_frequency(points)
+        if len(ranks) < 3:
+            return None, None
+        x, y = np.log(ranks), np.log(frequencies)
+        slope, intercept = np.polyfit(x, y, 1)
+        residual = np.sum((y - (slope * x + intercept)) ** 2)
+        spread = np.sum((y - y.mean()) ** 2)
+        return float(-slope) + 0.0, float(1 - residual / spread) if spread > 0 else 1.0
+
+    def zipf_line(self, ranks, points=ZIPF_POINTS):
+        """Frequencies the Zipf fit predicts at the given ranks"""
+        ranks_fit, frequencies = self.rank_frequency(points)
+        slope, intercept = np.polyfit(np.log(ranks_fit), np.log(frequencies), 1)
+        return np.exp(intercept) * np.asarray(ranks, dtype=float) ** slope
+
+    def summary(self):
+        median, p90, p99 = self.length_percentiles()
+        mean, stddev = self.length_moments()
+        exact = self.distinct > 0
+        exponent, r2 = self.zipf_fit() if exact else (None, None)
+        return TextStats(
+            text_id=self.text_id,
+            tokens=self.tokens,
+            distinct_tokens=self.distinct if exact else None,
+            mean_len=mean,
+            min_len=int(self.lengths[0]) if self.tokens else None,
+            max_len=int(self.lengths[-1]) if self.tokens else None,
+            median_len=median,
+            p90_len=p90,
+            p99_len=p99,
+            len_stddev=stddev,
+            entropy=self.entropy() if exact else None,
+            type_token_ratio=self.distinct / self.tokens if exact and self.tokens else None,
+            hapax_ratio=hapax_count(self.frequencies, self.frequency_counts) / self.distinct if exact else None,
+            zipf_exponent=exponent,
+            zipf_r2=r2,
+        )
+
+def pairs(conn, query, text_id):
+    """An (n, 2) int64 array of a two column query"""
+    return np.array(conn.execute(query.sql, (text_id,)).fetchall(), dtype=np.int64).reshape(-1, 2)
+
+def hapax_count(frequencies, frequency_counts):
+    """Number of distinct tokens that occur once"""
+    once = frequencies == 1
+    return int(frequency_counts[once].sum())
+
+def store(conn, stats):
+    """Write the distribution statistics of a text to its stats row"""
+    conn.execute(db_queries.STORE_DISTRIBUTION_STATS.sql, (
+        stats.distinct_tokens, stats.median_len, stats.p90_len, stats.p99_len, stats.len_stddev,
+        stats.entropy, stats.type_token_ratio, stats.hapax_ratio, stats.zipf_exponent, stats.zipf_r2,
+        stats.text_id))
+
+def compute(conn, text_id):
+    """Compute and store the statistics of a text, returns (TextStats, TextDistributions)"""
+    distributions = TextDistributions.load(conn, text_id)
+    stats = distributions.summary()
+    with conn:
+        store(conn, stats)
+    return stats, distributions
+
+def format_stats(stats):
+    def number(value, digits=2):
+        return "n/a" if value is None else f"{value:.{digits}f}"
+    return "\n".join([
+        f"Text #{stats.text_id}: {stats.tokens} tokens, {stats.distinct_tokens if stats.distinct_tokens is not None else 'n/a'} distinct",
+        f"  length     mean {number(stats.mean_len)}, sd {number(stats.len_stddev)}, min {stats.min_len}, "
+        f"median {stats.median_len}, p90 {stats.p90_len}, p99 {stats.p99_len}, max {stats.max_len}",
+        f"  entropy    {number(stats.entropy, 3)} bits",
+        f"  type/token {number(stats.type_token_ratio, 4)}, hapax {number(stats.hapax_ratio, 4)} of distinct",
+        f"  zipf       exponent {number(stats.zipf_exponent, 3)}, r2 {number(stats.zipf_r2, 3)}",
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute distribution statistics of texts and store them in stats")
+    parser.add_argument("texts", help="ids and ranges such as 1-100,205, or all")
+    parser.add_argument("--db", default="analysis.db", help="database path (default analysis.db)")
+    parser.add_argument("--bins", type=int, default=None, help="also print a length histogram with N bins")
+    parser.add_argument("--quiet", action="store_true", help="only print the total")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    start = time.perf_counter()
+    done = 0
+    try:
+        text_ids = db_access.parse_id_ranges(args.texts, conn)
+        for text_id in text_ids:
+            if conn.execute(db_queries.TEXT_EXISTS.sql, (text_id,)).fetchone()[0] == 0:
+                print(f"Skipping text ID {text_id}: not found")
+                continue
+            stats, distributions = compute(conn, text_id)
+            done += 1
+            if args.quiet:
+                continue
+            print(format_stats(stats))
+            if args.bins:
+                counts, edges = distributions.length_histogram(args.bins)
+                for count, low, high in zip(counts.tolist(), edges[:-1], edges[1:]):
+                    print(f"    {low:7.1f} - {high:7.1f}  {count}")
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+    print(f"Statistics of {done} texts stored in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#include "tokenizer.h"
+#include <string.h> /*string*/
+
+static unsigned char byte_class(int c)
+{
+    if (c == ' ' || c == '\t' || c == '\r' || c == '\n' || c == '\v' || c == '\f') {
+        return TOK_CLASS_SPACE;
+    }
+    if (c < 0x20 || c == 0x7F) {
+        return TOK_CLASS_CONTROL;
+    }
+    if (c >= 0x80) {
+        return TOK_CLASS_WORD; /*lead and continuation bytes alike, so UTF-8 characters are never split*/
+    }
+    if (c == '\'' || c == '-' || c == '_') {
+        return TOK_CLASS_WORD; /*keep words like don't, e-mail and snake_case together*/
+    }
+    if ((c >= '0' && c <= '9') || (c >= 'A' && c <= 'Z') || (c >= 'a' && c <= 'z')) {
+        return TOK_CLASS_WORD;
+    }
+    return TOK_CLASS_PUNCT;
+}
+
+static void reset_fold(tokenizer_config *cfg)
+{
+    for (int c = 0; c < 256; c++) {
+        cfg->fold[c] = (unsigned char)c;
+        if (cfg->fold_case && c >= 'A' && c <= 'Z') {
+            cfg->fold[c] = (unsigned char)(c - 'A' + 'a');
+        }
+    }
+}
+
+void tokenizer_config_init(tokenizer_config *cfg, int split_classes)
+{
+    for (int c = 0; c < 256; c++) {
+        cfg->delim[c] = (byte_class(c) & split_classes) != 0;
+    }
+    cfg->delim[0] = 1;
+    cfg->fold_case = 0;
+    reset_fold(cfg);
+}
+
+void tokenizer_config_delimiters(tokenizer_config *cfg, const char *delims)
+{
+    memset(cfg->delim, 0, sizeof(cfg->delim));
+    for (const unsigned char *p = (const unsigned char *)delims; *p; p++) {
+        cfg->delim[*p] = 1;
+    }
+    cfg->delim[0] = 1;
+}
+
+void tokenizer_config_fold_case(tokenizer_config *cfg, int fold_case)
+{
+    cfg->fold_case = fold_case;
+    reset_fold(cfg);
+}
+
+int tok_next(const tokenizer_config *cfg, const char *buf, size_t len, size_t *pos, tok_span *span)
+{
+    const unsigned char *p = (const unsigned char *)buf;
+    const unsigned char *delim = cfg->delim;
+    size_t i = *pos;
+
+    /*skip delimiters*/
+    while (i < len && delim[p[i]]) {
+        i++;
+    }
+    if (i == len) {
+        *pos = i;
+        return TOK_END;
+    }
+
+    size_t start = i;
+    while (i < len && !delim[p[i]]) {
+        i++;
+    }
+    span->offset = start;
+    span->length = i - start;
+    *pos = i;
+    return i == len ? TOK_PARTIAL : TOK_WORD;
+}
+
+size_t tok_word_prefix(const tokenizer_config *cfg, const char *buf, size_t len)
+{
+    const unsigned char *p = (const unsigned char *)buf;
+    size_t i = 0;
+    while (i < len && !cfg->delim[p[i]]) {
+        i++;
+    }
+    return i;
+}
+
+void tok_normalize(const tokenizer_config *cfg, const char *src, size_t len, char *dst)
+{
+    const unsigned char *s = (const unsigned char *)src;
+    for (size_t i = 0; i < len; i++) {
+        dst[i] = (char)cfg->fold[s[i]];
+    }
+}
\ No newline at end of file
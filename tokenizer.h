@@ -0,0 +1,42 @@
+#ifndef TOKENIZER_H
+#define TOKENIZER_H
+
+/* The head of "tokenizer", a reentrant table driven splitter that never writes to its input*/
+
+#include <stddef.h>
+
+/*byte classes, a config decides which of them end a token*/
+#define TOK_CLASS_WORD    0x00 /*letters, digits, ' - _ and every byte of a UTF-8 sequence*/
+#define TOK_CLASS_SPACE   0x01 /*space, \t, \r, \n, \v, \f*/
+#define TOK_CLASS_PUNCT   0x02 /*ASCII punctuation*/
+#define TOK_CLASS_CONTROL 0x04 /*other ASCII control bytes*/
+#define TOK_SPLIT_DEFAULT (TOK_CLASS_SPACE | TOK_CLASS_PUNCT | TOK_CLASS_CONTROL)
+
+/*tok_next results*/
+#define TOK_END     0 /*no more tokens in the buffer*/
+#define TOK_WORD    1 /*a complete token*/
+#define TOK_PARTIAL 2 /*a token running into the end of the buffer, it may continue in the next chunk*/
+
+typedef struct {
+    unsigned char delim[256]; /*1 if the byte ends a token*/
+    unsigned char fold[256];  /*byte normalization map, the identity unless case folding is on*/
+    int fold_case;
+} tokenizer_config;
+
+typedef struct {
+    size_t offset; /*start of the token in the scanned buffer*/
+    size_t length; /*token length in bytes*/
+} tok_span;
+
+void tokenizer_config_init(tokenizer_config *cfg, int split_classes);/*delimit on the given byte classes, e.g. TOK_SPLIT_DEFAULT*/
+
+void tokenizer_config_delimiters(tokenizer_config *cfg, const char *delims);/*delimit on exactly these bytes, NUL always delimits*/
+
+void tokenizer_config_fold_case(tokenizer_config *cfg, int fold_case);/*lowercase ASCII letters in tok_normalize*/
+
+int tok_next(const tokenizer_config *cfg, const char *buf, size_t len, size_t *pos, tok_span *span);/*find the next token at or after *pos, returns TOK_END, TOK_WORD or TOK_PARTIAL*/
+
+size_t tok_word_prefix(const tokenizer_config *cfg, const char *buf, size_t len);/*number of leading bytes that continue a token*/
+
+void tok_normalize(const tokenizer_config *cfg, const char *src, size_t len, char *dst);/*copy a token through the fold map, src and dst may be the same*/
+#endif
\ No newline at end of file
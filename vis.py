@@ -1,30 +1,416 @@
 import sqlite3
-import matplotlib.pyplot as plt
-import numpy as np
+import atexit
+import functools
+import json
+import math
+import time
 import sys
 import os
-from wordcloud import WordCloud
-import matplotlib.font_manager as fm
+import db_access
+import db_queries
+import metrics
+import render_cache
+import sketch
 
-def generate_word_frequency_chart(text_id, output_dir="."):
-    """Generate word frequency chart"""
+# matplotlib, numpy and wordcloud are imported by the charts that need them,
+# a run served from the render cache never loads them
+
+# Tokens loaded per text, the word cloud draws at most this many words
+TOP_TOKENS = 200
+# Bump when the look of a chart changes so cached renders are redrawn
+CHART_STYLE_VERSION = 1
+
+# Interactive runs open a window per chart, batch workers render off screen
+SHOW_FIGURES = True
+# Word cloud fonts in order of preference, SimHei and YaHei cover Chinese on Windows
+CLOUD_FONT_NAMES = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS', 'DejaVu Sans']
+# Resolved font path, findfont is slow enough to matter on every run
+FONT_CACHE_PATH = os.environ.get("VIS_FONT_CACHE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "text_analyzer", "font_cache.json")
+# (db_path, connection) reused by every query of a batch worker
+_worker_db = None
+# db_access.Database of the GUI, its per-thread connections replace a connect per query, see use_database()
+_shared_database = None
+# output_dir -> RenderCache of a batch worker, its hits go back to the parent to flush once
+_worker_caches = {}
+# Stage timings of this run, set by --metrics=FILE or VIS_METRICS. Stages:
+# import (loading matplotlib and friends), query, render (building the figure
+# or laying out the word cloud) and save (rasterizing, encoding and writing the PNG)
+recorder = None
+worker_reports = []  # reports sent back by batch workers
+# Set by --approx: texts analyzed with --sketch are charted from their stored
+# sketches instead of counting their tokens row by row, see sketch.py
+APPROXIMATE = False
+
+def timed(stage):
+    """Charge a function's time to a stage of the recorder, a plain call while metrics are off"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return func(*args, **kwargs)
+            with recorder.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def use_database(database):
+    """Serve the queries of this process from a db_access.Database, its connections are read only"""
+    global _shared_database
+    _shared_database = database
+
+def open_connection(db_path):
+    """Return a long-lived connection (batch worker or shared Database), or a new one to close after use"""
+    if _worker_db is not None and _worker_db[0] == db_path:
+        return _worker_db[1]
+    if _shared_database is not None and _shared_database.path == db_path:
+        return _shared_database.connection()
+    return sqlite3.connect(db_path)
+
+def close_connection(conn):
+    if _worker_db is not None and conn is _worker_db[1]:
+        return
+    if _shared_database is not None and conn is _shared_database.connection():
+        return
+    conn.close()
+
+@timed("import")
+def pyplot():
+    """Import pyplot on first use, off screen when figures are not shown"""
+    import matplotlib
+    if not SHOW_FIGURES:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def finish_figure():
+    """Show the current chart when running interactively, then free it"""
+    plt = pyplot()
+    if SHOW_FIGURES:
+        plt.show()
+    plt.close()
+
+def find_cloud_font():
+    """Return a font file for the word cloud, or None, the result is cached on disk"""
+    try:
+        with open(FONT_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached_font = json.load(f)
+        if cached_font.get("names") == CLOUD_FONT_NAMES and os.path.exists(cached_font.get("path") or ""):
+            return cached_font["path"]
+    except (OSError, ValueError, AttributeError):
+        pass
+    
+    import matplotlib.font_manager as fm
+    font_path = None
+    for font_name in CLOUD_FONT_NAMES:
+        try:
+            font_path = fm.findfont(fm.FontProperties(family=font_name))
+            if font_path and os.path.exists(font_path):
+                break
+        except Exception:
+            continue
+    if not (font_path and os.path.exists(font_path)):
+        return None
+    
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{FONT_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"names": CLOUD_FONT_NAMES, "path": font_path}, f)
+        os.replace(tmp_path, FONT_CACHE_PATH)
+    except OSError:
+        pass  # the lookup simply runs again next time
+    return font_path
+
+class TextAggregates:
+    """Per-text token aggregates shared by every chart"""
+
+    def __init__(self, text_id, frequencies, length_distribution, approximate=False):
+        self.text_id = text_id
+        # (token, frequency) pairs, most frequent first, at most TOP_TOKENS of them
+        self.frequencies = frequencies
+        # (token_length, count) pairs, shortest first
+        self.length_distribution = length_distribution
+        # frequencies are sketch estimates, the length distribution is always exact
+        self.approximate = approximate
+
+    @classmethod
+    @timed("query")
+    def load(cls, text_id, db_path='analysis.db', limit=TOP_TOKENS):
+        """Load the aggregates the analyzer precomputed at ingest time"""
+        conn = open_connection(db_path)
+        try:
+            try:
+                frequencies = conn.execute(db_queries.TOP_TOKEN_FREQUENCIES.sql, (text_id, limit)).fetchall()
+                length_distribution = conn.execute(db_queries.TOKEN_LENGTHS.sql, (text_id,)).fetchall()
+            except sqlite3.OperationalError:
+                # Database written by an analyzer without the aggregate tables
+                frequencies = length_distribution = []
+            
+            if frequencies:
+                return cls(text_id, frequencies, length_distribution)
+            token_sketch = load_sketch(conn, text_id)
+            if token_sketch is not None:
+                if APPROXIMATE:
+                    return cls(text_id, token_sketch.top(limit), length_distribution, approximate=True)
+                print(f"Text #{text_id} was analyzed with --sketch, counting its tokens exactly (--approx reads the sketch)")
+            return cls.from_tokens(conn, text_id, limit)
+        finally:
+            close_connection(conn)
+
+    @classmethod
+    def from_tokens(cls, conn, text_id, limit=TOP_TOKENS):
+        """Read the token stream of a text once and build every aggregate from it"""
+        try:
+            cursor = conn.execute(db_queries.TOKEN_FREQUENCIES_FROM_TOKENS.sql, (text_id,))
+        except sqlite3.OperationalError:
+            # Database from before the vocabulary table
+            cursor = conn.execute(db_queries.LEGACY_TOKEN_FREQUENCIES_SQL, (text_id,))
+        frequencies = cursor.fetchall()
+
+        # The length histogram falls out of the frequency table,
+        # so the token rows never have to be scanned a second time
+        length_counts = {}
+        for token, frequency in frequencies:
+            length = len(token)
+            length_counts[length] = length_counts.get(length, 0) + frequency
+
+        frequencies.sort(key=lambda row: row[1], reverse=True)
+        return cls(text_id, frequencies[:limit], sorted(length_counts.items()))
+
+    def top_tokens(self, limit):
+        """Return the `limit` most frequent (token, frequency) pairs"""
+        return self.frequencies[:limit]
+
+    def frequency_dict(self):
+        """Return the loaded token frequencies as a dictionary"""
+        return dict(self.frequencies)
+
+    def is_empty(self):
+        return not self.frequencies
+
+    def title(self, name):
+        """Chart title, marked when the counts are estimates"""
+        return f'Text #{self.text_id} {name}' + (' (approx.)' if self.approximate else '')
+
+def load_sketch(conn, text_id):
+    """The stored sketches of a text, None for texts counted exactly"""
+    try:
+        row = conn.execute(db_queries.TEXT_SKETCH.sql, (text_id,)).fetchone()
+    except sqlite3.OperationalError:
+        return None  # database from before the sketches table
+    return sketch.TokenSketch.from_row(text_id, row) if row else None
+
+@timed("query")
+def load_sketches(text_ids, db_path='analysis.db'):
+    """load_sketch for each text id"""
+    conn = open_connection(db_path)
+    try:
+        return [load_sketch(conn, tid) for tid in text_ids]
+    finally:
+        close_connection(conn)
+
+def lookup_tokens(conn, token_ids):
+    """Map vocab ids to their token strings, only for the ids asked for"""
+    rows = conn.execute(db_queries.VOCAB_TOKENS_FOR_IDS.sql, (json.dumps(list(token_ids)),))
+    return dict(rows.fetchall())
+
+@timed("query")
+def load_corpus_top_terms(limit=15, db_path='analysis.db'):
+    """Return (token, term_count, doc_count) rows for the most frequent tokens of the corpus"""
+    conn = open_connection(db_path)
+    try:
+        return conn.execute(db_queries.CORPUS_TOP_TERMS.sql, (limit,)).fetchall()
+    finally:
+        close_connection(conn)
+
+@timed("query")
+def load_tfidf_terms(text_id, limit=15, db_path='analysis.db'):
+    """Return (token, score) for the terms that set a text apart from the rest of the corpus
+
+    score = count * idf, with the smoothed idf = ln((1 + N) / (1 + df)) + 1
+    so terms stay ranked by count in a corpus of one text.
+    """
+    conn = open_connection(db_path)
+    try:
+        documents = conn.execute(db_queries.DOCUMENT_COUNT.sql).fetchone()[0]
+        scored = []
+        for token_id, count, doc_count in conn.execute(db_queries.TEXT_TERM_DOC_COUNTS.sql, (text_id,)):
+            idf = math.log((1 + documents) / (1 + doc_count)) + 1
+            scored.append((count * idf, token_id))
+        scored.sort(reverse=True)
+        scored = scored[:limit]
+        tokens = lookup_tokens(conn, [token_id for _, token_id in scored])
+        return [(tokens[token_id], score) for score, token_id in scored]
+    finally:
+        close_connection(conn)
+
+@timed("query")
+def load_comparison(text_id, other_id, limit=15, db_path='analysis.db'):
+    """Return (token, share_a, share_b) for the top tokens of either text
+
+    Shares are occurrences per 1000 tokens, so texts of different size compare.
+    """
+    conn = open_connection(db_path)
     try:
-        conn = sqlite3.connect('analysis.db')
+        sketches = [load_sketch(conn, tid) for tid in (text_id, other_id)]
+        if any(sketches):
+            if not APPROXIMATE:
+                sketched = text_id if sketches[0] is not None else other_id
+                raise ValueError(f"Text #{sketched} was analyzed with --sketch, compare it with --approx")
+            return approximate_comparison(conn, (text_id, other_id), sketches, limit)
+        
+        totals = {}
+        token_ids = []
+        for index, tid in enumerate((text_id, other_id)):
+            row = conn.execute(db_queries.TEXT_TOKEN_COUNT.sql, (tid,)).fetchone()
+            if row is None or not row[0]:
+                raise ValueError(f"No token data found for text ID {tid}")
+            totals[index] = row[0]
+            for token_id, _ in conn.execute(db_queries.TOP_TOKEN_IDS.sql, (tid, limit)):
+                if token_id not in token_ids:
+                    token_ids.append(token_id)
+        
+        # Counts of the combined top tokens in both texts, a token missing from a text counts 0
+        ids_json = json.dumps(token_ids)
+        counts = []
+        for index, tid in enumerate((text_id, other_id)):
+            found = dict(conn.execute(db_queries.TOKEN_COUNTS_FOR_IDS.sql, (tid, ids_json)).fetchall())
+            counts.append({token_id: found.get(token_id, 0) * 1000 / totals[index] for token_id in token_ids})
         
-        # Query word frequency statistics for the specified text
-        cursor = conn.execute("""
-            SELECT token, COUNT(*) as frequency 
-            FROM tokens 
-            WHERE text_id = ? 
-            GROUP BY token 
-            ORDER BY frequency DESC 
-            LIMIT 15
-        """, (text_id,))
+        tokens = lookup_tokens(conn, token_ids)
+        rows = [(tokens[token_id], counts[0][token_id], counts[1][token_id]) for token_id in token_ids]
+        rows.sort(key=lambda row: max(row[1], row[2]), reverse=True)
+        return rows[:limit]
+    finally:
+        close_connection(conn)
+
+def approximate_comparison(conn, text_ids, sketches, limit):
+    """load_comparison by token string, sketched texts answer from their top tokens and Count-Min estimates"""
+    totals = []
+    tokens = []
+    for tid, token_sketch in zip(text_ids, sketches):
+        row = conn.execute(db_queries.TEXT_TOKEN_COUNT.sql, (tid,)).fetchone()
+        if row is None or not row[0]:
+            raise ValueError(f"No token data found for text ID {tid}")
+        totals.append(row[0])
+        if token_sketch is not None:
+            top = token_sketch.top(limit)
+        else:
+            top = conn.execute(db_queries.TOP_TOKEN_FREQUENCIES.sql, (tid, limit)).fetchall()
+        tokens.extend(token for token, _ in top if token not in tokens)
+    
+    counts = []
+    for tid, token_sketch, total in zip(text_ids, sketches, totals):
+        if token_sketch is not None:
+            found = {token: token_sketch.estimate(token) for token in tokens}
+        else:
+            found = dict(conn.execute(db_queries.TOKEN_COUNTS_FOR_TOKENS.sql, (tid, json.dumps(tokens))).fetchall())
+        counts.append({token: found.get(token, 0) * 1000 / total for token in tokens})
+    
+    rows = [(token, counts[0][token], counts[1][token]) for token in tokens]
+    rows.sort(key=lambda row: max(row[1], row[2]), reverse=True)
+    return rows[:limit]
+
+@timed("query")
+def chart_key(chart, text_ids, params=None, corpus=False, db_path='analysis.db'):
+    """Cache key of a chart over the given texts, corpus charts also depend on every other text
+
+    None when the database has nothing to version the chart by, the chart is then not cached.
+    """
+    conn = open_connection(db_path)
+    try:
+        try:
+            versions = [conn.execute(db_queries.TEXT_DATA_VERSION.sql, (tid,)).fetchone() for tid in text_ids]
+            if corpus:
+                versions.append(conn.execute(db_queries.CORPUS_DATA_VERSION.sql).fetchone())
+        except sqlite3.OperationalError:
+            # Database the analyzer has not migrated yet, without texts.bytes and db_meta
+            try:
+                versions = [conn.execute(db_queries.LEGACY_TEXT_DATA_VERSION_SQL, (tid,)).fetchone() for tid in text_ids]
+                if corpus:
+                    versions.append(conn.execute(db_queries.LEGACY_CORPUS_DATA_VERSION_SQL).fetchone())
+            except sqlite3.OperationalError:
+                return None  # no usable version, the chart is rendered without the cache
+    finally:
+        close_connection(conn)
+    params = dict(params or {}, style=CHART_STYLE_VERSION, db=os.path.abspath(db_path))
+    if APPROXIMATE:
+        params['approx'] = True  # sketched texts draw differently, exact ones only get their own entry
+    return render_cache.make_key(list(text_ids), chart, params, versions)
+
+def cached(cache, output_path, key, label):
+    """Report a chart as saved when the cache already holds it"""
+    if cache is not None and key is not None and cache.fresh(output_path, key):
+        print(f"{label} chart saved as {output_path} (cached)")
+        if recorder is not None:
+            recorder.count("cached")
+        return True
+    return False
+
+@timed("save")
+def save_figure(output_path, **options):
+    """Write the current chart, matplotlib only rasterizes it here"""
+    pyplot().savefig(output_path, **options)
+    if recorder is not None:
+        recorder.count("charts")
+
+def resolve_aggregates(text_id, aggregates):
+    """Accept loaded aggregates, a loader callable, or None to load them now"""
+    if aggregates is None:
+        return TextAggregates.load(text_id)
+    if callable(aggregates):
+        return aggregates()
+    return aggregates
+
+@timed("render")
+def make_word_cloud(freq_dict, width=800, height=400):
+    """Lay out a word cloud from token frequencies"""
+    from wordcloud import WordCloud
+    
+    # Note: WordCloud may have issues with non-English characters on some systems
+    # We'll try to use a suitable font if available
+    font_path = find_cloud_font()
+    options = dict(
+        width=width,
+        height=height,
+        background_color='white',
+        relative_scaling=0.5,
+        max_words=TOP_TOKENS,
+        random_state=42
+    )
+    if font_path:
+        options['font_path'] = font_path
+    return WordCloud(**options).generate_from_frequencies(freq_dict)
+
+def word_cloud_rgba(aggregates, width=800, height=400):
+    """Return a word cloud as a flat float32 RGBA buffer in 0..1, ready for a GUI texture"""
+    import numpy as np
+    rgb = make_word_cloud(aggregates.frequency_dict(), width, height).to_array()
+    rgba = np.ones((rgb.shape[0], rgb.shape[1], 4), dtype=np.float32)
+    rgba[..., :3] = rgb / np.float32(255)
+    return rgba.ravel()
+
+# The generate_* functions print their own errors and return True when the
+# chart file was written or is already cached, False when it was not
+
+@timed("render")
+def generate_word_frequency_chart(text_id, output_dir=".", aggregates=None, cache=None):
+    """Generate word frequency chart"""
+    try:
+        # Use custom output path
+        output_path = os.path.join(output_dir, f'word_frequency_{text_id}.png')
+        key = chart_key('word_frequency', [text_id], {'top': 15}) if cache is not None else None
+        if cached(cache, output_path, key, "Word frequency"):
+            return True
+        plt = pyplot()
+        aggregates = resolve_aggregates(text_id, aggregates)
         
-        data = cursor.fetchall()
+        # Word frequency statistics for the specified text
+        data = aggregates.top_tokens(15)
         if not data:
             print(f"No token data found for text ID {text_id}")
-            return
+            return False
         
         tokens = [row[0] for row in data]
         frequencies = [row[1] for row in data]
@@ -34,7 +420,7 @@ def generate_word_frequency_chart(text_id, output_dir="."):
         bars = plt.bar(range(len(tokens)), frequencies, color='skyblue')
         plt.xlabel('Words')
         plt.ylabel('Frequency')
-        plt.title(f'Text #{text_id} Word Frequency')
+        plt.title(aggregates.title('Word Frequency'))
         plt.xticks(range(len(tokens)), tokens, rotation=45, ha='right')
         
         # Display values on the bars
@@ -43,35 +429,35 @@ def generate_word_frequency_chart(text_id, output_dir="."):
                      str(freq), ha='center', va='bottom')
         
         plt.tight_layout()
-        # Use custom output path
-        output_path = os.path.join(output_dir, f'word_frequency_{text_id}.png')
-        plt.savefig(output_path)
-        plt.show()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
         
-        conn.close()
         print(f"Word frequency chart saved as {output_path}")
+        return True
         
     except Exception as e:
         print(f"Error generating chart: {e}")
+        return False
 
-def generate_token_length_distribution(text_id, output_dir="."):
+@timed("render")
+def generate_token_length_distribution(text_id, output_dir=".", aggregates=None, cache=None):
     """Generate token length distribution chart"""
     try:
-        conn = sqlite3.connect('analysis.db')
-        
-        # Query token length distribution
-        cursor = conn.execute("""
-            SELECT LENGTH(token) as token_length, COUNT(*) as count
-            FROM tokens 
-            WHERE text_id = ?
-            GROUP BY LENGTH(token)
-            ORDER BY token_length
-        """, (text_id,))
+        # Use custom output path
+        output_path = os.path.join(output_dir, f'token_length_distribution_{text_id}.png')
+        key = chart_key('token_length_distribution', [text_id]) if cache is not None else None
+        if cached(cache, output_path, key, "Token length distribution"):
+            return True
+        plt = pyplot()
+        aggregates = resolve_aggregates(text_id, aggregates)
         
-        data = cursor.fetchall()
+        # Token length distribution
+        data = aggregates.length_distribution
         if not data:
             print(f"No token data found for text ID {text_id}")
-            return
+            return False
         
         lengths = [row[0] for row in data]
         counts = [row[1] for row in data]
@@ -84,115 +470,439 @@ def generate_token_length_distribution(text_id, output_dir="."):
         plt.title(f'Text #{text_id} Token Length Distribution')
         plt.grid(True, alpha=0.3)
         plt.tight_layout()
-        # Use custom output path
-        output_path = os.path.join(output_dir, f'token_length_distribution_{text_id}.png')
-        plt.savefig(output_path)
-        plt.show()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
         
-        conn.close()
         print(f"Token length distribution chart saved as {output_path}")
+        return True
         
     except Exception as e:
         print(f"Error generating chart: {e}")
+        return False
 
-def generate_word_cloud(text_id, output_dir="."):
+@timed("render")
+def generate_word_cloud(text_id, output_dir=".", aggregates=None, cache=None):
     """Generate word cloud chart"""
     try:
-        conn = sqlite3.connect('analysis.db')
-        
-        # Query word frequency for word cloud
-        cursor = conn.execute("""
-            SELECT token, COUNT(*) as frequency 
-            FROM tokens 
-            WHERE text_id = ? 
-            GROUP BY token 
-            ORDER BY frequency DESC
-        """, (text_id,))
+        output_path = os.path.join(output_dir, f'word_cloud_{text_id}.png')
+        key = chart_key('word_cloud', [text_id], {'max_words': TOP_TOKENS, 'dpi': 300}) if cache is not None else None
+        if cached(cache, output_path, key, "Word cloud"):
+            return True
+        plt = pyplot()
+        aggregates = resolve_aggregates(text_id, aggregates)
         
-        data = cursor.fetchall()
-        if not data:
+        if aggregates.is_empty():
             print(f"No token data found for text ID {text_id}")
-            return
+            return False
         
         # Create frequency dictionary for word cloud
-        freq_dict = {row[0]: row[1] for row in data}
+        freq_dict = aggregates.frequency_dict()
         
         # Generate word cloud
-        # Note: WordCloud may have issues with non-English characters on some systems
-        # We'll try to use a suitable font if available
         try:
-            # Try to find a suitable font
-            font_path = None
-            try:
-                # For Windows systems, try to use SimHei font for Chinese characters
-                font_names = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS', 'DejaVu Sans']
-                for font_name in font_names:
-                    try:
-                        font_path = fm.findfont(fm.FontProperties(family=font_name))
-                        if font_path and os.path.exists(font_path):
-                            break
-                    except:
-                        continue
-            except:
-                pass
-            
-            if font_path and os.path.exists(font_path):
-                wordcloud = WordCloud(
-                    width=800, 
-                    height=400, 
-                    background_color='white',
-                    font_path=font_path,
-                    relative_scaling=0.5,
-                    random_state=42
-                )
-            else:
-                wordcloud = WordCloud(
-                    width=800, 
-                    height=400, 
-                    background_color='white',
-                    relative_scaling=0.5,
-                    random_state=42
-                )
-                
-            wordcloud.generate_from_frequencies(freq_dict)
+            wordcloud = make_word_cloud(freq_dict)
             
             # Create word cloud plot
             plt.figure(figsize=(12, 6))
             plt.imshow(wordcloud, interpolation='bilinear')
             plt.axis('off')
-            plt.title(f'Text #{text_id} Word Cloud')
+            plt.title(aggregates.title('Word Cloud'))
             
             # Save word cloud
-            output_path = os.path.join(output_dir, f'word_cloud_{text_id}.png')
             plt.tight_layout()
-            plt.savefig(output_path, dpi=300, bbox_inches='tight')
-            plt.show()
+            save_figure(output_path, dpi=300, bbox_inches='tight')
+            if key is not None:
+                cache.store(output_path, key)
+            finish_figure()
             
-            conn.close()
             print(f"Word cloud chart saved as {output_path}")
+            return True
         except Exception as wc_error:
-            conn.close()
             print(f"Error generating word cloud: {wc_error}")
             print("Note: This might be due to missing fonts or unsupported characters.")
+            return False
             
     except Exception as e:
         print(f"Error preparing word cloud data: {e}")
+        return False
+
+@timed("render")
+def generate_corpus_frequency_chart(output_dir=".", cache=None):
+    """Generate word frequency chart over every analyzed text"""
+    try:
+        output_path = os.path.join(output_dir, 'corpus_word_frequency.png')
+        key = chart_key('corpus_word_frequency', [], {'top': 15}, corpus=True) if cache is not None else None
+        if cached(cache, output_path, key, "Corpus word frequency"):
+            return True
+        plt = pyplot()
+        data = load_corpus_top_terms(15)
+        if not data:
+            print("No token data found in the corpus")
+            return False
+        
+        tokens = [row[0] for row in data]
+        frequencies = [row[1] for row in data]
+        
+        plt.figure(figsize=(12, 6))
+        bars = plt.bar(range(len(tokens)), frequencies, color='steelblue')
+        plt.xlabel('Words')
+        plt.ylabel('Frequency')
+        plt.title('Corpus Word Frequency')
+        plt.xticks(range(len(tokens)), tokens, rotation=45, ha='right')
+        
+        # Display values on the bars
+        for bar, freq in zip(bars, frequencies):
+            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.1, 
+                     str(freq), ha='center', va='bottom')
+        
+        plt.tight_layout()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
+        
+        print(f"Corpus word frequency chart saved as {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"Error generating chart: {e}")
+        return False
+
+@timed("render")
+def generate_tfidf_chart(text_id, output_dir=".", cache=None):
+    """Generate TF-IDF top terms chart for one text"""
+    try:
+        output_path = os.path.join(output_dir, f'tfidf_{text_id}.png')
+        key = chart_key('tfidf', [text_id], {'top': 15}, corpus=True) if cache is not None else None
+        if cached(cache, output_path, key, "TF-IDF"):
+            return True
+        plt = pyplot()
+        data = load_tfidf_terms(text_id, 15)
+        if not data:
+            print(f"No token data found for text ID {text_id}")
+            return False
+        
+        # Highest score on top
+        tokens = [row[0] for row in reversed(data)]
+        scores = [row[1] for row in reversed(data)]
+        
+        plt.figure(figsize=(10, 6))
+        plt.barh(range(len(tokens)), scores, color='darkorange')
+        plt.yticks(range(len(tokens)), tokens)
+        plt.xlabel('TF-IDF')
+        plt.title(f'Text #{text_id} Top TF-IDF Terms')
+        plt.tight_layout()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
+        
+        print(f"TF-IDF chart saved as {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"Error generating chart: {e}")
+        return False
+
+@timed("render")
+def generate_comparison_chart(text_id, other_id, output_dir=".", cache=None):
+    """Generate a side by side word frequency chart of two texts"""
+    try:
+        output_path = os.path.join(output_dir, f'compare_{text_id}_{other_id}.png')
+        key = chart_key('compare', [text_id, other_id], {'top': 15}) if cache is not None else None
+        if cached(cache, output_path, key, "Comparison"):
+            return True
+        plt = pyplot()
+        data = load_comparison(text_id, other_id, 15)
+        if not data:
+            print(f"No token data found for text IDs {text_id} and {other_id}")
+            return False
+        
+        import numpy as np
+        tokens = [row[0] for row in data]
+        positions = np.arange(len(tokens))
+        width = 0.4
+        
+        plt.figure(figsize=(12, 6))
+        plt.bar(positions - width/2, [row[1] for row in data], width, label=f'Text #{text_id}', color='skyblue')
+        plt.bar(positions + width/2, [row[2] for row in data], width, label=f'Text #{other_id}', color='salmon')
+        plt.xlabel('Words')
+        plt.ylabel('Occurrences per 1000 tokens')
+        approximate = APPROXIMATE and any(load_sketches([text_id, other_id]))
+        plt.title(f'Text #{text_id} vs Text #{other_id} Word Frequency' + (' (approx.)' if approximate else ''))
+        plt.xticks(positions, tokens, rotation=45, ha='right')
+        plt.legend()
+        plt.tight_layout()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
+        
+        print(f"Comparison chart saved as {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"Error generating chart: {e}")
+        return False
+
+@timed("query")
+def load_distributions(text_id, db_path='analysis.db'):
+    """Length histogram and frequency spectrum of a text, its statistics are stored on the way"""
+    import text_stats
+    conn = open_connection(db_path)
+    try:
+        return text_stats.compute(conn, text_id)
+    finally:
+        close_connection(conn)
+
+def resolve_distributions(text_id, distributions):
+    """Accept (stats, distributions), a loader callable, or None to load them now"""
+    if distributions is None:
+        return load_distributions(text_id)
+    if callable(distributions):
+        return distributions()
+    return distributions
+
+@timed("render")
+def generate_length_histogram(text_id, output_dir=".", distributions=None, cache=None, bins=None):
+    """Generate token length histogram with the stored percentiles marked"""
+    try:
+        output_path = os.path.join(output_dir, f'length_histogram_{text_id}.png')
+        key = chart_key('length_histogram', [text_id], {'bins': bins}) if cache is not None else None
+        if cached(cache, output_path, key, "Length histogram"):
+            return True
+        plt = pyplot()
+        stats, distributions = resolve_distributions(text_id, distributions)
+        if stats.tokens == 0:
+            print(f"No token data found for text ID {text_id}")
+            return False
+        
+        counts, edges = distributions.length_histogram(bins)
+        plt.figure(figsize=(10, 6))
+        plt.bar(edges[:-1], counts, width=edges[1:] - edges[:-1], align='edge', color='seagreen', edgecolor='white')
+        for value, label, style in ((stats.median_len, 'median', '-'), (stats.p90_len, 'p90', '--'), (stats.p99_len, 'p99', ':')):
+            plt.axvline(value, color='black', linestyle=style, label=f'{label} {value}')
+        plt.xlabel('Token Length')
+        plt.ylabel('Count')
+        plt.title(f'Text #{text_id} Token Length Histogram (mean {stats.mean_len:.2f}, sd {stats.len_stddev:.2f})')
+        plt.legend()
+        plt.grid(True, axis='y', alpha=0.3)
+        plt.tight_layout()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
+        
+        print(f"Length histogram chart saved as {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"Error generating chart: {e}")
+        return False
+
+@timed("render")
+def generate_zipf_chart(text_id, output_dir=".", distributions=None, cache=None):
+    """Generate rank-frequency chart on log-log axes with the fitted Zipf line"""
+    try:
+        output_path = os.path.join(output_dir, f'zipf_{text_id}.png')
+        key = chart_key('zipf', [text_id]) if cache is not None else None
+        if cached(cache, output_path, key, "Zipf"):
+            return True
+        plt = pyplot()
+        stats, distributions = resolve_distributions(text_id, distributions)
+        if stats.zipf_exponent is None:
+            print(f"No token frequencies to fit for text ID {text_id}")
+            return False
+        
+        # Every rank would be millions of points for a large text, log-spaced ones draw the same curve
+        ranks, frequencies = distributions.rank_frequency(1000)
+        plt.figure(figsize=(10, 6))
+        plt.loglog(ranks, frequencies, marker='.', linestyle='none', color='steelblue', label='tokens')
+        plt.loglog(ranks, distributions.zipf_line(ranks), color='crimson',
+                   label=f'fit: exponent {stats.zipf_exponent:.2f}, r2 {stats.zipf_r2:.3f}')
+        plt.xlabel('Rank')
+        plt.ylabel('Frequency')
+        plt.title(f'Text #{text_id} Rank-Frequency (entropy {stats.entropy:.2f} bits, '
+                  f'type/token {stats.type_token_ratio:.3f}, hapax {stats.hapax_ratio:.2f})')
+        plt.legend()
+        plt.grid(True, which='both', alpha=0.3)
+        plt.tight_layout()
+        save_figure(output_path)
+        if key is not None:
+            cache.store(output_path, key)
+        finish_figure()
+        
+        print(f"Zipf chart saved as {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"Error generating chart: {e}")
+        return False
+
+@timed("query")
+def text_exists(text_id, db_path='analysis.db'):
+    conn = open_connection(db_path)
+    try:
+        return conn.execute(db_queries.TEXT_EXISTS.sql, (text_id,)).fetchone()[0] > 0
+    finally:
+        close_connection(conn)
+
+def parse_id_ranges(spec, db_path='analysis.db'):
+    """db_access.parse_id_ranges, "all" read through this process' connection"""
+    if spec != "all":
+        return db_access.parse_id_ranges(spec)
+    conn = open_connection(db_path)
+    try:
+        return db_access.parse_id_ranges(spec, conn)
+    finally:
+        close_connection(conn)
+
+def init_batch_worker(db_path, collect_metrics=False, approximate=False):
+    """Set up a batch worker process: off screen rendering and one database connection"""
+    global SHOW_FIGURES, _worker_db, recorder, APPROXIMATE
+    SHOW_FIGURES = False
+    APPROXIMATE = approximate
+    _worker_db = (db_path, sqlite3.connect(db_path))
+    recorder = metrics.StageMetrics("vis worker") if collect_metrics else None
+
+def render_text_charts(text_id, output_dir):
+    """Render every per-text chart of one text
+
+    Returns (text_id, error or None, metrics report or None, render cache hits).
+    """
+    if recorder is not None:
+        recorder.reset()
+    error = None
+    cache = _worker_caches.get(output_dir)
+    if cache is None:
+        cache = _worker_caches[output_dir] = render_cache.RenderCache(output_dir)
+    try:
+        if not text_exists(text_id):
+            raise ValueError("text not found")
+        loaded = []
+        
+        def aggregates():
+            if not loaded:
+                loaded.append(TextAggregates.load(text_id))
+            return loaded[0]
+        
+        charts = [
+            ('word frequency', generate_word_frequency_chart, f'word_frequency_{text_id}.png'),
+            ('token length distribution', generate_token_length_distribution, f'token_length_distribution_{text_id}.png'),
+            ('word cloud', generate_word_cloud, f'word_cloud_{text_id}.png'),
+        ]
+        failed = [name for name, generate, file_name in charts
+                  if not generate(text_id, output_dir, aggregates, cache)
+                  or not os.path.exists(os.path.join(output_dir, file_name))]
+        if failed:
+            error = "no " + ", ".join(failed) + " chart written"
+    except Exception as e:
+        error = str(e)
+    return text_id, error, recorder.report() if recorder is not None else None, cache.hits()
+
+def run_batch(text_ids, output_dir, workers=None, db_path='analysis.db'):
+    """Render the charts of many texts on a process pool, returns the failed ids"""
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    failed = []
+    start = time.perf_counter()
+    initargs = (db_path, recorder is not None, APPROXIMATE)
+    cache = render_cache.RenderCache(output_dir)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=initargs) as pool:
+        # Hand ids out in chunks so workers are not fed one pickle round trip per text
+        chunksize = max(1, len(text_ids) // (workers * 8))
+        results = pool.map(render_text_charts, text_ids, [output_dir] * len(text_ids), chunksize=chunksize)
+        for done, (text_id, error, report, hits) in enumerate(results, 1):
+            if report is not None:
+                worker_reports.append(report)
+            cache.touch(hits)
+            if error is not None:
+                failed.append(text_id)
+                print(f"Text ID {text_id} failed: {error}")
+            if done % 100 == 0:
+                print(f"{done}/{len(text_ids)} texts rendered")
+    cache.close()  # the hits of every worker in one write
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Rendered {len(text_ids)} texts ({len(failed)} failed) in {elapsed:.1f} s, {len(text_ids) / elapsed:.1f} texts/s")
+    return failed
+
+def usage():
+    print("Usage: python vis.py <text_id> [output_dir]")
+    print("       python vis.py --tfidf <text_id> [output_dir]")
+    print("       python vis.py --compare <text_id> <other_id> [output_dir]")
+    print("       python vis.py --corpus [output_dir]")
+    print("       python vis.py --batch <ids> [output_dir] [--workers=N]")
+    print("       python vis.py --stats <text_id> [output_dir] [--bins=N]")
+    print("  --metrics=FILE: write stage timings as JSON, - for stderr (default $VIS_METRICS)")
+    print("  --approx: chart texts analyzed with --sketch from their sketches, in bounded memory")
+    print("  ids: comma separated ids and ranges such as 1-100,205, or all")
+    print("  text_id: ID of the text to visualize")
+    print("  output_dir: Directory to save charts (optional, defaults to current directory)")
+    sys.exit(1)
+
+def write_metrics(path):
+    """Write the run's metrics, the batch workers' reports are summed under workers"""
+    report = recorder.report()
+    if worker_reports:
+        report["workers"] = metrics.merge_reports(worker_reports, "vis workers")
+    try:
+        metrics.write_report(report, path)
+    except OSError as e:
+        print(f"Warning: failed to write metrics to {path}: {e}")
 
 def main():
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: python vis.py <text_id> [output_dir]")
-        print("  text_id: ID of the text to visualize")
-        print("  output_dir: Directory to save charts (optional, defaults to current directory)")
-        sys.exit(1)
+    global recorder, APPROXIMATE
+    args = sys.argv[1:]
+    if "--approx" in args:
+        args.remove("--approx")
+        APPROXIMATE = True
+    metrics_path = os.environ.get("VIS_METRICS")
+    for arg in [arg for arg in args if arg.startswith("--metrics=")]:
+        args.remove(arg)
+        metrics_path = arg.split("=", 1)[1]
+    if metrics_path:
+        # Written on every exit, including the sys.exit() of a failed run
+        recorder = metrics.StageMetrics("vis")
+        atexit.register(write_metrics, metrics_path)
+    mode = args.pop(0) if args and args[0].startswith("--") else None
+    workers = None
+    if mode == "--batch":
+        for arg in [arg for arg in args if arg.startswith("--workers=")]:
+            args.remove(arg)
+            try:
+                workers = int(arg.split("=", 1)[1])
+            except ValueError:
+                print("Error: --workers must be an integer")
+                sys.exit(1)
+    bins = None
+    if mode == "--stats":
+        for arg in [arg for arg in args if arg.startswith("--bins=")]:
+            args.remove(arg)
+            try:
+                bins = int(arg.split("=", 1)[1])
+            except ValueError:
+                print("Error: --bins must be an integer")
+                sys.exit(1)
+    id_count = {None: 1, "--tfidf": 1, "--compare": 2, "--corpus": 0, "--batch": 1, "--stats": 1}.get(mode)
+    if id_count is None or not id_count <= len(args) <= id_count + 1:
+        usage()
     
     try:
-        text_id = int(sys.argv[1])
-    except ValueError:
-        print("Error: text_id must be an integer")
+        if mode == "--batch":
+            ids = parse_id_ranges(args[0])
+        else:
+            ids = [int(arg) for arg in args[:id_count]]
+    except ValueError as e:
+        print(f"Error: {e}" if mode == "--batch" else "Error: text_id must be an integer")
+        sys.exit(1)
+    except sqlite3.Error as e:
+        print(f"Error reading text ids: {e}")
         sys.exit(1)
     
     # Get output directory (if provided)
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else "."
+    output_dir = args[id_count] if len(args) > id_count else "."
     
     # Ensure output directory exists
     if not os.path.exists(output_dir):
@@ -202,11 +912,76 @@ def main():
             print(f"Error: Failed to create output directory '{output_dir}': {e}")
             sys.exit(1)
     
+    if mode == "--batch":
+        if run_batch(ids, output_dir, workers):
+            sys.exit(1)
+        return
+    
+    # Charts already rendered from the same data are reused
+    cache = render_cache.RenderCache(output_dir)
+    atexit.register(cache.close)
+    
+    if mode == "--corpus":
+        if not generate_corpus_frequency_chart(output_dir, cache):
+            sys.exit(1)
+        return
+    
+    try:
+        missing = [text_id for text_id in ids if not text_exists(text_id)]
+    except sqlite3.Error as e:
+        print(f"Error reading the database: {e}")
+        sys.exit(1)
+    if missing:
+        print(f"Error: text ID {missing[0]} not found")
+        sys.exit(1)
+    
+    if mode == "--tfidf":
+        if not generate_tfidf_chart(ids[0], output_dir, cache):
+            sys.exit(1)
+        return
+    if mode == "--compare":
+        if not generate_comparison_chart(ids[0], ids[1], output_dir, cache):
+            sys.exit(1)
+        return
+    if mode == "--stats":
+        import text_stats
+        try:
+            loaded = load_distributions(ids[0])
+        except Exception as e:
+            print(f"Error computing statistics: {e}")
+            sys.exit(1)
+        print(text_stats.format_stats(loaded[0]))
+        written = [generate_length_histogram(ids[0], output_dir, loaded, cache, bins)]
+        if loaded[0].tokens and loaded[0].distinct_tokens is None:
+            print(f"Text #{ids[0]} was analyzed with --sketch and keeps no exact frequencies, skipping the Zipf chart")
+        else:
+            written.append(generate_zipf_chart(ids[0], output_dir, loaded, cache))
+        if not all(written):
+            sys.exit(1)
+        return
+    
+    text_id = ids[0]
     print(f"Generating visualization charts for text ID {text_id}...")
     print(f"Charts will be saved to: {os.path.abspath(output_dir)}")
-    generate_word_frequency_chart(text_id, output_dir)
-    generate_token_length_distribution(text_id, output_dir)
-    generate_word_cloud(text_id, output_dir)
+    
+    # Read the tokens once and share the aggregates between all charts,
+    # nothing is read when every chart comes from the cache
+    loaded = []
+    
+    def aggregates():
+        if not loaded:
+            try:
+                loaded.append(TextAggregates.load(text_id))
+            except Exception as e:
+                print(f"Error loading token data: {e}")
+                sys.exit(1)
+        return loaded[0]
+    
+    written = [generate_word_frequency_chart(text_id, output_dir, aggregates, cache),
+               generate_token_length_distribution(text_id, output_dir, aggregates, cache),
+               generate_word_cloud(text_id, output_dir, aggregates, cache)]
+    if not all(written):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file